@@ -1,13 +1,88 @@
+import os
 import stategraph
 import logging
 import gradio as gr
+from config import get_config
+from registry import registry
+from query_cache import QueryCache, normalize_question
+from query_result import pagers
+from single_flight import SingleFlight
+from tracing import span
 
-def process_message(user_message, history):
-    state = graph.invoke({
-    "question": user_message
-    })
-    history += [(user_message, state['response'])]
-    return "", history
+# A shared link makes many users ask the same question at once; they all follow one graph run
+question_flights = SingleFlight("question")
+
+def question_key(user_message):
+    """Identical text against the same schema and data gets the same answer"""
+    query_cache = registry.get("query_cache", lambda: QueryCache(get_config().db))
+    return (normalize_question(user_message), *query_cache.versions())
+
+def page_table(page):
+    """Convert a QueryResult page into a Dataframe value"""
+    return {"headers": page.columns, "data": [list(row) for row in page.rows()]}
+
+async def process_message(user_message, history):
+    history = history + [(user_message, "")]
+    progress = []  # Plan and step updates shown until the first response token arrives
+    answer = ""
+    step_queries = {}
+
+    # One run streams three kinds of events: progress, LLM tokens and full state values
+    # The request span is the parent of every node, step, LLM and database span of this run
+    with span("request", kind="request", question=user_message):
+        async for mode, payload in question_flights.astream(question_key(user_message), lambda: graph.astream(
+            {"question": user_message},
+            stream_mode=["custom", "messages", "values"]
+        )):
+            if mode == "custom" and not answer:
+                if payload["event"] == "plan":
+                    steps = [step for step in payload["steps"] if step.startswith("Inference:")]
+                    progress.append(f"📋 Plan ready: {len(steps)} database step(s)")
+                elif payload["event"] == "step":
+                    mark = "✅" if payload["ok"] else "⚠️"
+                    progress.append(f"{mark} {payload['step']}")
+                history[-1] = (user_message, "\n".join(progress))
+                yield "", history, gr.update(), gr.update(), gr.update(), {}
+
+            elif mode == "messages":
+                # Only tokens of the final answer are streamed, not the classifier's or planner's
+                chunk, metadata = payload
+                if metadata.get("langgraph_node") == "generate_response" and chunk.content:
+                    answer += chunk.content
+                    history[-1] = (user_message, answer)
+                    yield "", history, gr.update(), gr.update(), gr.update(), {}
+
+            elif mode == "values":
+                answer = payload.get("response") or answer
+                step_queries = payload.get("step_queries") or step_queries
+
+    history[-1] = (user_message, answer)
+
+    # Each truncated step gets its own pager, a server-side cursor over the SQL the guardrail already checked
+    if not step_queries:
+        yield "", history, gr.update(value=None, visible=False), gr.update(visible=False), \
+            gr.update(choices=[], value=None, visible=False), {}
+        return
+    config = get_config()
+    handles = {step: pagers.open(config.read_pool, sql, timeout=config.query_guard.timeout)
+               for step, sql in step_queries.items()}
+    first = next(iter(handles))
+    yield "", history, gr.update(value=page_table(pagers.get(handles[first]).next_page()), visible=True), \
+        gr.update(visible=True), gr.update(choices=list(handles), value=first, visible=len(handles) > 1), handles
+
+def show_step(handles, step):
+    """Show the page a step's pager is on, or its first page"""
+    pager = pagers.get(handles.get(step)) if handles and step else None
+    if pager is None:
+        return gr.update()
+    return gr.update(value=page_table(pager.last if pager.last is not None else pager.next_page()))
+
+def next_page(handles, step):
+    pager = pagers.get(handles.get(step)) if handles and step else None
+    if pager is None or pager.exhausted:
+        return gr.update()
+    page = pager.next_page()
+    return gr.update(value=page_table(page)) if len(page) else gr.update()
 
 with gr.Blocks(theme=gr.themes.Monochrome()) as app:
     gr.Markdown("<h2 align='center'>AI Database Explorer</h2><p align='center'>Talk to a database in your language</p>")
@@ -16,11 +91,23 @@ with gr.Blocks(theme=gr.themes.Monochrome()) as app:
     with gr.Row():
         entry = gr.Textbox(label="Chat with our AI DB Assistant:")
     with gr.Row():
+        result_step = gr.Dropdown(label="Result of step", choices=[], visible=False, interactive=True)
+    with gr.Row():
+        results = gr.Dataframe(label="Full query result", visible=False, interactive=False)
+    with gr.Row():
+        more = gr.Button("Next page", visible=False)
         clear = gr.Button("Clear")
+    pager_handles = gr.State({})  # Step text -> pager handle
 
-    entry.submit(process_message, inputs=[entry, chatbot], outputs=[entry, chatbot])
+    entry.submit(process_message, inputs=[entry, chatbot],
+                 outputs=[entry, chatbot, results, more, result_step, pager_handles])
+    result_step.change(show_step, inputs=[pager_handles, result_step], outputs=results)
+    more.click(next_page, inputs=[pager_handles, result_step], outputs=results)
     clear.click(lambda: None, inputs=None, outputs=chatbot, queue=False)
 
+# Number of sessions a worker serves at once; the handler is async, so waiting on the LLM does not block others
+app.queue(default_concurrency_limit=int(os.getenv("GRADIO_CONCURRENCY_LIMIT", "8")))
+
 if __name__ == "__main__":
     # Configure the main logger
     logging.basicConfig(
@@ -38,7 +125,3 @@ if __name__ == "__main__":
     graph = stategraph.create_graph()
 
     app.launch()
-
-
-
-
@@ -0,0 +1,522 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import re
+import resource
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import Field, PrivateAttr
+from schema_introspector import SchemaIntrospector
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CORPUS = os.path.join(SRC_DIR, "data", "benchmark_corpus.json")
+DEFAULT_SOURCE_DB = os.path.join(SRC_DIR, "data", "chinook.db")
+DEFAULT_SYNONYMS = os.path.join(SRC_DIR, "data", "chinook_synonyms.json")  # Every variant is built from Chinook
+DEFAULT_DATA_DIR = os.path.join(SRC_DIR, ".cache", "benchmark")
+
+# Pipeline stage -> (marker in the prompt, pattern extracting the replay key; None keys on the last message)
+STAGES = [
+    ("classify", "You are an input classifier", None),
+    ("plan", "friendly planning agent", re.compile(r"Question: (.*?)\n\nCreate a focused plan", re.DOTALL)),
+    ("sql", "You write a single SQLite query", None),
+    ("agent", "database inference expert", re.compile(r"User Question: (.*)")),
+    ("response", "response coordinator", re.compile(r"Original Question: (.*)")),
+    ("chat", "friendly AI assistant", re.compile(r"(?!)")),  # Chat replies share one key
+]
+
+# Replies for prompts missing from the corpus; every miss is counted in the report
+FALLBACKS = {
+    "classify": "DATABASE_QUERY",
+    "plan": "Inference: {key}\nGeneral: Provide the results in a friendly way",
+    "sql": "SELECT 1",
+    "agent": "Query Executed: none\nResults: []\nSummary: No recorded answer.",
+    "response": "No recorded answer.",
+    "chat": "Hello!",
+    "unknown": "No recorded answer.",
+}
+
+
+def prompt_stage(messages: list) -> tuple:
+    """(stage, replay key) for a prompt, recognised by the system prompt of each pipeline stage"""
+    text = "\n".join(str(message.content) for message in messages)
+    # Prompts formatted to a single string carry the human turn after a "Human: " label
+    last = str(messages[-1].content).rsplit("Human: ", 1)[-1].strip() if messages else ""
+    for stage, marker, pattern in STAGES:
+        if marker in text:
+            if pattern is None:
+                return stage, last
+            match = pattern.search(text)
+            return stage, match.group(1).strip() if match else ""
+    return "unknown", last
+
+
+class ReplayChatModel(BaseChatModel):
+    """Deterministic stand-in LLM replaying recorded responses with a simulated latency.
+
+    With a `recorder` model, prompts missing from the corpus are sent to it and its answers are kept,
+    so a run against the real provider records a corpus for later offline runs.
+    """
+
+    responses: dict  # stage -> replay key -> response text
+    latency_ms: float = 0.0  # Time to the first token
+    token_ms: float = 0.0  # Time per further output token when streaming
+    model: str = "replay"
+    recorder: Any = None
+    calls: dict = Field(default_factory=dict)  # stage -> number of calls
+    misses: dict = Field(default_factory=dict)  # stage -> prompts answered by a fallback
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"model": self.model}
+
+    def reply(self, messages: list) -> str:
+        stage, key = prompt_stage(messages)
+        with self._lock:
+            self.calls[stage] = self.calls.get(stage, 0) + 1
+            text = self.responses.get(stage, {}).get(key)
+        if text is None and self.recorder is not None:
+            text = self.recorder.invoke(messages).content
+            with self._lock:
+                self.responses.setdefault(stage, {})[key] = text
+        if text is None:
+            with self._lock:
+                self.misses[stage] = self.misses.get(stage, 0) + 1
+            logger.warning(f"No recorded {stage} response for {key[:80]!r}")
+            text = FALLBACKS[stage].format(key=key)
+        return text
+
+    @staticmethod
+    def usage(messages: list, text: str) -> dict:
+        # Rough token counts so the tracer records usage as it would for a provider
+        tokens_in = sum(len(str(m.content)) for m in messages) // 4
+        tokens_out = max(len(text) // 4, 1)
+        return {"input_tokens": tokens_in, "output_tokens": tokens_out, "total_tokens": tokens_in + tokens_out}
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        text = self.reply(messages)
+        time.sleep((self.latency_ms + self.token_ms * len(text.split())) / 1000)
+        message = AIMessage(content=text, usage_metadata=self.usage(messages, text))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        text = self.reply(messages)
+        time.sleep(self.latency_ms / 1000)
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(self.token_ms / 1000)
+            last = i == len(words) - 1
+            piece = word if last else word + " "
+            # Usage is reported once, on the last chunk
+            usage = self.usage(messages, text) if last else None
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece, usage_metadata=usage))
+            yield chunk
+
+
+def load_corpus(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        corpus = json.load(f)
+    corpus.setdefault("responses", {})
+    return corpus
+
+
+def save_corpus(path: str, corpus: dict):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(corpus, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+
+
+def table_ddl(table: dict, prefix: str = "") -> str:
+    """CREATE TABLE for an introspected table, with references redirected to the prefixed copies"""
+    quote = SchemaIntrospector.quote
+    lines = [f"{quote(c['columnName'])} {c['columnType'] or ''}{'' if c['isOptional'] else ' NOT NULL'}".rstrip()
+             for c in table["columns"]]
+    if table["primaryKey"]:
+        lines.append(f"PRIMARY KEY ({', '.join(quote(c) for c in table['primaryKey'])})")
+    for column in table["columns"]:
+        reference = column["foreignKeyReference"]
+        if reference:
+            lines.append(f"FOREIGN KEY ({quote(column['columnName'])}) REFERENCES "
+                         f"{quote(prefix + reference['table'])} ({quote(reference['column'])})")
+    return f"CREATE TABLE {quote(prefix + table['tableName'])} (\n    " + ",\n    ".join(lines) + "\n)"
+
+
+def build_scaled_copy(source: str, target: str, row_factor: int = 1, schema_copies: int = 1):
+    """Write a copy of the source database with every table's rows repeated row_factor times
+    and the whole schema repeated schema_copies times under "sNNN_" prefixes.
+
+    Integer keys are shifted by the parent table's largest key in every repetition, so primary keys stay
+    unique and foreign keys keep pointing at rows of the same repetition.
+    """
+    started = time.perf_counter()
+    tables = SchemaIntrospector(source).introspect()
+    quote = SchemaIntrospector.quote
+    conn = sqlite3.connect(f"file:{target}", uri=True)
+    try:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("ATTACH DATABASE ? AS source", (f"file:{source}?mode=ro",))
+
+        # Largest integer key of each table with a single-column primary key
+        max_keys = {}
+        for table in tables:
+            if len(table["primaryKey"]) == 1:
+                key = table["primaryKey"][0]
+                value = conn.execute(f"SELECT MAX({quote(key)}) FROM source.{quote(table['tableName'])}").fetchone()[0]
+                if isinstance(value, int):
+                    max_keys[table["tableName"]] = (key, value)
+
+        def shift(table: dict, column: dict):
+            """Table whose key range the column follows, or None for plain data columns"""
+            reference = column["foreignKeyReference"]
+            if reference and max_keys.get(reference["table"], (None,))[0] == reference["column"]:
+                return reference["table"]
+            if max_keys.get(table["tableName"], (None,))[0] == column["columnName"]:
+                return table["tableName"]
+            return None
+
+        for copy in range(schema_copies):
+            prefix = f"s{copy:03d}_" if copy else ""
+            for table in tables:
+                name = table["tableName"]
+                conn.execute(table_ddl(table, prefix))
+                for repetition in range(row_factor):
+                    expressions = []
+                    for column in table["columns"]:
+                        parent = shift(table, column)
+                        expression = quote(column["columnName"])
+                        if parent and repetition:
+                            expression = f"{expression} + {repetition * max_keys[parent][1]}"
+                        expressions.append(expression)
+                    conn.execute(f"INSERT INTO {quote(prefix + name)} SELECT {', '.join(expressions)} "
+                                 f"FROM source.{quote(name)}")
+                for index in table["indexes"]:
+                    if index["origin"] == "c":
+                        columns = ", ".join(quote(c) for c in index["columns"])
+                        conn.execute(f"CREATE {'UNIQUE ' if index['unique'] else ''}INDEX "
+                                     f"{quote(prefix + index['name'])} ON {quote(prefix + name)} ({columns})")
+            conn.commit()
+
+        # Fresh statistics, as the guard and planner read row counts from sqlite_stat1
+        conn.execute("DETACH DATABASE source")
+        conn.execute("ANALYZE main")
+        conn.commit()
+    finally:
+        conn.close()
+    logger.info(f"Built {target} (x{row_factor} rows, {len(tables) * schema_copies} tables) in "
+                f"{time.perf_counter() - started:.1f} s")
+
+
+def prepare_variants(source: str, data_dir: str, scales: list, wide: int) -> list:
+    """(name, path) of every database to benchmark, building missing scaled copies"""
+    os.makedirs(data_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(source))[0]
+    variants = []
+    specs = [(f"x{scale}", scale, 1) for scale in scales] + ([(f"w{wide}", 1, wide)] if wide > 1 else [])
+    for suffix, row_factor, schema_copies in specs:
+        if row_factor == 1 and schema_copies == 1:
+            variants.append((f"{stem}-{suffix}", source))
+            continue
+        path = os.path.join(data_dir, f"{stem}-{suffix}.db")
+        if not os.path.exists(path):
+            partial = path + ".partial"
+            if os.path.exists(partial):
+                os.remove(partial)
+            build_scaled_copy(source, partial, row_factor, schema_copies)
+            os.replace(partial, path)
+        variants.append((f"{stem}-{suffix}", path))
+    return variants
+
+
+class SpanCollector:
+    """In-memory replacement for the trace exporter."""
+
+    def __init__(self):
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def export(self, span):
+        with self.lock:
+            self.spans.append(span.to_dict())
+
+    def drain(self) -> list:
+        with self.lock:
+            spans, self.spans = self.spans, []
+        return spans
+
+
+def percentiles(values: list) -> dict:
+    """Count and nearest-rank p50/p95/p99 of a list of milliseconds"""
+    ordered = sorted(values)
+    if not ordered:
+        return {"count": 0}
+
+    def rank(p):
+        return round(ordered[min(len(ordered) - 1, max(0, int(-(-p * len(ordered) // 100)) - 1))], 3)
+
+    return {"count": len(ordered), "p50": rank(50), "p95": rank(95), "p99": rank(99),
+            "max": round(ordered[-1], 3)}
+
+
+def summarize_pass(spans: list, questions: list, wall_seconds: float) -> dict:
+    """Throughput, latency percentiles per span group and LLM calls per question for one pass"""
+    requests = {s["trace_id"]: s for s in spans if s["kind"] == "request"}
+    groups = {}
+    llm_calls = {trace_id: 0 for trace_id in requests}
+    for s in spans:
+        if s["kind"] == "request":
+            continue
+        key = f"{s['kind']}:{s['name']}"
+        groups.setdefault(key, []).append(s["duration_ms"])
+        if s["kind"] == "step" and s["attributes"].get("path"):
+            groups.setdefault(f"step:{s['attributes']['path']}", []).append(s["duration_ms"])
+        if s["kind"] == "llm" and s["trace_id"] in llm_calls:
+            llm_calls[s["trace_id"]] += 1
+
+    per_question = {requests[t]["attributes"]["question"]: n for t, n in llm_calls.items()}
+    return {
+        "questions": len(questions),
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_qps": round(len(questions) / wall_seconds, 3) if wall_seconds else 0.0,
+        "latency_ms": percentiles([s["duration_ms"] for s in requests.values()]),
+        "errors": sum(1 for s in requests.values() if s["error"]),
+        "stages": {key: percentiles(values) for key, values in sorted(groups.items())},
+        "llm_calls": {
+            "total": sum(per_question.values()),
+            "per_question": round(sum(per_question.values()) / len(per_question), 3) if per_question else 0.0,
+            "by_question": dict(sorted(per_question.items())),
+        },
+    }
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_variant(db_path: str, corpus_path: str, options: dict, results):
+    """Benchmark one database in this (fresh) process and put the report on the results queue"""
+    # Scratch caches and logs, so earlier runs and other variants cannot warm this one
+    scratch = tempfile.mkdtemp(prefix="benchmark-")
+    os.environ.update({
+        "DATABASE": db_path,
+        "SCHEMA_CACHE_DIR": os.path.join(scratch, "schema"),
+        "CLASSIFIER_LOG": os.path.join(scratch, "classifier.jsonl"),
+        "WORKLOAD_LOG": os.path.join(scratch, "workload.jsonl"),
+        "PLAN_CACHE_DIR": os.path.join(scratch, "plans"),
+        "TRACE_LOG": "",
+        "METRICS_PORT": "0",
+        "PROFILE_COLUMNS": "1" if options["profile_columns"] else "0",
+        "SPECULATIVE_MODE": "1" if options["speculative"] else "0",
+    })
+    os.environ.setdefault("SCHEMA_SYNONYMS", DEFAULT_SYNONYMS)
+    os.environ.setdefault("GOOGLE_API_KEY", "offline")
+    os.environ.setdefault("GROQ_API_KEY", "offline")
+    if not options["verbose"]:
+        # The agents print their reasoning; keep the benchmark's own output readable
+        sys.stdout = open(os.devnull, "w")
+        logging.disable(logging.WARNING)
+
+    import tracing
+    from config import DEFAULT_MODEL, FAST_MODEL
+    from registry import registry
+
+    collector = SpanCollector()
+    tracing.exporter = collector
+    corpus = load_corpus(corpus_path)
+    model = ReplayChatModel(responses=corpus["responses"], latency_ms=options["latency_ms"],
+                            token_ms=options["token_ms"], callbacks=[tracing.llm_tracer])
+    for name in (DEFAULT_MODEL, FAST_MODEL):
+        registry.override(f"llm_client:{name}", model)
+
+    started = time.perf_counter()
+    from stategraph import create_graph
+    graph = create_graph()
+    startup_ms = (time.perf_counter() - started) * 1000
+    collector.drain()
+
+    def ask(question):
+        with tracing.span("request", kind="request", question=question):
+            graph.invoke({"question": question})
+
+    questions = corpus["questions"]
+    report = {"startup_ms": round(startup_ms, 3), "passes": {}}
+    for name in ["cold", "warm"][:options["passes"]] + [f"warm{i}" for i in range(2, options["passes"])]:
+        calls_before = sum(model.calls.values())
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+            list(executor.map(ask, questions))
+        summary = summarize_pass(collector.drain(), questions, time.perf_counter() - started)
+        summary["llm_calls"]["model_calls"] = sum(model.calls.values()) - calls_before
+        summary["peak_rss_mb"] = peak_rss_mb()
+        report["passes"][name] = summary
+
+    report["llm_calls_by_stage"] = dict(sorted(model.calls.items()))
+    report["replay_misses"] = dict(sorted(model.misses.items()))
+    report["peak_rss_mb"] = peak_rss_mb()
+    if options["speculative"]:
+        from speculation import speculation_stats
+        report["speculation"] = speculation_stats.snapshot()
+    report["resources_ms"] = registry.startup_report()
+    results.put(report)
+
+
+def describe_database(path: str) -> dict:
+    introspector = SchemaIntrospector(path)
+    conn = introspector.connect()
+    try:
+        tables = introspector.list_tables(conn)
+        rows = sum(introspector.estimate_rows(conn, table) for table in tables)
+    finally:
+        conn.close()
+    return {"tables": len(tables), "rows": rows, "size_mb": round(os.path.getsize(path) / (1024 * 1024), 1)}
+
+
+def run_benchmark(variants: list, corpus_path: str, options: dict) -> dict:
+    """Run every variant in its own process, so each starts cold and has its own memory high-water mark"""
+    context = multiprocessing.get_context("spawn")
+    report = {"options": options, "corpus": os.path.basename(corpus_path), "variants": {}}
+    for name, path in variants:
+        logger.info(f"Benchmarking {name} ({path})")
+        results = context.Queue()
+        worker = context.Process(target=run_variant, args=(path, corpus_path, options, results), name=name)
+        worker.start()
+        try:
+            variant = results.get(timeout=options["variant_timeout"])
+        except Exception:
+            variant = {"error": f"no result within {options['variant_timeout']} s"}
+        worker.join(timeout=10)
+        if worker.is_alive():
+            worker.terminate()
+        variant.update(describe_database(path))
+        report["variants"][name] = variant
+    return report
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    """Lines describing changes of more than threshold percent in latency and throughput"""
+    changes = []
+
+    def check(label, old, new, higher_is_better=False):
+        if not old or new is None:
+            return
+        change = (new - old) / old * 100
+        if abs(change) >= threshold:
+            worse = change < 0 if higher_is_better else change > 0
+            changes.append(f"{'REGRESSION' if worse else 'improved  '} {label}: {old:g} -> {new:g} ({change:+.1f}%)")
+
+    for variant, data in sorted(current["variants"].items()):
+        old_variant = baseline.get("variants", {}).get(variant, {})
+        for pass_name, summary in sorted(data.get("passes", {}).items()):
+            old = old_variant.get("passes", {}).get(pass_name)
+            if not old:
+                continue
+            prefix = f"{variant}/{pass_name}"
+            check(f"{prefix} throughput_qps", old["throughput_qps"], summary["throughput_qps"], True)
+            check(f"{prefix} llm calls per question", old["llm_calls"]["per_question"],
+                  summary["llm_calls"]["per_question"])
+            for stat in ("p50", "p95", "p99"):
+                check(f"{prefix} request {stat}", old["latency_ms"].get(stat), summary["latency_ms"].get(stat))
+            for stage, stats in summary["stages"].items():
+                check(f"{prefix} {stage} p95", old["stages"].get(stage, {}).get("p95"), stats.get("p95"))
+        check(f"{variant} peak_rss_mb", old_variant.get("peak_rss_mb"), data.get("peak_rss_mb"))
+    return changes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the full pipeline offline with a replayed LLM")
+    parser.add_argument("--database", default=DEFAULT_SOURCE_DB, help="Source database to benchmark and scale up")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="Questions and recorded LLM responses")
+    parser.add_argument("--scales", default="1,10", help="Comma-separated row multipliers, e.g. 1,10,100,1000")
+    parser.add_argument("--wide", type=int, default=0, help="Also benchmark the schema repeated this many times")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="Where scaled copies are built and kept")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Simulated LLM time to first token")
+    parser.add_argument("--token-ms", type=float, default=0.0, help="Simulated LLM time per output token")
+    parser.add_argument("--passes", type=int, default=2, help="Passes over the corpus; the first is cold")
+    parser.add_argument("--concurrency", type=int, default=1, help="Questions in flight at once")
+    parser.add_argument("--profile-columns", action="store_true", help="Keep background column profiling on")
+    parser.add_argument("--speculative", action="store_true", help="Classify, discover and plan concurrently")
+    parser.add_argument("--record", action="store_true",
+                        help="Send prompts missing from the corpus to the real LLM and save its answers")
+    parser.add_argument("--output", default="benchmark-results.json", help="Where to write the results")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Percent change reported by --compare")
+    parser.add_argument("--verbose", action="store_true", help="Show the agents' output")
+    args = parser.parse_args()
+
+    if args.record:
+        # Recording runs in this process, one question at a time, against the configured providers
+        os.environ.update({"DATABASE": args.database, "TRACE_LOG": "", "METRICS_PORT": "0"})
+        os.environ.setdefault("SCHEMA_SYNONYMS", DEFAULT_SYNONYMS)
+        from config import DEFAULT_MODEL, FAST_MODEL, get_config
+        from registry import registry
+        from stategraph import create_graph
+
+        corpus = load_corpus(args.corpus)
+        config = get_config()
+        models = [ReplayChatModel(responses=corpus["responses"], recorder=config.build_llm(name))
+                  for name in (DEFAULT_MODEL, FAST_MODEL)]
+        for name, model in zip((DEFAULT_MODEL, FAST_MODEL), models):
+            registry.override(f"llm_client:{name}", model)
+        graph = create_graph()
+        for question in corpus["questions"]:
+            graph.invoke({"question": question})
+        for model in models:
+            for stage, responses in model.responses.items():
+                corpus["responses"].setdefault(stage, {}).update(responses)
+        save_corpus(args.corpus, corpus)
+        print(f"Recorded responses into {args.corpus}")
+        sys.exit(0)
+
+    options = {
+        "latency_ms": args.latency_ms, "token_ms": args.token_ms, "passes": max(args.passes, 1),
+        "concurrency": args.concurrency, "profile_columns": args.profile_columns, "verbose": args.verbose,
+        "speculative": args.speculative,
+        "variant_timeout": float(os.getenv("BENCHMARK_VARIANT_TIMEOUT", "3600")),
+    }
+    scales = [int(scale) for scale in args.scales.split(",") if scale.strip()]
+    variants = prepare_variants(args.database, args.data_dir, scales, args.wide)
+    report = run_benchmark(variants, args.corpus, options)
+
+    # Sorted keys and fixed rounding keep results diffable between runs
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"Wrote {args.output}")
+    for name, variant in report["variants"].items():
+        for pass_name, summary in variant.get("passes", {}).items():
+            latency = summary["latency_ms"]
+            print(f"{name:>20} {pass_name:>6}: {summary['throughput_qps']:.2f} q/s, p50 {latency.get('p50')} ms, "
+                  f"p95 {latency.get('p95')} ms, {summary['llm_calls']['per_question']} LLM calls/question, "
+                  f"peak RSS {summary['peak_rss_mb']} MB")
+        if "speculation" in variant:
+            print(f"{name:>20} speculation: {variant['speculation']}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            changes = compare(json.load(f), report, args.threshold)
+        print("\n".join(changes) if changes else f"No changes above {args.threshold}%")
+        sys.exit(1 if any(line.startswith("REGRESSION") for line in changes) else 0)
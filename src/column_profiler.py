@@ -0,0 +1,250 @@
+import bisect
+import difflib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import networkx as nx
+from connection_pool import StatementTimeout, statement_timeout
+from schema_cache import schema_cache
+from schema_introspector import SchemaIntrospector
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+TEXT_TYPE = re.compile(r"char|text|clob|string", re.IGNORECASE)
+STOPWORDS = {
+    "the", "and", "for", "from", "with", "all", "how", "many", "much", "what", "which", "who", "show", "list",
+    "give", "find", "per", "each", "total", "sales", "top", "are", "was", "were", "has", "have", "does", "did",
+    "most", "least", "than", "more", "less", "between", "by", "in", "of", "to", "on", "at", "is", "a", "an",
+}
+
+
+class ColumnProfiler:
+    """Computes per-column statistics and value dictionaries and attaches them to the schema graph."""
+
+    def __init__(self, pool, top_k: int = None, dictionary_max: int = None, timeout: float = None):
+        self.pool = pool
+        self.top_k = top_k or int(os.getenv("PROFILE_TOP_K", "5"))
+        self.dictionary_max = dictionary_max or int(os.getenv("PROFILE_DICTIONARY_MAX", "5000"))  # Distinct values
+        self.timeout = timeout or float(os.getenv("PROFILE_TIMEOUT", "30"))  # Per statement
+
+    def profile(self, db_graph: nx.Graph):
+        """Attach a "stats" dict to every column node without one, and "values" to low-cardinality text columns"""
+        started = time.perf_counter()
+        # A dedicated connection, so long profiling scans never hold one of the pool's slots
+        conn = self.pool.new_connection()
+        try:
+            for node in list(db_graph.nodes()):
+                data = db_graph.nodes[node]
+                if "tableName" not in data:
+                    continue
+                columns = {db_graph.nodes[n]["columnName"]: n for n in db_graph.neighbors(node)
+                           if "columnName" in db_graph.nodes[n]}
+                # After an incremental schema update only the new and changed tables lack statistics
+                if columns and all("stats" in db_graph.nodes[n] for n in columns.values()):
+                    continue
+                try:
+                    self.profile_table(conn, db_graph, data["tableName"], columns)
+                except (sqlite3.Error, StatementTimeout) as e:
+                    logger.warning(f"Skipped profiling {data['tableName']}: {e}")
+        finally:
+            conn.close()
+        db_graph.graph["profiled"] = True
+        logger.info(f"Profiled columns of {db_graph.number_of_nodes()} schema nodes in "
+                    f"{(time.perf_counter() - started) * 1000:.0f} ms")
+
+    def profile_table(self, conn: sqlite3.Connection, db_graph: nx.Graph, table: str, columns: dict):
+        quote = SchemaIntrospector.quote
+        # One pass over the table for every column's counts and bounds
+        aggregates = ", ".join(
+            f"COUNT({quote(c)}), COUNT(DISTINCT {quote(c)}), MIN({quote(c)}), MAX({quote(c)})" for c in columns
+        )
+        with statement_timeout(conn, self.timeout):
+            row = conn.execute(f"SELECT COUNT(*), {aggregates} FROM {quote(table)}").fetchone()
+
+        rows = row[0]
+        for i, (column, node) in enumerate(columns.items()):
+            non_null, distinct, minimum, maximum = row[1 + i * 4: 5 + i * 4]
+            stats = {
+                "distinct": distinct,
+                "nullFraction": round(1 - non_null / rows, 4) if rows else 0.0,
+                "min": self.plain(minimum),
+                "max": self.plain(maximum),
+                "topValues": [],
+            }
+
+            # Value frequencies only for low-cardinality columns, and never for the primary key
+            column_data = db_graph.nodes[node]
+            if 0 < distinct <= self.dictionary_max and not column_data.get("isPrimaryKey"):
+                with statement_timeout(conn, self.timeout):
+                    counts = conn.execute(
+                        f"SELECT {quote(column)}, COUNT(*) FROM {quote(table)} WHERE {quote(column)} IS NOT NULL "
+                        f"GROUP BY 1 ORDER BY 2 DESC"
+                    ).fetchall()
+                if counts and counts[0][1] > 1:
+                    stats["topValues"] = [[self.plain(value), count] for value, count in counts[:self.top_k]]
+
+                text = [value for value, _ in counts if isinstance(value, str)]
+                if text and (TEXT_TYPE.search(column_data.get("columnType") or "") or len(text) == len(counts)):
+                    column_data["values"] = sorted(text)
+
+            column_data["stats"] = stats
+
+    @staticmethod
+    def plain(value):
+        """JSON-safe value: blobs are dropped, long text is cut"""
+        if isinstance(value, bytes):
+            return None
+        if isinstance(value, str) and len(value) > 80:
+            return value[:80]
+        return value
+
+
+class LiteralResolver:
+    """Maps phrases in a question to exact values stored in the database.
+
+    Every profiled value dictionary is merged into one sorted array of lower-cased keys, so an exact or
+    prefix lookup is a single binary search however many columns the schema has.
+    """
+
+    def __init__(self, db_graph: nx.Graph):
+        entries = []  # (lower-cased value, table, column, value)
+        for node in db_graph.nodes():
+            data = db_graph.nodes[node]
+            if "tableName" not in data:
+                continue
+            for neighbor in db_graph.neighbors(node):
+                column = db_graph.nodes[neighbor]
+                for value in column.get("values") or []:
+                    entries.append((value.lower(), data["tableName"], column["columnName"], value))
+        entries.sort()
+        self.keys = [entry[0] for entry in entries]
+        self.entries = [entry[1:] for entry in entries]  # (table, column, value)
+        self.distinct_keys = sorted(set(self.keys))  # Candidates for fuzzy matching
+
+    def exact(self, term: str) -> list:
+        term = term.lower()
+        start = bisect.bisect_left(self.keys, term)
+        end = bisect.bisect_right(self.keys, term, lo=start)
+        return self.entries[start:end]
+
+    def prefix(self, term: str, limit: int = 10) -> list:
+        term = term.lower()
+        start = bisect.bisect_left(self.keys, term)
+        end = bisect.bisect_left(self.keys, term + "\uffff", lo=start)
+        return self.entries[start:min(end, start + limit)]
+
+    def fuzzy(self, term: str, cutoff: float = 0.85) -> list:
+        """Entries with the closest spelling, compared only against keys sharing the first letter"""
+        term = term.lower()
+        start = bisect.bisect_left(self.distinct_keys, term[:1])
+        end = bisect.bisect_left(self.distinct_keys, term[:1] + "\uffff", lo=start)
+        matches = difflib.get_close_matches(term, self.distinct_keys[start:end], n=1, cutoff=cutoff)
+        return self.exact(matches[0]) if matches else []
+
+    @staticmethod
+    def phrases(question: str) -> list:
+        """Quoted strings first, then word n-grams from longest to shortest, as (phrase, span)"""
+        found = [(match.group(1), None) for match in re.finditer(r"[\"']([^\"']+)[\"']", question)]
+        words = [word.strip(".,;:!?()\"'") for word in question.split()]
+        for size in range(min(4, len(words)), 0, -1):
+            for start in range(len(words) - size + 1):
+                phrase = " ".join(words[start:start + size])
+                if size == 1 and (len(phrase) < 3 or phrase.lower() in STOPWORDS):
+                    continue
+                found.append((phrase, (start, start + size)))
+        return found
+
+    def resolve(self, question: str, tables: list = None, max_hints: int = 5) -> list:
+        """Return literal hints as dicts with table, column, value, phrase and match ("exact" or "fuzzy")"""
+        if not self.keys:
+            return []
+        preferred = {table.lower() for table in tables or []}
+        hints, seen, used = [], set(), set()
+
+        for phrase, span in self.phrases(question):
+            if span is not None and used.intersection(range(*span)):
+                continue
+            matches, match_type = self.exact(phrase), "exact"
+            if not matches and len(phrase) >= 4 and all(word[:1].isupper() for word in phrase.split()):
+                # Only proper-noun phrases get a fuzzy lookup; common words would match too much
+                matches, match_type = self.fuzzy(phrase), "fuzzy"
+            if not matches:
+                continue
+
+            # Columns of the tables already judged relevant win over the rest of the schema
+            in_scope = [match for match in matches if match[0].lower() in preferred]
+            for table, column, value in in_scope or matches[:3]:
+                if (table, column, value) not in seen:
+                    seen.add((table, column, value))
+                    hints.append({"table": table, "column": column, "value": value, "phrase": phrase,
+                                  "match": match_type})
+            if span is not None:
+                used.update(range(*span))
+            if len(hints) >= max_hints:
+                break
+        return hints[:max_hints]
+
+
+# One resolver per schema fingerprint and profiling state, shared by every inference step
+_resolvers = {}
+_started = set()
+_lock = threading.Lock()
+
+
+def get_literal_resolver(db_graph: nx.Graph) -> LiteralResolver:
+    """Return the resolver for this graph; rebuilt once when background profiling completes"""
+    key = (db_graph.graph.get("fingerprint") or id(db_graph), bool(db_graph.graph.get("profiled")))
+    resolver = _resolvers.get(key)
+    if resolver is None:
+        with _lock:
+            resolver = _resolvers.get(key)
+            if resolver is None:
+                resolver = LiteralResolver(db_graph)
+                _resolvers[key] = resolver
+                if key[1]:
+                    _resolvers.pop((key[0], False), None)  # Superseded by the profiled one
+    return resolver
+
+
+def carry_over_resolvers(previous: nx.Graph, graph: nx.Graph, changes: dict):
+    """Schema change listener: forget the previous graph's resolvers, keeping them when no tables changed"""
+    fingerprint = previous.graph.get("fingerprint") or id(previous)
+    with _lock:
+        _started.discard(fingerprint)
+        for profiled in (False, True):
+            resolver = _resolvers.pop((fingerprint, profiled), None)
+            if resolver is not None and not any(changes.values()):
+                _resolvers[(graph.graph["fingerprint"], profiled)] = resolver
+
+
+schema_cache.subscribe(carry_over_resolvers)
+
+
+def profile_in_background(db_graph: nx.Graph, pool):
+    """Profile a copy of a schema graph once in a daemon thread, then swap it into the schema cache
+
+    The shared graph is never written to, so requests and the cache can read or serialize it meanwhile.
+    """
+    fingerprint = db_graph.graph.get("fingerprint")
+    if db_graph.graph.get("profiled") or os.getenv("PROFILE_COLUMNS", "1") != "1":
+        return
+    with _lock:
+        if fingerprint in _started:
+            return
+        _started.add(fingerprint)
+
+    def run():
+        profiled = db_graph.copy()
+        ColumnProfiler(pool).profile(profiled)
+        if not schema_cache.publish(pool.db_path, profiled):
+            logger.info(f"Dropped the column profile of superseded schema graph {fingerprint}")
+
+    threading.Thread(target=run, name="column-profiler", daemon=True).start()
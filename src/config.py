@@ -3,9 +3,30 @@ from langchain_groq import ChatGroq
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_community.utilities import SQLDatabase
 from dotenv import load_dotenv
+from sqlalchemy import MetaData, create_engine
+from sqlalchemy.pool import NullPool
+from registry import registry
+from schema_cache import schema_cache
+from connection_pool import ReadOnlyPool
+from query_guard import QueryGuard
+from llm_scheduler import LLMScheduler, ScheduledChatModel, provider_of
+from model_router import RoutedChatModel
+from tracing import llm_tracer
 
 load_dotenv()
 
+DEFAULT_MODEL = "gemini-2.5-flash"
+FAST_MODEL = "llama-3.1-8b-instant"
+# Classification is a one-word label, so it goes to the fast model; everything else, including the answer
+# users read, stays on the default model. LLM_MODEL_<STAGE> overrides
+STAGE_MODELS = {
+    "classify": FAST_MODEL,
+    "plan": DEFAULT_MODEL,
+    "sql": DEFAULT_MODEL,
+    "agent": DEFAULT_MODEL,
+    "response": DEFAULT_MODEL,
+}
+
 class Config:
     def __init__(self):
         #Load required environment variables
@@ -17,9 +38,97 @@ class Config:
         if not all([self.gemini_api_key, self.db]):
             raise ValueError("Missing required environment variables: GEMINI_API_KEY, DATABASE")
 
-        # Configure database connection
-        self.db_engine = SQLDatabase.from_uri(f"sqlite:///{self.db}")
+    @property
+    def read_pool(self) -> ReadOnlyPool:
+        # Tuned read-only connections used for every query the agents run
+        return registry.get("read_pool", lambda: ReadOnlyPool(self.db))
+
+    @property
+    def query_guard(self) -> QueryGuard:
+        # Checked before any generated SQL runs on the pool
+        return registry.get("query_guard", lambda: QueryGuard(self.read_pool))
+
+    @property
+    def sql_engine(self):
+        # Configure database connection, shared by every agent in the process; connections come from the
+        # read pool and go back to it, so SQLAlchemy keeps none of its own
+        return registry.get("sql_engine", lambda: create_engine(
+            "sqlite://",
+            creator=self.read_pool.checkout,
+            poolclass=NullPool
+        ))
+
+    @property
+    def db_engine(self) -> SQLDatabase:
+        # Replaced whole after each schema change, so read it at the point of use rather than holding on to it
+        return registry.get("db_engine", lambda: SQLDatabase(self.sql_engine, metadata=self.metadata))
+
+    @property
+    def metadata(self) -> MetaData:
+        # Our own reflection, which db_engine describes tables from
+        return registry.get("db_metadata", lambda: reflect_metadata(self.sql_engine))
+
+    @property
+    def llm(self):
+        return self.get_llm(DEFAULT_MODEL)  # Default model
+
+    @property
+    def llm_groq(self):
+        return self.get_llm(FAST_MODEL)  # Explicitly use llama3.1-8b-instant
+
+    def llm_for(self, stage: str):
+        """Return the model for a pipeline stage, hedged with the other configured model"""
+        return registry.get(f"llm_route:{stage}", lambda: self.build_route(stage))
+
+    def build_route(self, stage: str) -> RoutedChatModel:
+        # Groq is optional; without its key every stage stays on Gemini and hedges against itself
+        available = [DEFAULT_MODEL] + ([FAST_MODEL] if self.groq_api_key else [])
+        primary = os.getenv(f"LLM_MODEL_{stage.upper()}", STAGE_MODELS.get(stage, DEFAULT_MODEL))
+        if primary not in available:
+            primary = DEFAULT_MODEL
+        alternate = next((model for model in available if model != primary), primary)
+        return RoutedChatModel(stage=stage, primary=primary, alternate=alternate,
+                               models={model: self.get_llm(model) for model in {primary, alternate}})
+
+    def get_llm(self, model: str):
+        """Return the shared model for a model name; every call goes through its provider's scheduler"""
+        return registry.get(f"llm:{model}", lambda: ScheduledChatModel(
+            client=self.get_client(model),
+            scheduler=registry.get(f"llm_scheduler:{provider_of(model)}", lambda: LLMScheduler(provider_of(model)))
+        ))
+
+    def get_client(self, model: str):
+        """Return the shared provider client for a model, building it on first use"""
+        return registry.get(f"llm_client:{model}", lambda: self.build_llm(model))
+
+    def build_llm(self, model: str):
+        # Set up language models with specific configurations; every call is traced
+        if model.startswith("gemini"):
+            return ChatGoogleGenerativeAI(temperature=0, model=model, callbacks=[llm_tracer])
+        return ChatGroq(temperature=0, model_name=model, callbacks=[llm_tracer])
+
+
+def get_config() -> Config:
+    """Return the process-wide Config"""
+    return registry.get("config", Config)
+
+
+def reflect_metadata(engine) -> MetaData:
+    """Reflect every table in the database"""
+    metadata = MetaData()
+    metadata.reflect(bind=engine)
+    return metadata
+
+
+def reflect_db_engine(previous, graph, changes: dict):
+    """Schema change listener: rebuild the shared SQLDatabase so table info and agent tools see the new schema"""
+    engine = registry.peek("sql_engine")
+    if engine is None or registry.peek("db_engine") is None or not any(changes.values()):
+        return
+    # Built aside and installed with one override each; agents pick the new one up on their next use
+    metadata = reflect_metadata(engine)
+    registry.override("db_metadata", metadata)
+    registry.override("db_engine", SQLDatabase(engine, metadata=metadata))
+
 
-        # Set up language models with specific configurations
-        self.llm = ChatGoogleGenerativeAI(temperature=0,  model="gemini-2.5-flash",)  # Default model
-        self.llm_groq = ChatGroq(temperature=0, model_name="llama-3.1-8b-instant")  # Explicitly use llama3.1-8b-instant
\ No newline at end of file
+schema_cache.subscribe(reflect_db_engine)
@@ -0,0 +1,225 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes free within the checkout timeout."""
+
+
+class PoolClosed(Exception):
+    """Raised when a connection is requested from a pool that has been closed."""
+
+
+class StatementTimeout(Exception):
+    """Raised when a statement runs past its deadline and SQLite interrupts it."""
+
+
+@contextmanager
+def statement_timeout(conn: sqlite3.Connection, seconds: float = None):
+    """Interrupt any statement on this connection that is still running after the given seconds"""
+    if not seconds:
+        yield conn
+        return
+
+    deadline = time.monotonic() + seconds
+    # Called every N virtual machine instructions; a non-zero return aborts the statement
+    conn.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+    try:
+        yield conn
+    except sqlite3.OperationalError as e:
+        if time.monotonic() > deadline and "interrupted" in str(e):
+            raise StatementTimeout(f"Query stopped after the {seconds:g}s statement timeout") from e
+        raise
+    finally:
+        conn.set_progress_handler(None, 0)
+
+
+class PooledConnection:
+    """A checked-out pool connection whose close() returns it to the pool instead of closing it.
+
+    Handed to SQLAlchemy as its creator's connection, so the toolkit's queries share the pool's size
+    limit, checkout timeout and wait metrics instead of opening connections of their own.
+    """
+
+    def __init__(self, pool, conn: sqlite3.Connection):
+        object.__setattr__(self, "pool", pool)
+        object.__setattr__(self, "conn", conn)
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.conn, name, value)
+
+    def close(self):
+        conn = self.conn
+        if conn is not None:
+            object.__setattr__(self, "conn", None)
+            self.pool.release(conn)
+
+
+class ReadOnlyPool:
+    """Bounded pool of tuned, read-only SQLite connections.
+
+    Every connection is opened with mode=ro and PRAGMA query_only, so generated SQL can never write.
+    A thread gets back the connection it used last when that one is idle, which keeps SQLite's
+    per-connection page cache warm for that thread. Connections are created with
+    check_same_thread=False and are only ever used by one thread at a time, so worker threads and
+    asyncio.to_thread callers can share the pool.
+    """
+
+    def __init__(self, db_path: str, size: int = None, checkout_timeout: float = None):
+        self.db_path = os.path.abspath(db_path)
+        self.size = size or int(os.getenv("SQLITE_POOL_SIZE", "8"))
+        self.checkout_timeout = checkout_timeout or float(os.getenv("SQLITE_POOL_TIMEOUT", "30"))
+        self.mmap_size = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+        self.cache_size_kib = int(os.getenv("SQLITE_CACHE_SIZE_KIB", str(64 * 1024)))
+        self.busy_timeout_ms = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+        self.condition = threading.Condition()
+        self.idle = []  # Connections ready for checkout
+        self.created = 0
+        self.closed = False
+        self.affinity = threading.local()  # .conn: the connection this thread used last
+        self.waits = deque(maxlen=2048)  # Recent checkout wait times in seconds
+        self.per_connection = {}  # id(connection) -> {"checkouts", "wait_total", "wait_max"}
+
+        if os.getenv("SQLITE_ENABLE_WAL", "0") == "1":
+            self.enable_wal()
+
+    def enable_wal(self):
+        """Switch the database file to WAL so readers never block on a writer; persistent, so opt-in"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+            logger.info(f"SQLite journal mode for {self.db_path}: {mode}")
+        finally:
+            conn.close()
+
+    def new_connection(self) -> sqlite3.Connection:
+        """Open one tuned read-only connection"""
+        conn = sqlite3.connect(
+            f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False,
+            timeout=self.busy_timeout_ms / 1000
+        )
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA mmap_size = {self.mmap_size}")
+        conn.execute(f"PRAGMA cache_size = -{self.cache_size_kib}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """Check out a connection, waiting up to checkout_timeout for one to become free"""
+        started = time.perf_counter()
+        with self.condition:
+            while True:
+                if self.closed:
+                    raise PoolClosed(f"The connection pool for {self.db_path} is closed")
+                preferred = getattr(self.affinity, "conn", None)
+                if preferred is not None and preferred in self.idle:
+                    conn = preferred
+                    self.idle.remove(conn)
+                    break
+                if self.idle:
+                    conn = self.idle.pop()
+                    break
+                if self.created < self.size:
+                    self.created += 1
+                    conn = None  # Opened outside the lock below
+                    break
+
+                remaining = self.checkout_timeout - (time.perf_counter() - started)
+                if remaining <= 0:
+                    raise PoolTimeout(f"No SQLite connection free after {self.checkout_timeout:.0f}s")
+                self.condition.wait(remaining)
+
+        if conn is None:
+            try:
+                conn = self.new_connection()
+            except Exception:
+                with self.condition:
+                    self.created -= 1
+                    self.condition.notify()
+                raise
+
+        waited = time.perf_counter() - started
+        with self.condition:
+            self.affinity.conn = conn  # Dropped with the thread, so exited threads pin no connection
+            self.waits.append(waited)
+            stats = self.per_connection.setdefault(id(conn), {"checkouts": 0, "wait_total": 0.0, "wait_max": 0.0})
+            stats["checkouts"] += 1
+            stats["wait_total"] += waited
+            stats["wait_max"] = max(stats["wait_max"], waited)
+        return conn
+
+    def checkout(self) -> PooledConnection:
+        """Acquire a connection that goes back to the pool when closed (the SQLAlchemy creator)"""
+        return PooledConnection(self, self.acquire())
+
+    def release(self, conn: sqlite3.Connection):
+        """Return a connection to the pool"""
+        # Leave no read transaction open, so the connection sees fresh data on its next use
+        if conn.in_transaction:
+            conn.rollback()
+        with self.condition:
+            if self.closed:
+                conn.close()
+                self.created -= 1
+                return
+            self.idle.append(conn)
+            self.condition.notify()
+
+    @contextmanager
+    def connection(self, timeout: float = None):
+        """Context manager around acquire/release, optionally with a statement timeout"""
+        conn = self.acquire()
+        try:
+            with statement_timeout(conn, timeout):
+                yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self) -> dict:
+        """Pool occupancy and checkout wait-time metrics in milliseconds"""
+        with self.condition:
+            waits = sorted(self.waits)
+            per_connection = {
+                f"conn-{i}": {
+                    "checkouts": stats["checkouts"],
+                    "wait_avg_ms": round(stats["wait_total"] / stats["checkouts"] * 1000, 3),
+                    "wait_max_ms": round(stats["wait_max"] * 1000, 3),
+                }
+                for i, stats in enumerate(self.per_connection.values())
+            }
+            idle, created = len(self.idle), self.created
+
+        def percentile(p):
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 3) if waits else 0.0
+
+        return {
+            "size": self.size, "open": created, "idle": idle,
+            "wait_p50_ms": percentile(0.50), "wait_p95_ms": percentile(0.95), "wait_max_ms": percentile(1.0),
+            "connections": per_connection,
+        }
+
+    def close(self):
+        """Close idle connections and refuse new checkouts; checked-out ones are closed on release"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()  # Waiters raise PoolClosed rather than time out
+            for conn in self.idle:
+                conn.close()
+            self.created -= len(self.idle)
+            self.idle.clear()
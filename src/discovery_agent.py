@@ -1,7 +1,10 @@
 import json
 import logging
 import networkx as nx
-from config import Config
+from config import Config, get_config
+from schema_introspector import SchemaIntrospector
+from query_result import QueryResult, execute
+from tracing import span
 from langchain.tools import Tool
 from langchain_community.utilities import SQLDatabase
 from langchain_community.agent_toolkits import SQLDatabaseToolkit
@@ -16,12 +19,27 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 class DiscoveryAgent:
-    def __init__(self):
-        self.config = Config()
-        self.toolkit = SQLDatabaseToolkit(db=self.config.db_engine, llm=self.config.llm)
-        self.tools = self.toolkit.get_tools()
-
-        self.tools.extend(
+    def __init__(self, config: Config = None):
+        self.config = config or get_config()
+        self.introspector = SchemaIntrospector(self.config.db)
+        self.agent_for = None  # (SQLDatabase, AgentExecutor); only discover_with_llm needs the LLM agent
+
+    @property
+    def agent_executor(self) -> AgentExecutor:
+        # Built on first use, so catalog discovery never creates an LLM client or toolkit,
+        # and rebuilt when a schema change replaces the shared SQLDatabase
+        db = self.config.db_engine
+        built = self.agent_for
+        if built is None or built[0] is not db:
+            built = self.agent_for = (db, self.create_agent_executor(db))
+        return built[1]
+
+    def create_agent_executor(self, db: SQLDatabase) -> AgentExecutor:
+        """Build the LLM agent that explores the schema through the SQL toolkit"""
+        toolkit = SQLDatabaseToolkit(db=db, llm=self.config.llm)
+        tools = toolkit.get_tools()
+
+        tools.extend(
             [
                 Tool(
                     name = "VISUALISE_SCHEMA",
@@ -31,23 +49,25 @@ class DiscoveryAgent:
             ]
         )
 
-        self.chat_prompt = self.create_chat_prompt()
-        self.agent = create_openai_functions_agent(
-            llm = self.config.llm,
-            prompt = self.chat_prompt,
-            tools = self.tools,
+        agent = create_openai_functions_agent(
+            llm = self.config.llm.bind(lane="background"),  # Schema exploration yields to user requests
+            prompt = self.create_chat_prompt(),
+            tools = tools,
         )
 
-        self.agent_executor = AgentExecutor.from_agent_and_tools(
-            agent = self.agent,
-            tools = self.tools,
+        return AgentExecutor.from_agent_and_tools(
+            agent = agent,
+            tools = tools,
             verbose = True,
             handle_parsing_errors = True,
             max_iterations = 3,
         )
 
-    def run_query(self, query):
-        return self.config.db_engine.run(query)
+    def run_query(self, query) -> QueryResult:
+        with span("db.query", kind="db", sql=query) as query_span:
+            result = execute(self.config.read_pool, query)
+            query_span.set(rows=len(result))
+            return result
 
     def create_chat_prompt(self):
          # Create the system message template for generating SQL responses
@@ -100,8 +120,18 @@ class DiscoveryAgent:
         return ChatPromptTemplate.from_messages([system_message, human_message])
     
     def discover(self) -> nx.Graph:
-        """Perform schema discovery and return a graph representation."""
+        """Perform schema discovery from the SQLite catalog and return a graph representation."""
         logger.info("Performing discovery...")
+
+        # Read tables, columns and foreign keys straight from sqlite_master and PRAGMAs
+        data = self.introspector.introspect()
+
+        # Convert the catalog description into a graph representation
+        return self.buildGraph(data)
+
+    def discover_with_llm(self) -> nx.Graph:
+        """Perform schema discovery through the LLM agent and return a graph representation."""
+        logger.info("Performing LLM discovery...")
         prompt = "For all tables in this database, show the table name, column name, column type, if its optional. Also show Foreign key references to other columns. Do not show examples. Output only as json."
 
         # Invoke the agent executor with the discovery prompt
@@ -120,46 +150,93 @@ class DiscoveryAgent:
         """Parse the JSON response and return a graph representation."""
         response = output[output.find('\n')+1:output.rfind('\n')]
         data = json.loads(response)
+        return self.buildGraph(data)
 
+    @staticmethod
+    def buildGraph(data):
+        """Construct a graph from a list of table descriptions."""
         graph = nx.Graph() # Initialize an empty graph
-        nodeIds = 0 # Track table nodes
-        columnIds = len(data)+1 # Track column nodes
-        labeldict = {} # Dictionary to store node labels for visualization
-        canonicalColumns = {} # Map table-column pairs to column node Ids
 
         #Add tables and columns as nodes in the graph
         for table in data:
-            nodeIds +=1 
-            graph.add_node(nodeIds )
-            graph.nodes[nodeIds]['tableName'] = table['tableName']
-            labeldict[nodeIds] = table['tableName']
-
-            # Add tables and columns as nodes in the graph
-            for column in table['columns']:
-                columnIds +=1 
-                graph.add_node(columnIds)
-                graph.nodes[columnIds]['columnName'] = column['columnName']
-                graph.nodes[columnIds]['columnType'] = column['columnType']
-                graph.nodes[columnIds]['isOptional'] = column['isOptional']
-                #graph.nodes[columnIds]['foreignKeyReference'] = column['foreignKeyReference']
-                labeldict[columnIds] = column['columnName']
-                canonicalColumns[table['tableName']+'-'+column['columnName']] = columnIds
-                
-                graph.add_edge(nodeIds, columnIds)
-
-            # Add edges for foreign key references
-            for table in data:
-                for column in table['columns']:
-                    try:
-                        if column["foreignKeyReference"] is not None:
-                            this_column = table["tableName"] + column["columnName"]
-                            reference_column_ = column["foreignKeyReference"]["table"] + column["foreignKeyReference"]["column"]
-                            graph.add_edge(canonicalColumns[this_column], canonicalColumns[reference_column_])
-                    except Exception:
-                        pass
+            DiscoveryAgent.addTable(graph, table)
 
+        # Add edges for foreign key references, once every column has a node to point at
+        DiscoveryAgent.linkForeignKeys(graph)
         return graph
 
-
-
-            
+    @staticmethod
+    def addTable(graph, table):
+        """Add a table node and its column nodes; IDs are "table" and "table.column" so they survive updates"""
+        tableId = table['tableName']
+        graph.add_node(tableId, tableName=table['tableName'])
+
+        # Catalog-only details the LLM route never returns
+        for key in ('primaryKey', 'indexes', 'rowCount', 'ddlHash'):
+            if key in table:
+                graph.nodes[tableId][key] = table[key]
+
+        for column in table['columns']:
+            columnId = f"{table['tableName']}.{column['columnName']}"
+            graph.add_node(columnId, columnName=column['columnName'], columnType=column['columnType'],
+                           isOptional=column['isOptional'])
+            if 'isPrimaryKey' in column:
+                graph.nodes[columnId]['isPrimaryKey'] = column['isPrimaryKey']
+            # Kept on the node so the edge can be restored when the referenced table is rebuilt
+            if column.get('foreignKeyReference'):
+                graph.nodes[columnId]['foreignKeyReference'] = column['foreignKeyReference']
+            graph.add_edge(tableId, columnId)
+
+    @staticmethod
+    def removeTable(graph, tableName):
+        """Remove a table node with its column nodes and their foreign-key edges"""
+        columns = [n for n in graph.neighbors(tableName) if 'columnName' in graph.nodes[n]]
+        graph.remove_nodes_from(columns + [tableName])
+
+    @staticmethod
+    def linkForeignKeys(graph):
+        """Connect every referencing column to the column it references, where both exist"""
+        for columnId, data in list(graph.nodes(data=True)):
+            reference = data.get('foreignKeyReference')
+            if reference:
+                target = f"{reference['table']}.{reference['column']}"
+                if target in graph and not graph.has_edge(columnId, target):
+                    graph.add_edge(columnId, target)
+
+    @staticmethod
+    def updateGraph(graph, introspector) -> dict:
+        """Patch the graph in place to match the catalog; return the added, removed and changed tables
+
+        Only tables whose DDL hash moved are re-read. Returns None for graphs built before tables carried a
+        hash (or by the LLM route), which need a full rebuild.
+        """
+        known = {node: data.get('ddlHash') for node, data in graph.nodes(data=True) if 'tableName' in data}
+        if any(node != graph.nodes[node]['tableName'] or not ddlHash for node, ddlHash in known.items()):
+            return None
+
+        conn = introspector.connect()
+        try:
+            current = introspector.table_hashes(conn)
+            changes = {
+                'added': sorted(set(current) - set(known)),
+                'removed': sorted(set(known) - set(current)),
+                'changed': sorted(name for name in set(current) & set(known) if current[name] != known[name]),
+            }
+
+            # Row counts move with the data rather than the DDL; refreshing them is one seek per table
+            for name in set(known) - set(changes['removed']) - set(changes['changed']):
+                graph.nodes[name]['rowCount'] = introspector.estimate_rows(conn, name)
+        finally:
+            conn.close()
+
+        for name in changes['removed'] + changes['changed']:
+            DiscoveryAgent.removeTable(graph, name)
+        rebuilt = changes['added'] + changes['changed']
+        for table in introspector.introspect(rebuilt) if rebuilt else []:
+            DiscoveryAgent.addTable(graph, table)
+        DiscoveryAgent.linkForeignKeys(graph)
+
+        if rebuilt:
+            # New columns have no statistics yet; the background profiler fills in only those
+            graph.graph['profiled'] = False
+        return changes
@@ -0,0 +1,337 @@
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+import networkx as nx
+from connection_pool import StatementTimeout, statement_timeout
+from join_paths import get_join_planner
+from query_guard import QueryGuard
+from workload import WorkloadRecorder
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+OPERATOR = r"(==|=|<>|!=|<=|>=|<|>|\blike\b|\bin\b|\bbetween\b|\bis\b|\bglob\b)"
+EQUALITY = {"=", "==", "in", "is"}
+QUALIFIED_PREDICATE = re.compile(r"\b(\w+)\.(\w+)\s*" + OPERATOR, re.IGNORECASE)
+QUALIFIED_OPERAND = re.compile(r"(?:==|=)\s*(\w+)\.(\w+)\b", re.IGNORECASE)
+BARE_PREDICATE = re.compile(r"(?<![.\w])(\w+)\s*" + OPERATOR, re.IGNORECASE)
+AUTOMATIC_INDEX = re.compile(r"^SEARCH (\S+) USING AUTOMATIC (?:PARTIAL )?(?:COVERING )?INDEX \((.*)\)")
+
+
+class IndexAdvisor:
+    """Proposes indexes for the recorded workload and foreign keys, ranked by estimated savings."""
+
+    def __init__(self, db_graph: nx.Graph, workload: WorkloadRecorder, guard: QueryGuard, max_columns: int = None):
+        self.db_graph = db_graph
+        self.workload = workload
+        self.guard = guard  # Supplies row estimates, the cost model and the read-only pool
+        self.max_columns = max_columns or int(os.getenv("INDEX_ADVISOR_MAX_COLUMNS", "4"))
+        self.tables = self.table_details(db_graph)
+
+    @staticmethod
+    def table_details(db_graph: nx.Graph) -> dict:
+        """Columns, primary key and existing indexes per table, from the discovery graph"""
+        tables = {}
+        for node in db_graph.nodes():
+            data = db_graph.nodes[node]
+            if "tableName" not in data:
+                continue
+            columns = [db_graph.nodes[n]["columnName"] for n in db_graph.neighbors(node)
+                       if "columnName" in db_graph.nodes[n]]
+            existing = [tuple(index["columns"]) for index in data.get("indexes", [])]
+            if data.get("primaryKey"):
+                existing.append(tuple(data["primaryKey"]))
+            tables[data["tableName"].lower()] = {"name": data["tableName"], "columns": columns, "indexes": existing}
+        return tables
+
+    def covered(self, table: str, columns: tuple) -> bool:
+        """True when an existing index already starts with these columns"""
+        details = self.tables.get(table.lower())
+        lowered = tuple(column.lower() for column in columns)
+        return details is not None and any(
+            tuple(column.lower() for column in index[:len(columns)]) == lowered for index in details["indexes"]
+        )
+
+    def candidates(self) -> dict:
+        """Candidate indexes as (table, columns) -> {"reasons", "shapes"}"""
+        found = {}
+
+        def propose(table, columns, reason, shape=None):
+            details = self.tables.get(table.lower())
+            columns = tuple(dict.fromkeys(columns))
+            if not details or not columns or len(columns) > self.max_columns or self.covered(table, columns):
+                return
+            candidate = found.setdefault((details["name"], columns), {"reasons": set(), "shapes": set()})
+            candidate["reasons"].add(reason)
+            if shape:
+                candidate["shapes"].add(shape)
+
+        queries = self.workload.queries()
+        tables_used = {q["shape"]: {t.lower() for t in QueryGuard.aliases(q["sql"]).values()} for q in queries}
+
+        # Unindexed foreign-key columns, the usual culprits behind slow joins
+        planner = get_join_planner(self.db_graph)
+        for left, right, data in planner.table_graph.edges(data=True):
+            shapes = [shape for shape, used in tables_used.items() if {left.lower(), right.lower()} <= used]
+            for left_table, left_column, right_table, right_column in data["conditions"]:
+                for table, column in ((left_table, left_column), (right_table, right_column)):
+                    for shape in shapes or [None]:
+                        propose(table, (column,), "foreign key without an index", shape)
+
+        # Predicates and joins the recorded queries evaluate without an index
+        for query in queries:
+            try:
+                plan_rows, reads = self.explain(query["sql"])
+            except sqlite3.Error:
+                continue
+            aliases = {alias: table.lower() for alias, table in QueryGuard.aliases(query["sql"]).items()}
+            predicates = self.predicates(query["sql"], aliases)
+            for _id, _parent, _unused, detail in plan_rows:
+                automatic = AUTOMATIC_INDEX.match(detail)
+                if automatic:
+                    table = aliases.get(automatic.group(1).lower(), automatic.group(1))
+                    columns = [term.split("=")[0].split(">")[0].split("<")[0].strip()
+                               for term in automatic.group(2).split(" AND ")]
+                    propose(table, columns, "join builds an automatic index", query["shape"])
+                elif detail.startswith("SCAN "):
+                    table = aliases.get(detail.split()[1].lower(), detail.split()[1].lower())
+                    equality, ranges = predicates.get(table, ([], []))
+                    if not equality and not ranges:
+                        continue
+                    columns = equality + ranges[:1]  # Equality columns first, then at most one range
+                    propose(table, columns, "filtered column scanned without an index", query["shape"])
+
+                    # Covering variant: every column the query reads from the table, so the table is never visited
+                    read = [column for column in reads.get(table, []) if column not in columns]
+                    propose(table, columns + read, "covering index for a filtered scan", query["shape"])
+        return found
+
+    def explain(self, sql: str):
+        """Plan rows of a query plus the columns it reads per table (lower-case table name)"""
+        reads = {}
+
+        def authorizer(action, arg1, arg2, database, trigger):
+            if action == sqlite3.SQLITE_READ and arg1 and arg2:
+                reads.setdefault(arg1.lower(), [])
+                if arg2 not in reads[arg1.lower()]:
+                    reads[arg1.lower()].append(arg2)
+            return sqlite3.SQLITE_OK
+
+        with self.guard.pool.connection() as conn:
+            conn.set_authorizer(authorizer)
+            try:
+                plan_rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+            finally:
+                conn.set_authorizer(None)
+        return plan_rows, reads
+
+    def predicates(self, sql: str, aliases: dict) -> dict:
+        """Filter and join columns per table: table -> (equality columns, range columns)"""
+        found = {}
+
+        def add(table, column, operator):
+            details = self.tables.get(table)
+            if details is None:
+                return
+            names = {name.lower(): name for name in details["columns"]}
+            if column.lower() not in names:
+                return
+            equality, ranges = found.setdefault(table, ([], []))
+            target = equality if operator.lower() in EQUALITY else ranges
+            if names[column.lower()] not in equality + ranges:
+                target.append(names[column.lower()])
+
+        for qualifier, column, operator in QUALIFIED_PREDICATE.findall(sql):
+            if qualifier.lower() in aliases:
+                add(aliases[qualifier.lower()], column, operator)
+        for qualifier, column in QUALIFIED_OPERAND.findall(sql):
+            if qualifier.lower() in aliases:
+                add(aliases[qualifier.lower()], column, "=")
+
+        # Unqualified columns belong to the only table in the query that has them
+        tables = set(aliases.values())
+        for column, operator in BARE_PREDICATE.findall(sql):
+            owners = [t for t in tables if column.lower() in {c.lower() for c in self.tables.get(t, {}).get("columns", [])}]
+            if len(owners) == 1:
+                add(owners[0], column, operator)
+        return found
+
+    def scratch_schema(self) -> sqlite3.Connection:
+        """In-memory copy of the schema and planner statistics, without data, for what-if planning"""
+        scratch = sqlite3.connect(":memory:")
+        with self.guard.pool.connection() as conn:
+            skipped = self.virtual_tables(conn)
+            ddl = conn.execute(
+                "SELECT tbl_name, sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite\\_%' "
+                "ESCAPE '\\' ORDER BY type = 'index', type = 'view', type = 'trigger'"
+            ).fetchall()
+            try:
+                stats = conn.execute("SELECT tbl, idx, stat FROM sqlite_stat1").fetchall()
+            except sqlite3.OperationalError:
+                stats = []
+        for table, statement in ddl:
+            if table.lower() not in skipped:
+                scratch.execute(statement)
+        stats = [row for row in stats if row[0].lower() not in skipped]
+
+        # SQLite plans from sqlite_stat1 when present, so the copy needs the same statistics
+        if stats:
+            scratch.execute("ANALYZE")
+            scratch.execute("DELETE FROM sqlite_stat1")
+            scratch.executemany("INSERT INTO sqlite_stat1 VALUES (?, ?, ?)", stats)
+            scratch.execute("ANALYZE sqlite_schema")
+        scratch.commit()
+        return scratch
+
+    @staticmethod
+    def virtual_tables(conn: sqlite3.Connection) -> set:
+        """Virtual tables (FTS, R*Tree, ...) and their shadow tables, which a DDL-only copy cannot rebuild"""
+        try:
+            # PRAGMA table_list (SQLite 3.37+): (schema, name, type, ncol, wr, strict)
+            return {row[1].lower() for row in conn.execute("PRAGMA table_list")
+                    if row[0] == "main" and row[2] in ("virtual", "shadow")}
+        except sqlite3.OperationalError:
+            # Older SQLite: shadow tables are named after their virtual table
+            tables = [name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+            virtual = [name.lower() for (name,) in conn.execute(
+                "SELECT name FROM sqlite_master WHERE sql LIKE 'CREATE VIRTUAL TABLE%'")]
+            return {name.lower() for name in tables
+                    if any(name.lower() == v or name.lower().startswith(v + "_") for v in virtual)}
+
+    def cost(self, scratch: sqlite3.Connection, sql: str) -> float:
+        plan_rows = scratch.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+        return self.guard.estimate(plan_rows, QueryGuard.aliases(sql))[0]
+
+    def recommend(self, top_n: int = 5) -> list:
+        """Rank candidates by estimated row visits saved across the workload, using what-if plans"""
+        queries = {query["shape"]: query for query in self.workload.queries()}
+        candidates = self.candidates()
+        scratch = self.scratch_schema()
+        recommendations = []
+        try:
+            # Every baseline is planned before any candidate index exists; shapes that cannot be planned are skipped
+            baseline = {}
+            for shape in {shape for candidate in candidates.values() for shape in candidate["shapes"]}:
+                try:
+                    baseline[shape] = self.cost(scratch, queries[shape]["sql"])
+                except sqlite3.Error as e:
+                    logger.warning(f"Cannot plan workload query {shape}: {e}")
+
+            for (table, columns), candidate in candidates.items():
+                name = "idx_advisor_" + "_".join(re.sub(r"\W", "", part).lower() for part in (table, *columns))
+                ddl = f'CREATE INDEX "{name}" ON "{table}" (' + ", ".join(f'"{c}"' for c in columns) + ")"
+
+                savings, ms_saved, used_by = 0.0, 0.0, []
+                try:
+                    scratch.execute(ddl)
+                    for shape in candidate["shapes"]:
+                        if shape not in baseline:
+                            continue
+                        query = queries[shape]
+                        try:
+                            after = self.cost(scratch, query["sql"])
+                        except sqlite3.Error:
+                            continue
+                        before = baseline[shape]
+                        if after < before:
+                            savings += query["count"] * (before - after)
+                            ms_saved += query["total_ms"] * (1 - after / before)
+                            used_by.append(shape)
+                except sqlite3.Error as e:
+                    logger.warning(f"Skipping candidate {ddl}: {e}")
+                    continue
+                finally:
+                    scratch.execute(f'DROP INDEX IF EXISTS "{name}"')
+
+                # Workload-backed candidates must actually help; foreign-key ones are kept as structural advice
+                if candidate["shapes"] and not used_by:
+                    continue
+                recommendations.append({
+                    "name": name, "table": table, "columns": list(columns), "ddl": ddl, "reasons": sorted(candidate["reasons"]),
+                    "queries": used_by, "estimated_row_visits_saved": round(savings),
+                    "estimated_ms_saved": round(ms_saved, 3),
+                })
+        finally:
+            scratch.close()
+
+        # Among candidates with equal savings, the narrower index is cheaper to keep up to date
+        recommendations.sort(key=lambda r: (-r["estimated_row_visits_saved"], len(r["columns"]), r["table"]))
+        return recommendations[:top_n]
+
+    def verify(self, recommendations: list, repeats: int = None) -> list:
+        """Build each index on a scratch copy of the database and time its queries before and after"""
+        repeats = repeats or int(os.getenv("INDEX_ADVISOR_REPEATS", "5"))
+        queries = {query["shape"]: query for query in self.workload.queries()}
+        scratch_dir = tempfile.mkdtemp(prefix="index-advisor-", dir=os.getenv("INDEX_ADVISOR_SCRATCH_DIR"))
+        scratch = sqlite3.connect(os.path.join(scratch_dir, "scratch.db"))
+        try:
+            # The backup API copies a consistent snapshot page by page without blocking readers
+            with self.guard.pool.connection() as conn:
+                conn.backup(scratch)
+
+            for recommendation in recommendations:
+                shapes = recommendation["queries"]
+                before = {shape: self.time_query(scratch, queries[shape]["sql"], repeats) for shape in shapes}
+
+                started = time.perf_counter()
+                scratch.execute(recommendation["ddl"])
+                build_ms = (time.perf_counter() - started) * 1000
+                after = {shape: self.time_query(scratch, queries[shape]["sql"], repeats) for shape in shapes}
+                scratch.execute(f'DROP INDEX "{recommendation["name"]}"')
+
+                recommendation["verified"] = {
+                    "build_ms": round(build_ms, 3),
+                    "before_ms": round(sum(before.values()), 3),
+                    "after_ms": round(sum(after.values()), 3),
+                    "per_query": {shape: {"before_ms": round(before[shape], 3), "after_ms": round(after[shape], 3)}
+                                  for shape in shapes},
+                }
+                logger.info(f"Verified {recommendation['ddl']}: {sum(before.values()):.1f} ms -> "
+                            f"{sum(after.values()):.1f} ms")
+        finally:
+            scratch.close()
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+        return recommendations
+
+    def time_query(self, conn: sqlite3.Connection, sql: str, repeats: int) -> float:
+        """Median wall time of a query in milliseconds; a timeout counts as the full timeout"""
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            try:
+                with statement_timeout(conn, self.guard.timeout):
+                    conn.execute(sql).fetchall()
+            except StatementTimeout:
+                pass
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
+
+
+if __name__ == "__main__":
+    from config import get_config
+    from discovery_agent import DiscoveryAgent
+    from schema_cache import schema_cache
+
+    parser = argparse.ArgumentParser(description="Propose indexes for the recorded query workload")
+    parser.add_argument("--top", type=int, default=5, help="Number of recommendations to print")
+    parser.add_argument("--verify", action="store_true", help="Time each index on a scratch copy of the database")
+    args = parser.parse_args()
+
+    config = get_config()
+    db_graph = schema_cache.get_or_build(config.db, lambda: DiscoveryAgent(config).discover())
+    advisor = IndexAdvisor(db_graph, WorkloadRecorder(), config.query_guard)
+    recommendations = advisor.recommend(args.top)
+    if args.verify:
+        advisor.verify(recommendations)
+    print(json.dumps(recommendations, indent=2))
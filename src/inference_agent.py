@@ -1,9 +1,22 @@
+import os
+import re
 import json
+import time
 import logging
+import threading
 import networkx as nx
-from config import Config
+from config import Config, get_config
+from registry import registry
+from query_cache import QueryCache, normalize_question
+from query_result import QueryResult, execute
+from workload import WorkloadRecorder
+from schema_index import get_schema_index
+from join_paths import UnreachableTables, get_join_planner
+from column_profiler import get_literal_resolver
+from single_flight import SingleFlight
+from tracing import span, annotate, metrics
 from langchain.agents import AgentExecutor, create_openai_functions_agent
-from langchain.tools import Tool
+from langchain.tools import Tool, StructuredTool
 from langchain_community.agent_toolkits import SQLDatabaseToolkit
 from langchain_community.utilities import SQLDatabase
 from langchain_core.prompts import SystemMessagePromptTemplate, HumanMessagePromptTemplate, ChatPromptTemplate
@@ -17,34 +30,35 @@ logger = logging.getLogger(__name__)
 
 
 class InferenceAgent:
-    def __init__(self):
-        self.config = Config()
-        self.toolkit = SQLDatabaseToolkit(db = self.config.db_engine, llm = self.config.llm)
-        self.tools = self.toolkit.get_tools()
+    def __init__(self, config: Config = None):
+        self.config = config or get_config()
         self.chat_prompt = self.create_chat_prompt()
-        self.agent = create_openai_functions_agent(
-            llm=self.config.llm,
-            prompt=self.chat_prompt,
-            tools=self.tools
-        )
-        self.agent_executor = AgentExecutor.from_agent_and_tools(
-            agent=self.agent,
-            tools=self.tools,
-            verbose=True,
-            handle_parsing_errors=True,
-            max_iterations=15
-        )
+        self.agent_for = None  # (SQLDatabase, AgentExecutor built on its toolkit)
+        self.query_cache = registry.get("query_cache", lambda: QueryCache(self.config.db))
+        self.workload = registry.get("workload", WorkloadRecorder)
+        # Identical steps running at the same time, from one plan or from concurrent users, share one answer
+        self.step_flights = registry.get("step_flights", lambda: SingleFlight("inference step"))
+        self.index_top_k = int(os.getenv("SCHEMA_INDEX_TOP_K", "5"))
+        self.index_min_score = float(os.getenv("SCHEMA_INDEX_MIN_SCORE", "0.1"))
+
+        # Single-shot SQL generation before falling back to the agent; INFERENCE_MODE=agent disables it
+        self.fast_mode = os.getenv("INFERENCE_MODE", "fast").lower() == "fast"
+        self.sql_prompt = self.create_sql_prompt()
+        self.last_result = threading.local()  # Last successful result on this thread, for the agent path
 
-        self.test_connection()
+        # The connection only needs checking once per process, not once per agent
+        registry.get("connection_check", self.test_connection)
 
     def test_connection(self):
         try:
             self.show_tables()
             logger.info("Database connection successful")
+            return True
         except Exception as e:
             print(f"Database connection failed: {e}")
+            return False
 
-    def show_tables(self) -> str:
+    def show_tables(self) -> QueryResult:
         """Query to list all tables and views in the database"""
         query = '''
         SELECT name, type
@@ -54,13 +68,76 @@ class InferenceAgent:
 
         return self.run_query(query)
 
-    def run_query(self, query:str) -> str:
-        """Execute an SQL query and handle any exception"""
-        try:
-            return self.config.db_engine.run(query)
-        except Exception as e:
-            logger.error(f"Query execution failed: {str(e)}")
-            return f"Error executing query: {str(e)}"
+    def run_query(self, query:str) -> QueryResult:
+        """Check an SQL query with the guardrail, execute it and handle any exception"""
+        guard = self.config.query_guard
+        with span("db.guard", kind="db") as guard_span:
+            verdict = guard.check(query)
+            guard_span.set(action=verdict.action, estimated_cost=round(verdict.cost))
+        if verdict.rejected:
+            logger.warning(f"Guardrail rejected query: {verdict.reason}")
+            return QueryResult.failed(verdict.feedback())
+
+        with span("db.query", kind="db", sql=verdict.sql) as query_span:
+            try:
+                started = time.perf_counter()
+                result = execute(self.config.read_pool, verdict.sql, timeout=guard.timeout)
+                latency_ms = (time.perf_counter() - started) * 1000
+
+                # Every executed query feeds the index advisor's workload
+                rows = result.summary.row_count if result.summary is not None else len(result)
+                self.workload.record(verdict.sql, latency_ms, rows, verdict.plan)
+                query_span.set(rows=rows, summarized=result.summary is not None)
+                metrics.observe("db_rows", rows, operation="query")
+                if verdict.action == "rewrite":
+                    result.notice = verdict.reason
+                result.sql = verdict.sql
+                self.last_result.value = result
+                return result
+            except Exception as e:
+                logger.error(f"Query execution failed: {str(e)}")
+                query_span.set(error=str(e))
+                return QueryResult.failed(f"Error executing query: {str(e)}")
+
+    @property
+    def agent_executor(self) -> AgentExecutor:
+        # Rebuilt when a schema change replaces the shared SQLDatabase, so the tools describe the current schema
+        db = self.config.db_engine
+        built = self.agent_for
+        if built is None or built[0] is not db:
+            built = self.agent_for = (db, self.create_agent_executor(db))
+        return built[1]
+
+    def create_agent_executor(self, db: SQLDatabase) -> AgentExecutor:
+        """Build the fallback SQL agent on a toolkit for this SQLDatabase"""
+        toolkit = SQLDatabaseToolkit(db=db, llm=self.config.llm)
+        # The agent's query tool returns the same compact rendering as the other paths
+        tools = [self.create_query_tool(tool) if tool.name == "sql_db_query" else tool
+                 for tool in toolkit.get_tools()]
+        agent = create_openai_functions_agent(
+            llm=self.config.llm_for("agent"),
+            prompt=self.chat_prompt,
+            tools=tools
+        )
+        return AgentExecutor.from_agent_and_tools(
+            agent=agent,
+            tools=tools,
+            verbose=True,
+            handle_parsing_errors=True,
+            max_iterations=15,
+            return_intermediate_steps=True  # Needed to cache the SQL the agent settled on
+        )
+
+    def create_query_tool(self, toolkit_tool) -> StructuredTool:
+        """Replace the toolkit's sql_db_query tool with one backed by run_query"""
+        def sql_db_query(query: str) -> str:
+            return self.run_query(query).to_prompt()
+
+        return StructuredTool.from_function(
+            func=sql_db_query,
+            name=toolkit_tool.name,
+            description=toolkit_tool.description
+        )
 
     def create_chat_prompt(self) -> ChatPromptTemplate:
         """Create a system prompt and user prompt"""
@@ -85,54 +162,108 @@ class InferenceAgent:
         # Combine system and human message templates into a chat prompt
         return ChatPromptTemplate.from_messages([system_message, human_message])
 
+    def create_sql_prompt(self) -> ChatPromptTemplate:
+        """Prompt for writing one query from a pruned schema"""
+        system_message = SystemMessagePromptTemplate.from_template(
+            """You write a single SQLite query for a question about the tables below.
+
+            Schema:
+            {schema}
+
+            Suggested joins: {joins}
+
+            Values stored in the database that match the question: {literals}
+
+            Rules:
+            1. Return ONLY the SQL query, no explanation
+            2. Use only SELECT statements
+            3. Use only the tables and columns shown above
+            4. Spell literal values exactly as in the stored values above
+            """
+        )
+        human_message = HumanMessagePromptTemplate.from_template("{question}")
+        return ChatPromptTemplate.from_messages([system_message, human_message])
+
     def analyze_questions_with_graph(self, db_graph: nx.Graph, question: str) -> dict:
         """Analyse the user questions in the context of the database graph"""
         print(f"\n🔎 Starting graph analysis for: '{question}'")
-        question_lower = question.lower()
 
         # Structure to store analysis results
         analysis = {
             'tables': [],
             'relationships': [],
             'columns': [],
-            'possible_paths': []
+            'possible_paths': [],
+            'literals': []
         }
 
-        #Scan graph nodes to identify relevant tables and columns
-        for node in db_graph.nodes():
-            node_data = db_graph.nodes[node]
+        # Rank tables and columns against the question with the prebuilt retrieval index
+        index = get_schema_index(db_graph)
+        for match in index.search(question, top_k=self.index_top_k, min_score=self.index_min_score):
+            print(f"  📦 Found relevant table: {match['name']} (score {match['score']})")
+            table_info = {'name': match['name'], 'columns': []}
 
-            if "tableName" not in node_data:
-                continue
-
-            table_name = node_data['tableName'].lower()
-            if not (table_name in question_lower or
-                    table_name.rstrip('s') in question_lower or
-                    f"{table_name}s" in question_lower):
-                continue
+            for column in match['columns']:
+                table_info['columns'].append({
+                    'name': column['name'],
+                    'type': column['type'],
+                    'table': match['name']
+                })
+                print(f"    📎 Found relevant column: {column['name']}")
 
-            print(f"  📦 Found relevant table: {node_data['tableName']}")
-            table_info = {'name': node_data['tableName'], 'columns': []} 
+            analysis['tables'].append(table_info)
 
-             # Find matching columns connected to the table
-            for neighbor in db_graph.neighbors(node):
-                col_data = db_graph.nodes[neighbor]
-                if 'columnName' in col_data and col_data['columnName'].lower() in question_lower:
-                    table_info['columns'].append({
-                        'name': col_data['columnName'],
-                        'type': col_data['columnType'],
-                        'table': node_data['tableName']
-                    })
-                    print(f"    📎 Found relevant column: {col_data['columnName']}")
+        # Ground literal values against the profiled value dictionaries instead of exploratory queries
+        for hint in get_literal_resolver(db_graph).resolve(question, [t['name'] for t in analysis['tables']]):
+            print(f"  🔤 Resolved '{hint['phrase']}' to {hint['table']}.{hint['column']} = '{hint['value']}'")
+            analysis['literals'].append(f"{hint['table']}.{hint['column']} = '{hint['value']}'")
+            if hint['table'] not in [t['name'] for t in analysis['tables']]:
+                analysis['tables'].append({'name': hint['table'], 'columns': []})
 
-            analysis['tables'].append(table_info)
+        # Precomputed foreign-key routes turn the relevant tables into ready-made joins
+        planner = get_join_planner(db_graph)
+        table_names = [t['name'] for t in analysis['tables']]
+        tree = planner.join_tree(table_names)
+        for parent, child in tree.edges():
+            for left_table, left_column, right_table, right_column in planner.table_graph[parent][child]['conditions']:
+                analysis['relationships'].append(f"{left_table}.{left_column} = {right_table}.{right_column}")
+        try:
+            analysis['possible_paths'] = planner.join_clauses(table_names)
+        except UnreachableTables as e:
+            # No single join covers every table; leave the choice of tables to the SQL writer
+            logger.warning(f"{e}; no join path suggested")
+            print(f"  ⚠️ {e}")
 
         return analysis
 
 
     def query(self, text: str, db_graph) -> str:
         """Execute a query using graph-based analysis or standard prompt"""
+        return self.query_with_path(text, db_graph)[0]
+
+    def query_with_path(self, text: str, db_graph) -> tuple:
+        """Execute a query and return (answer, path, sql) where path is cache, fast, agent or error
+
+        sql is the guard-checked query behind a truncated result, for paging it in the UI, and None otherwise.
+        """
         try:
+            schema_version, data_version = self.query_cache.versions()
+            self.config.query_guard.observe(data_version)  # Row estimates follow the data
+            key = (normalize_question(text), schema_version, data_version)
+            return self.step_flights.do(key, lambda: self.answer(text, db_graph, schema_version, data_version))
+        except Exception as e:
+            print(f"\n❌ Error in inference query: {str(e)}")
+            return self.served(text, "error", f"Error processing query: {str(e)}")
+
+    def answer(self, text: str, db_graph, schema_version, data_version) -> tuple:
+        """Answer one step from the cache, the fast path or the agent, as (answer, path, sql)"""
+        try:
+            # Repeated questions are answered from the cache without any LLM call
+            cached = self.cached_answer(text, schema_version, data_version)
+            if cached is not None:
+                print(f"\n♻️ Served from query cache: '{text}'")
+                return self.served(text, "cache", *cached)
+
             if db_graph:
                 print(f"\n Analysing query with graph: '{text}'")
 
@@ -141,11 +272,19 @@ class InferenceAgent:
                 print(f"\n📊 Graph Analysis Results:")
                 print(json.dumps(graph_analysis, indent=2))
 
+                # Try one LLM call with the pruned schema before paying for the multi-step agent
+                if self.fast_mode and graph_analysis['tables']:
+                    answer = self.fast_query(text, graph_analysis, schema_version, data_version)
+                    if answer is not None:
+                        return self.served(text, "fast", *answer)
+
                 # Enhance the prompt with graph analysis context
                 enhanced_prompt = f"""
                 Database Structure Analysis:
                 - Available Tables: {[t['name'] for t in graph_analysis['tables']]}
-                - Table Relationships: {graph_analysis['possible_paths']}
+                - Table Relationships: {graph_analysis['relationships']}
+                - Join Path: {' '.join(graph_analysis['possible_paths'])}
+                - Known Values: {graph_analysis['literals']}
 
                 User Question: {text}
 
@@ -153,13 +292,92 @@ class InferenceAgent:
                 """
 
                 print(f"\n📝 Enhanced prompt created with graph context")
-                return self.agent_executor.invoke({"input": enhanced_prompt, "db_name": self.config.db})['output']
-            print(f"\n⚡ No graph available, executing standard query: '{text}'")
-            return self.agent_executor.invoke({"input": text, "db_name": self.config.db})['output']
+                self.last_result.value = None
+                response = self.agent_executor.invoke({"input": enhanced_prompt, "db_name": self.config.db})
+            else:
+                print(f"\n⚡ No graph available, executing standard query: '{text}'")
+                self.last_result.value = None
+                response = self.agent_executor.invoke({"input": text, "db_name": self.config.db})
+
+            # The agent's tools run on this thread, so its last successful query is the one it settled on
+            self.remember(text, response, schema_version)
+            return self.served(text, "agent", response['output'], getattr(self.last_result, "value", None))
 
         except Exception as e:
             # Handle errors during query processing
             print(f"\n❌ Error in inference query: {str(e)}")
-            return f"Error processing query: {str(e)}"
+            return self.served(text, "error", f"Error processing query: {str(e)}")
 
+    def served(self, text: str, path: str, answer: str, result: QueryResult = None) -> tuple:
+        """Record which path answered a step; only a truncated result is offered for paging"""
+        metrics.increment("inference_steps_total", path=path)  # Thread-safe totals per path
+        annotate(path=path)
+        logger.info(f"Inference step served by {path}: '{text}'")
+        return answer, path, result.sql if result is not None and result.truncated else None
+
+    def fast_query(self, text: str, graph_analysis: dict, schema_version, data_version):
+        """Generate SQL in a single LLM call from the pruned schema, validate and run it; (answer, result) or None"""
+        table_names = [t['name'] for t in graph_analysis['tables']]
+        try:
+            # CREATE TABLE statements plus sample rows, from the metadata reflected at startup
+            schema = self.config.db_engine.get_table_info(table_names)
+        except Exception as e:
+            logger.warning(f"Fast path could not describe tables {table_names}: {e}")
+            return None
+
+        response = self.config.llm_for("sql").invoke(self.sql_prompt.format(
+            schema=schema,
+            joins=' '.join(graph_analysis['possible_paths']) or 'none needed',
+            literals='; '.join(graph_analysis['literals']) or 'none',
+            question=text
+        ))
+        sql = self.extract_sql(response.content)
+
+        # run_query validates locally first: one read-only statement that SQLite can compile and run cheaply
+        result = self.run_query(sql)
+        if result.error:
+            logger.info(f"Fast path SQL failed ({result.error}), falling back to the agent")
+            return None
+
+        self.query_cache.put_sql(text, schema_version, sql)
+        self.query_cache.put_result(sql, data_version, result)
+        return f"Query Executed: {sql}\nResults: {result.to_prompt()}", result
+
+    @staticmethod
+    def extract_sql(content: str) -> str:
+        """Strip code fences and commentary around a generated query"""
+        match = re.search(r"```(?:sql)?\s*(.*?)```", content, re.DOTALL | re.IGNORECASE)
+        sql = match.group(1) if match else content
+        return sql.strip().rstrip(';').strip()
+
+    def cached_answer(self, text: str, schema_version, data_version):
+        """Answer from the question->SQL and SQL->result caches as (answer, result), or return None"""
+        sql = self.query_cache.get_sql(text, schema_version)
+        if sql is None:
+            return None
+
+        # Known SQL but data has changed since: re-run the SQL, still without the LLM
+        result = self.query_cache.get_result(sql, data_version)
+        if result is None:
+            result = self.run_query(sql)
+            if result.error:
+                return None
+            self.query_cache.put_result(sql, data_version, result)
+
+        return f"Query Executed: {sql}\nResults: {result.to_prompt()}", result
+
+    def remember(self, text: str, response: dict, schema_version):
+        """Store and return the last successful sql_db_query call the agent made"""
+        for action, observation in reversed(response.get("intermediate_steps", [])):
+            if getattr(action, "tool", None) != "sql_db_query":
+                continue
+
+            tool_input = action.tool_input
+            sql = tool_input.get("query") if isinstance(tool_input, dict) else tool_input
+            if not sql or str(observation).startswith("Error"):
+                continue
 
+            # Only the SQL is kept; the first cache hit stores its typed result
+            self.query_cache.put_sql(text, schema_version, sql)
+            return sql
+        return None
@@ -0,0 +1,303 @@
+import json
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter, deque
+import numpy as np
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+CATEGORIES = ["DATABASE_QUERY", "GREETING", "CHITCHAT", "FAREWELL"]
+DEFAULT_LOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "classifier", "log.jsonl")
+
+GREETING_PATTERN = re.compile(
+    r"^(hi+|hello+|hey+|hiya|howdy|yo|greetings|good (morning|afternoon|evening|day)|"
+    r"how are you( doing)?|how's it going|what's up|sup)( there| all| everyone)?[\s!.,?]*$"
+)
+FAREWELL_PATTERN = re.compile(
+    r"^((ok(ay)?|thanks?( you)?|cheers)[\s,!.]*)?(bye+|goodbye|good bye|bye bye|see (you|ya)( later| soon)?|"
+    r"later|take care|good night|ciao|farewell|that's all( for now)?)[\s!.,]*$"
+)
+
+
+def tokenize(text: str) -> list:
+    """Lower-case word tokens plus word bigrams"""
+    words = re.findall(r"[a-z0-9']+", text.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def split_identifier(name: str) -> str:
+    """Turn CamelCase or snake_case identifiers into space separated words"""
+    return re.sub(r"(?<=[a-z0-9])(?=[A-Z])", " ", name).replace("_", " ").lower().strip()
+
+
+class RuleClassifier:
+    """Keyword stage: greetings, farewells and mentions of schema objects."""
+
+    def __init__(self):
+        self.schema_terms = set()
+        self.schema_key = None  # Fingerprint of the graph the terms came from
+
+    def update_schema(self, db_graph):
+        """Collect table names and multi-word column names from the schema graph"""
+        key = db_graph.graph.get("fingerprint", id(db_graph))
+        if key == self.schema_key:
+            return
+
+        terms = set()
+        for node in db_graph.nodes():
+            data = db_graph.nodes[node]
+            if "tableName" in data:
+                table = split_identifier(data["tableName"])
+                terms.update({table, table.rstrip("s")})
+            elif "columnName" in data:
+                # Single-word columns such as "Name" or "Title" are too generic to signal a query
+                column = split_identifier(data["columnName"])
+                if " " in column and not column.endswith(" id"):
+                    terms.add(column)
+
+        self.schema_terms = {term for term in terms if len(term) > 2}
+        self.schema_key = key
+
+    def classify(self, text: str):
+        """Return (category, confidence) or None when no rule fires"""
+        normalized = " ".join(text.lower().split())
+        if not normalized:
+            return "CHITCHAT", 1.0
+
+        # Any schema mention wins, even inside a greeting ("hi, how many tracks are there?")
+        padded = f" {re.sub(r'[^a-z0-9 ]', ' ', normalized)} "
+        if any(f" {term} " in padded or f" {term}s " in padded for term in self.schema_terms):
+            return "DATABASE_QUERY", 0.95
+
+        if FAREWELL_PATTERN.match(normalized):
+            return "FAREWELL", 1.0
+        if GREETING_PATTERN.match(normalized):
+            return "GREETING", 1.0
+        return None
+
+
+class CentroidModel:
+    """One trained state of the local model: vocabulary, IDF weights and per-label centroids."""
+
+    def __init__(self, vocabulary: dict, idf: np.ndarray, centroids: np.ndarray, labels: list):
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.centroids = centroids  # (classes, vocabulary) matrix of L2-normalised centroids
+        self.labels = labels
+
+    def weights(self, text: str) -> tuple:
+        """Sparse L2-normalised TF-IDF row of a text, as (columns, values)"""
+        columns, values = [], []
+        for token, count in Counter(tokenize(text)).items():
+            column = self.vocabulary.get(token)
+            if column is not None:
+                columns.append(column)
+                values.append((1.0 + math.log(count)) * self.idf[column])
+        values = np.array(values, dtype=np.float32)
+        norm = np.linalg.norm(values)
+        return np.array(columns, dtype=np.int64), values / norm if norm else values
+
+    def vectorize(self, text: str) -> np.ndarray:
+        """Dense L2-normalised TF-IDF row of one text"""
+        columns, values = self.weights(text)
+        vector = np.zeros(len(self.vocabulary), dtype=np.float32)
+        vector[columns] = values
+        return vector
+
+
+class LocalModelClassifier:
+    """TF-IDF + nearest-centroid linear classifier trained on logged classifications.
+
+    Retraining builds a new CentroidModel and swaps it in with one assignment, so a concurrent
+    classify always sees a vocabulary, IDF vector and centroids of the same shape.
+    """
+
+    def __init__(self, min_examples: int = 20):
+        self.min_examples = min_examples
+        self.fitted = None  # CentroidModel, replaced whole on every fit
+        self.trained_on = 0
+
+    def fit(self, examples: list):
+        """Train on (text, label) pairs"""
+        if len(examples) < self.min_examples or len({label for _, label in examples}) < 2:
+            return False
+
+        document_frequency = Counter(token for text, _ in examples for token in set(tokenize(text)))
+        tokens = sorted(document_frequency)
+        vocabulary = {token: i for i, token in enumerate(tokens)}
+        idf = np.array([math.log((1 + len(examples)) / (1 + document_frequency[token])) + 1.0 for token in tokens],
+                       dtype=np.float32)
+        model = CentroidModel(vocabulary, idf, None, sorted({label for _, label in examples}))
+
+        # One centroid per label, summed a sparse row at a time; scoring is then a matrix-vector product
+        centroids = np.zeros((len(model.labels), len(vocabulary)), dtype=np.float32)
+        for text, label in examples:
+            columns, values = model.weights(text)
+            centroids[model.labels.index(label), columns] += values
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        model.centroids = centroids / np.where(norms == 0, 1.0, norms)
+
+        self.fitted = model
+        self.trained_on = len(examples)
+        return True
+
+    def classify(self, text: str):
+        """Return (category, confidence) or None when the model is not trained"""
+        model = self.fitted  # Read once, so a retrain mid-call cannot mix two models
+        if model is None:
+            return None
+
+        scores = model.centroids @ model.vectorize(text)
+        if not scores.any():
+            return None
+
+        # Confidence is the similarity margin between the best and runner-up labels
+        order = np.argsort(scores)[::-1]
+        margin = float(scores[order[0]] - scores[order[1]]) if len(order) > 1 else float(scores[order[0]])
+        return model.labels[order[0]], margin
+
+
+class InputClassifier:
+    """Rules first, then the local model, and the LLM only when neither is confident.
+
+    Training data is the max_examples most recent LLM decisions, the log is rewritten to that window
+    before it doubles, and retraining runs on a background thread while the old model keeps serving.
+    """
+
+    def __init__(self, log_path: str = None, max_examples: int = None):
+        self.log_path = log_path or os.getenv("CLASSIFIER_LOG", DEFAULT_LOG_PATH)
+        self.model_threshold = float(os.getenv("CLASSIFIER_MODEL_THRESHOLD", "0.35"))
+        self.retrain_every = int(os.getenv("CLASSIFIER_RETRAIN_EVERY", "25"))
+        self.max_examples = max_examples or int(os.getenv("CLASSIFIER_MAX_EXAMPLES", "5000"))
+        self.rules = RuleClassifier()
+        self.model = LocalModelClassifier()
+        self.examples = deque(maxlen=self.max_examples)
+        self.appended = 0  # Lines in the log; rewritten to the window once it reaches twice max_examples
+        self.recorded = 0  # Examples added since the model was last trained
+        self.training = False
+        self.hits = Counter()  # Tier name -> number of messages it decided
+        self.lock = threading.Lock()
+        self.load_examples()
+        self.model.fit(list(self.examples))
+
+    def load_examples(self):
+        """Read previously logged LLM classifications, keeping the most recent max_examples"""
+        try:
+            with open(self.log_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        self.examples.append((record["text"], record["label"]))
+                        self.appended += 1
+                    except (ValueError, KeyError):
+                        continue
+        except FileNotFoundError:
+            return
+        if self.appended >= 2 * self.max_examples:
+            with self.lock:
+                self.rotate_log()
+
+    def record(self, text: str, label: str):
+        """Log an LLM decision as training data and retrain periodically"""
+        with self.lock:
+            self.examples.append((text, label))
+            self.recorded += 1
+            try:
+                os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"text": text, "label": label}) + "\n")
+                self.appended += 1
+            except OSError as e:
+                logger.warning(f"Could not log classification: {e}")
+            if self.appended >= 2 * self.max_examples:
+                self.rotate_log()
+
+            if self.training or self.recorded < self.retrain_every:
+                return
+            self.training, self.recorded = True, 0
+            examples = list(self.examples)
+        threading.Thread(target=self.retrain, args=(examples,), name="classifier-retrain", daemon=True).start()
+
+    def retrain(self, examples: list):
+        # Fits outside the lock; the model swaps the result in with one assignment
+        try:
+            self.model.fit(examples)
+        except Exception as e:
+            logger.warning(f"Could not retrain the local classifier: {e}")
+        finally:
+            with self.lock:
+                self.training = False
+
+    def rotate_log(self):
+        """Rewrite the log as the retained training window"""
+        # Caller holds the lock
+        temp = f"{self.log_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+            with open(temp, "w", encoding="utf-8") as f:
+                for text, label in self.examples:
+                    f.write(json.dumps({"text": text, "label": label}) + "\n")
+            os.replace(temp, self.log_path)
+            self.appended = len(self.examples)
+        except OSError as e:
+            logger.warning(f"Could not rotate the classification log: {e}")
+
+    def rule_label(self, text: str, db_graph=None):
+        """The rule tier's label on its own, or None; cheap enough to consult before any other work"""
+        if db_graph is not None:
+            self.rules.update_schema(db_graph)
+        decision = self.rules.classify(text)
+        return decision[0] if decision is not None else None
+
+    def classify_locally(self, text: str, db_graph=None):
+        """Return a label from the rule or model tier, or None when the LLM is needed"""
+        if db_graph is not None:
+            self.rules.update_schema(db_graph)
+
+        decision = self.rules.classify(text)
+        if decision is not None:
+            self.hits["rules"] += 1
+            return decision[0]
+
+        decision = self.model.classify(text)
+        if decision is not None and decision[1] >= self.model_threshold:
+            self.hits["model"] += 1
+            return decision[0]
+        return None
+
+    def classify(self, text: str, llm_classify, db_graph=None) -> str:
+        """Classify text, calling llm_classify(text) only as the last tier"""
+        label = self.classify_locally(text, db_graph)
+        if label is not None:
+            return label
+
+        self.hits["llm"] += 1
+        label = llm_classify(text)
+        if label in CATEGORIES:
+            self.record(text, label)
+        return label
+
+    async def aclassify(self, text: str, allm_classify, db_graph=None) -> str:
+        """Async variant of classify for the streaming request path"""
+        label = self.classify_locally(text, db_graph)
+        if label is not None:
+            return label
+
+        self.hits["llm"] += 1
+        label = await allm_classify(text)
+        if label in CATEGORIES:
+            self.record(text, label)
+        return label
+
+    def hit_rates(self) -> dict:
+        """Fraction of classifications decided by each tier"""
+        total = sum(self.hits.values())
+        return {tier: self.hits[tier] / total if total else 0.0 for tier in ("rules", "model", "llm")}
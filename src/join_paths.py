@@ -0,0 +1,189 @@
+import logging
+import threading
+import networkx as nx
+from networkx.algorithms.approximation import steiner_tree
+from schema_cache import schema_cache
+from schema_introspector import SchemaIntrospector
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+
+class UnreachableTables(ValueError):
+    """Some requested tables share no foreign-key route with the others, so no single join covers them."""
+
+    def __init__(self, root: str, tables: list):
+        super().__init__(f"No foreign-key route from {root} to {', '.join(tables)}")
+        self.root = root
+        self.tables = tables
+
+
+class JoinPlanner:
+    """Table-level join graph built from foreign-key edges, with precomputed shortest join paths."""
+
+    def __init__(self, db_graph: nx.Graph, table_graph: nx.Graph = None, paths: dict = None):
+        self.table_graph = table_graph if table_graph is not None else self.build_table_graph(db_graph)
+
+        # One BFS per table (all pairs) once per schema; every later lookup is a dictionary access
+        # Paths handed over from a previous planner are reused as they are
+        self.paths = dict(paths or {})
+        for table in self.table_graph:
+            if table not in self.paths:
+                self.paths[table] = nx.single_source_shortest_path(self.table_graph, table)
+        self.components = [set(component) for component in nx.connected_components(self.table_graph)]
+
+    @staticmethod
+    def build_table_graph(db_graph: nx.Graph) -> nx.Graph:
+        """Collapse column-to-column foreign-key edges into table-to-table join edges"""
+        owner = {}  # column node -> table name
+        table_graph = nx.Graph()
+        for node in db_graph.nodes():
+            data = db_graph.nodes[node]
+            if "tableName" not in data:
+                continue
+            table_graph.add_node(data["tableName"])
+            for neighbor in db_graph.neighbors(node):
+                if "columnName" in db_graph.nodes[neighbor]:
+                    owner[neighbor] = data["tableName"]
+
+        for left, right in db_graph.edges():
+            if left not in owner or right not in owner:
+                continue  # table-to-column membership edge
+            left_table, right_table = owner[left], owner[right]
+            if left_table == right_table:
+                continue  # self references (e.g. ReportsTo) never help connect two tables
+
+            condition = (left_table, db_graph.nodes[left]["columnName"], right_table, db_graph.nodes[right]["columnName"])
+            if table_graph.has_edge(left_table, right_table):
+                table_graph[left_table][right_table]["conditions"].append(condition)
+            else:
+                table_graph.add_edge(left_table, right_table, conditions=[condition])
+        return table_graph
+
+    @staticmethod
+    def table_edges(db_graph: nx.Graph, table: str) -> list:
+        """(other table, condition) for every foreign-key edge between a table's columns and another table's"""
+        edges = []
+        for column in db_graph.neighbors(table):
+            if "columnName" not in db_graph.nodes[column]:
+                continue
+            for other in db_graph.neighbors(column):
+                other_table = next((n for n in db_graph.neighbors(other) if "tableName" in db_graph.nodes[n]), None)
+                if other == table or other_table in (None, table):
+                    continue
+                edges.append((other_table, (table, db_graph.nodes[column]["columnName"], other_table,
+                                            db_graph.nodes[other]["columnName"])))
+        return edges
+
+    def update(self, db_graph: nx.Graph, changes: dict) -> "JoinPlanner":
+        """A new planner for the patched graph, recomputing paths only in the components the change touched"""
+        stale = set(changes["removed"]) | set(changes["changed"])
+        rebuilt = set(changes["added"]) | set(changes["changed"])
+        table_graph = self.table_graph.copy()
+        table_graph.remove_nodes_from(stale)
+        for table in rebuilt:
+            table_graph.add_node(table)
+            for other, condition in self.table_edges(db_graph, table):
+                if not table_graph.has_edge(table, other):
+                    table_graph.add_edge(table, other, conditions=[])
+                conditions = table_graph[table][other]["conditions"]
+                reverse = (condition[2], condition[3], condition[0], condition[1])
+                if condition not in conditions and reverse not in conditions:
+                    conditions.append(condition)
+
+        # Paths depend only on which tables are joined, and never leave a connected component: when a
+        # change moved join edges, only the components on either side of it need new paths
+        moved = {table for table in stale | rebuilt
+                 if (table in self.table_graph) != (table in table_graph)
+                 or (table in table_graph and set(self.table_graph[table]) != set(table_graph[table]))}
+        affected = set()
+        for component in self.components + [set(c) for c in nx.connected_components(table_graph)]:
+            if component & moved:
+                affected |= component
+        paths = {table: path for table, path in self.paths.items() if table not in affected}
+        return JoinPlanner(db_graph, table_graph, paths)
+
+    def shortest_path(self, source: str, target: str):
+        """Tables on the shortest join route between two tables, or None if unconnected"""
+        return self.paths.get(source, {}).get(target)
+
+    def join_tree(self, tables: list) -> nx.Graph:
+        """Smallest set of joins connecting the tables (approximate Steiner tree for three or more)"""
+        terminals = [table for table in dict.fromkeys(tables) if table in self.table_graph]
+        tree = nx.Graph()
+        tree.add_nodes_from(terminals)
+        if len(terminals) < 2:
+            return tree
+
+        if len(terminals) == 2:
+            path = self.shortest_path(*terminals)
+            if path:
+                nx.add_path(tree, path)
+            return tree
+
+        # Steiner trees are only defined within one connected component
+        for component in self.components:
+            group = [table for table in terminals if table in component]
+            if len(group) == 2:
+                nx.add_path(tree, self.shortest_path(*group))
+            elif len(group) > 2:
+                tree.add_edges_from(steiner_tree(self.table_graph.subgraph(component), group).edges())
+        return tree
+
+    def join_clauses(self, tables: list) -> list:
+        """Ready-made FROM/JOIN clauses connecting the tables, starting from the first one
+
+        Raises UnreachableTables rather than returning a join that silently leaves some tables out.
+        """
+        terminals = [table for table in dict.fromkeys(tables) if table in self.table_graph]
+        if len(terminals) < 2:
+            return []
+        tree = self.join_tree(terminals)
+
+        root = terminals[0]
+        unreachable = [table for table in terminals if table not in nx.node_connected_component(tree, root)]
+        if unreachable:
+            raise UnreachableTables(root, unreachable)
+        quote = SchemaIntrospector.quote  # Names such as "Order Details" or "Group" must survive as identifiers
+        clauses = [f"FROM {quote(root)}"]
+        for parent, child in nx.bfs_edges(tree, root):
+            # When two tables share several foreign keys the first declared one is used
+            left_table, left_column, right_table, right_column = self.table_graph[parent][child]["conditions"][0]
+            clauses.append(f"JOIN {quote(child)} ON {quote(left_table)}.{quote(left_column)} = "
+                           f"{quote(right_table)}.{quote(right_column)}")
+        return clauses
+
+
+# One planner per schema fingerprint, shared by every inference step in the process
+_planners = {}
+_lock = threading.Lock()
+
+
+def get_join_planner(db_graph: nx.Graph) -> JoinPlanner:
+    """Return the join planner for this graph, building it once per schema fingerprint"""
+    key = db_graph.graph.get("fingerprint") or id(db_graph)
+    planner = _planners.get(key)
+    if planner is None:
+        with _lock:
+            planner = _planners.get(key)
+            if planner is None:
+                planner = JoinPlanner(db_graph)
+                logger.info(f"Precomputed join paths for {planner.table_graph.number_of_nodes()} tables")
+                _planners[key] = planner
+    return planner
+
+
+def update_planner(previous: nx.Graph, graph: nx.Graph, changes: dict):
+    """Schema change listener: carry the previous planner over to the patched graph, evicting the old entry"""
+    with _lock:
+        old = _planners.pop(previous.graph.get("fingerprint") or id(previous), None)
+        if old is None:
+            return
+        _planners[graph.graph["fingerprint"]] = old.update(graph, changes) if any(changes.values()) else old
+
+
+schema_cache.subscribe(update_planner)
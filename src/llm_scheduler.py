@@ -0,0 +1,383 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from tracing import metrics, annotate
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+LANES = {"interactive": 0, "normal": 1, "background": 2}  # Lower runs first
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+RATE_LIMIT_MARKERS = ("429", "rate limit", "ratelimit", "resource exhausted", "resourceexhausted", "quota")
+TRANSIENT_MARKERS = ("503", "500", "502", "504", "unavailable", "overloaded", "timed out", "timeout", "deadline",
+                     "connection reset", "connection error", "internalservererror")
+
+metrics.define("llm_queue_wait_seconds", "histogram", "Time LLM calls waited for the scheduler, by provider and lane")
+metrics.define("llm_scheduler_events_total", "counter", "LLM scheduler retries, sheds and queue timeouts by provider")
+
+_lane = ContextVar("llm_lane", default="normal")
+
+
+@contextmanager
+def llm_lane(lane: str):
+    """Run every LLM call made in this block in the given priority lane"""
+    token = _lane.set(lane)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+class LLMOverloaded(RuntimeError):
+    """A call was shed, or waited too long, because the provider's queue was full."""
+
+
+def provider_of(model: str) -> str:
+    return "google" if model.startswith("gemini") else "groq"
+
+
+def error_kind(error: BaseException):
+    """Return "rate_limit", "transient" or None for an exception raised by a provider client"""
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    text = f"{type(error).__name__} {error}".lower()
+    if status == 429 or any(marker in text for marker in RATE_LIMIT_MARKERS):
+        return "rate_limit"
+    if status in RETRYABLE_STATUS or any(marker in text for marker in TRANSIENT_MARKERS):
+        return "transient"
+    return None
+
+
+class TokenBucket:
+    """Refills continuously at a per-minute rate and holds at most one minute's worth."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float, now: float) -> float:
+        """Seconds until amount is available; requests larger than the bucket wait for a full one"""
+        self.refill(now)
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+    def adjust(self, amount: float):
+        # Settle an estimate against the real usage; may go negative and hold back the next calls
+        self.level = min(self.capacity, self.level + amount)
+
+
+class Ticket:
+    """One call waiting for, or holding, a slot with its provider."""
+
+    def __init__(self, lane: str, tokens: int, seq: int, loop=None):
+        self.lane = lane
+        self.priority = LANES.get(lane, LANES["normal"])
+        self.tokens = tokens
+        self.seq = seq
+        self.enqueued = time.monotonic()
+        self.waited = 0.0
+        self.state = "waiting"  # granted, shed or abandoned
+        self.event = threading.Event()
+        self.loop = loop
+        self.future = loop.create_future() if loop is not None else None
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    def settle(self, state: str):
+        self.state = state
+        if self.future is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(lambda: self.future.done() or self.future.set_result(state))
+
+
+class LLMScheduler:
+    """Admission control for one provider: token buckets, a concurrency cap and a priority queue.
+
+    Calls queue by lane and arrival order and are granted a slot once the request and token buckets
+    allow it. A full queue sheds its lowest-priority waiter for a more urgent newcomer, or rejects the
+    newcomer. A rate-limit response pauses the whole provider, so waiting calls back off together.
+    """
+
+    def __init__(self, provider: str, requests_per_minute: float = None, tokens_per_minute: float = None,
+                 concurrency: int = None, max_queue: int = None, queue_timeout: float = None):
+        def setting(name, default):
+            return os.getenv(f"{name}_{provider.upper()}", os.getenv(name, default))
+
+        self.provider = provider
+        rpm = float(setting("LLM_RPM", "0")) if requests_per_minute is None else requests_per_minute
+        tpm = float(setting("LLM_TPM", "0")) if tokens_per_minute is None else tokens_per_minute
+        self.requests = TokenBucket(rpm) if rpm else None  # 0 means no limit
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.concurrency = concurrency or int(setting("LLM_CONCURRENCY", "8"))
+        self.max_queue = max_queue or int(setting("LLM_QUEUE_MAX", "64"))
+        self.queue_timeout = queue_timeout or float(setting("LLM_QUEUE_TIMEOUT", "60"))
+        self.max_retries = int(setting("LLM_MAX_RETRIES", "4"))
+        self.backoff_base = float(setting("LLM_BACKOFF_BASE", "0.5"))
+        self.backoff_cap = float(setting("LLM_BACKOFF_CAP", "30"))
+
+        self.queue = []  # Heap of waiting tickets
+        self.active = 0
+        self.paused_until = 0.0
+        self.timer = None
+        self.timer_due = 0.0
+        self.seq = itertools.count()
+        self.lock = threading.Lock()
+
+    def enqueue(self, lane: str, tokens: int, loop=None) -> Ticket:
+        ticket = Ticket(lane, tokens, next(self.seq), loop)
+        with self.lock:
+            if len(self.queue) >= self.max_queue:
+                victim = max(self.queue)
+                if not ticket < victim:
+                    self.event("shed")
+                    raise LLMOverloaded(f"{self.provider} queue is full ({self.max_queue} waiting)")
+                # The least urgent, most recent waiter makes room
+                self.queue.remove(victim)
+                heapq.heapify(self.queue)
+                victim.settle("shed")
+                self.event("shed")
+            heapq.heappush(self.queue, ticket)
+            self.dispatch()
+        return ticket
+
+    def dispatch(self):
+        # Caller holds the lock; grant slots in priority order while the limits allow
+        while self.queue and self.active < self.concurrency:
+            head = self.queue[0]
+            now = time.monotonic()
+            delay = max(self.paused_until - now,
+                        self.requests.delay(1, now) if self.requests else 0.0,
+                        self.tokens.delay(head.tokens, now) if self.tokens else 0.0)
+            if delay > 0:
+                self.wake_in(delay)
+                return
+            heapq.heappop(self.queue)
+            if self.requests:
+                self.requests.take(1)
+            if self.tokens:
+                self.tokens.take(head.tokens)
+            self.active += 1
+            waited = now - head.enqueued
+            metrics.observe("llm_queue_wait_seconds", waited, provider=self.provider, lane=head.lane)
+            head.waited = waited
+            head.settle("granted")
+
+    def wake_in(self, delay: float):
+        due = time.monotonic() + delay
+        if self.timer is not None and self.timer_due <= due:
+            return
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer, self.timer_due = threading.Timer(delay, self.redispatch), due
+        self.timer.daemon = True
+        self.timer.start()
+
+    def redispatch(self):
+        with self.lock:
+            self.timer = None
+            self.dispatch()
+
+    def abandon(self, ticket: Ticket) -> bool:
+        """Take a ticket out of the queue; False if it was granted meanwhile"""
+        with self.lock:
+            if ticket.state != "waiting":
+                return False
+            self.queue.remove(ticket)
+            heapq.heapify(self.queue)
+            ticket.state = "abandoned"
+            return True
+
+    def admitted(self, ticket: Ticket) -> Ticket:
+        if ticket.state == "shed":
+            raise LLMOverloaded(f"{self.provider} call shed for more urgent work")
+        annotate(queue_ms=round(ticket.waited * 1000, 3), lane=ticket.lane)
+        return ticket
+
+    def acquire(self, lane: str, tokens: int) -> Ticket:
+        ticket = self.enqueue(lane, tokens)
+        if not ticket.event.wait(self.queue_timeout) and self.abandon(ticket):
+            self.event("queue_timeout")
+            raise LLMOverloaded(f"Waited over {self.queue_timeout:g}s for a {self.provider} slot")
+        return self.admitted(ticket)
+
+    async def aacquire(self, lane: str, tokens: int) -> Ticket:
+        ticket = self.enqueue(lane, tokens, asyncio.get_running_loop())
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if self.abandon(ticket):
+                self.event("queue_timeout")
+                raise LLMOverloaded(f"Waited over {self.queue_timeout:g}s for a {self.provider} slot")
+        except asyncio.CancelledError:
+            if not self.abandon(ticket) and ticket.state == "granted":
+                self.release(ticket)
+            raise
+        return self.admitted(ticket)
+
+    def release(self, ticket: Ticket, used_tokens: int = None):
+        with self.lock:
+            self.active -= 1
+            if self.tokens and used_tokens is not None:
+                self.tokens.adjust(ticket.tokens - used_tokens)
+            self.dispatch()
+
+    def backoff(self, attempt: int, error: BaseException):
+        """Seconds to wait before retrying, or None when the error should be raised"""
+        kind = error_kind(error)
+        if kind is None or attempt >= self.max_retries:
+            return None
+        # Full jitter keeps callers that failed together from retrying together
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+        if kind == "rate_limit":
+            with self.lock:
+                self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        self.event("retry")
+        logger.warning(f"{self.provider} call failed ({kind}: {error}); retry {attempt + 1} in {delay:.2f}s")
+        return delay
+
+    def event(self, name: str):
+        metrics.increment("llm_scheduler_events_total", provider=self.provider, event=name)
+
+    def stats(self) -> dict:
+        with self.lock:
+            lanes = {}
+            for ticket in self.queue:
+                lanes[ticket.lane] = lanes.get(ticket.lane, 0) + 1
+            return {"active": self.active, "waiting": len(self.queue), "by_lane": lanes}
+
+
+def estimate_tokens(messages: list) -> int:
+    # Prompt size at about four characters a token plus a typical answer
+    return sum(len(str(message.content)) for message in messages) // 4 + int(os.getenv("LLM_OUTPUT_ESTIMATE", "256"))
+
+
+def used_tokens(message) -> int:
+    usage = getattr(message, "usage_metadata", None) or {}
+    return usage.get("total_tokens") or None
+
+
+class ScheduledChatModel(BaseChatModel):
+    """Chat model that sends every call to its client through the provider's scheduler.
+
+    The lane comes from a `lane` call argument (e.g. `llm.bind(lane="background")`), else from
+    the enclosing `llm_lane` block.
+    """
+
+    client: Any  # The provider's chat model
+    scheduler: Any  # LLMScheduler of that provider
+
+    @property
+    def _llm_type(self) -> str:
+        return f"scheduled-{self.client._llm_type}"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return self.client._identifying_params
+
+    def _get_ls_params(self, stop=None, **kwargs):
+        return self.client._get_ls_params(stop=stop, **kwargs)
+
+    @staticmethod
+    def client_config() -> dict:
+        # The client run must not inherit this run's callbacks, or streamed tokens would be reported twice
+        return {"callbacks": []}
+
+    def _generate(self, messages, stop=None, run_manager=None, lane=None, **kwargs) -> ChatResult:
+        tokens = estimate_tokens(messages)
+        for attempt in itertools.count():
+            ticket = self.scheduler.acquire(lane or _lane.get(), tokens)
+            try:
+                message = self.client.invoke(messages, self.client_config(), stop=stop, **kwargs)
+            except Exception as e:
+                self.scheduler.release(ticket)
+                delay = self.scheduler.backoff(attempt, e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            except BaseException:
+                self.scheduler.release(ticket)
+                raise
+            self.scheduler.release(ticket, used_tokens(message))
+            return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, lane=None, **kwargs) -> ChatResult:
+        tokens = estimate_tokens(messages)
+        for attempt in itertools.count():
+            ticket = await self.scheduler.aacquire(lane or _lane.get(), tokens)
+            try:
+                message = await self.client.ainvoke(messages, self.client_config(), stop=stop, **kwargs)
+            except Exception as e:
+                self.scheduler.release(ticket)
+                delay = self.scheduler.backoff(attempt, e)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                self.scheduler.release(ticket)
+                raise
+            self.scheduler.release(ticket, used_tokens(message))
+            return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, lane=None, **kwargs):
+        tokens = estimate_tokens(messages)
+        for attempt in itertools.count():
+            ticket = self.scheduler.acquire(lane or _lane.get(), tokens)
+            started, used, delay = False, None, None
+            try:
+                for chunk in self.client.stream(messages, self.client_config(), stop=stop, **kwargs):
+                    started = True
+                    used = used_tokens(chunk) or used
+                    yield ChatGenerationChunk(message=chunk)
+                return
+            except Exception as e:
+                # Once tokens have been passed on, a retry would repeat them
+                delay = None if started else self.scheduler.backoff(attempt, e)
+                if delay is None:
+                    raise
+            finally:
+                self.scheduler.release(ticket, used)
+            time.sleep(delay)
+
+    async def _astream(self, messages, stop=None, run_manager=None, lane=None, **kwargs):
+        tokens = estimate_tokens(messages)
+        for attempt in itertools.count():
+            ticket = await self.scheduler.aacquire(lane or _lane.get(), tokens)
+            started, used, delay = False, None, None
+            try:
+                async for chunk in self.client.astream(messages, self.client_config(), stop=stop, **kwargs):
+                    started = True
+                    used = used_tokens(chunk) or used
+                    yield ChatGenerationChunk(message=chunk)
+                return
+            except Exception as e:
+                delay = None if started else self.scheduler.backoff(attempt, e)
+                if delay is None:
+                    raise
+            finally:
+                self.scheduler.release(ticket, used)
+            await asyncio.sleep(delay)
@@ -0,0 +1,270 @@
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from tracing import metrics, annotate
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+CLIENT_CONFIG = {"callbacks": []}  # Inner runs must not report this run's streamed tokens a second time
+
+metrics.define("llm_route_seconds", "histogram", "Latency of routed LLM calls by model and stage")
+metrics.define("llm_hedges_total", "counter", "Hedged LLM requests by stage and outcome")
+
+
+class LatencyStats:
+    """Rolling latency and error samples per (model, stage)."""
+
+    def __init__(self, window: int = None):
+        self.window = window or int(os.getenv("LLM_LATENCY_WINDOW", "200"))
+        self.samples = {}  # (model, stage) -> deque of (seconds, ok)
+        self.lock = threading.Lock()
+
+    def record(self, model: str, stage: str, seconds: float, ok: bool):
+        with self.lock:
+            samples = self.samples.get((model, stage))
+            if samples is None:
+                samples = self.samples[(model, stage)] = deque(maxlen=self.window)
+            samples.append((seconds, ok))
+        metrics.observe("llm_route_seconds", seconds, model=model, stage=stage)
+
+    def percentile(self, model: str, stage: str, q: float, min_samples: int = 1):
+        """Nearest-rank percentile of successful calls, or None with fewer than min_samples"""
+        with self.lock:
+            durations = sorted(seconds for seconds, ok in self.samples.get((model, stage), ()) if ok)
+        if len(durations) < max(min_samples, 1):
+            return None
+        return durations[min(len(durations) - 1, max(0, round(q / 100 * len(durations)) - 1))]
+
+    def error_rate(self, model: str, stage: str, min_samples: int = 1) -> float:
+        with self.lock:
+            samples = list(self.samples.get((model, stage), ()))
+        if len(samples) < max(min_samples, 1):
+            return 0.0
+        return sum(1 for _, ok in samples if not ok) / len(samples)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            keys = list(self.samples)
+        return {f"{model}/{stage}": {"p50": self.percentile(model, stage, 50), "p95": self.percentile(model, stage, 95),
+                                     "errors": round(self.error_rate(model, stage), 3)} for model, stage in keys}
+
+
+# Shared by every routed model in the process
+latency_stats = LatencyStats()
+_hedge_pool = ThreadPoolExecutor(max_workers=int(os.getenv("LLM_HEDGE_WORKERS", "16")), thread_name_prefix="llm-hedge")
+
+
+class RoutedChatModel(BaseChatModel):
+    """Sends one pipeline stage to its configured model and hedges calls that run past its p95.
+
+    When the primary has not answered within its rolling p95 for this stage, the same request goes to
+    the alternate model; the first answer wins and the other call is cancelled. A failed primary fails
+    over to the alternate, and a primary whose recent error rate is too high is demoted for the stage.
+    """
+
+    stage: str
+    primary: str
+    alternate: str
+    models: dict  # Model name -> scheduled chat model
+    stats: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "routed"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"stage": self.stage, "primary": self.primary, "alternate": self.alternate}
+
+    def _get_ls_params(self, stop=None, **kwargs):
+        return self.models[self.primary]._get_ls_params(stop=stop, **kwargs)
+
+    @property
+    def latency(self) -> LatencyStats:
+        return self.stats or latency_stats
+
+    def order(self) -> tuple:
+        """(first, second) model names, demoting a primary that keeps failing"""
+        min_samples = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+        max_errors = float(os.getenv("LLM_ROUTE_MAX_ERROR_RATE", "0.5"))
+        if self.latency.error_rate(self.primary, self.stage, min_samples) > max_errors:
+            return self.alternate, self.primary
+        return self.primary, self.alternate
+
+    def hedge_delay(self, model: str, stage: str):
+        """Seconds to wait before hedging, or None while there is no basis for it"""
+        if os.getenv("LLM_HEDGING", "1") != "1":
+            return None
+        return self.latency.percentile(model, stage, float(os.getenv("LLM_HEDGE_PERCENTILE", "95")),
+                                       int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20")))
+
+    def settled(self, winner: str, first: str, route: str):
+        # route is None for a plain call, else "hedge" or "failover"
+        if route == "hedge":
+            outcome = "primary_won" if winner == first else "hedge_won"
+            metrics.increment("llm_hedges_total", stage=self.stage, outcome=outcome)
+        annotate(model=winner, route=route or "primary")
+
+    def timed(self, name: str, stage: str, func):
+        started = time.perf_counter()
+        try:
+            result = func()
+        except Exception:
+            self.latency.record(name, stage, time.perf_counter() - started, ok=False)
+            raise
+        self.latency.record(name, stage, time.perf_counter() - started, ok=True)
+        return result
+
+    async def atimed(self, name: str, stage: str, func):
+        started = time.perf_counter()
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            raise  # A cancelled loser says nothing about the model
+        except Exception:
+            self.latency.record(name, stage, time.perf_counter() - started, ok=False)
+            raise
+        self.latency.record(name, stage, time.perf_counter() - started, ok=True)
+        return result
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        first, second = self.order()
+        delay = self.hedge_delay(first, self.stage)
+
+        def call(name):
+            return self.timed(name, self.stage, lambda: self.models[name].invoke(
+                messages, CLIENT_CONFIG, stop=stop, **kwargs))
+
+        if delay is None:
+            # Nothing to hedge against yet, so stay on this thread and only fail over
+            try:
+                message, winner, route = call(first), first, None
+            except Exception as e:
+                metrics.increment("llm_hedges_total", stage=self.stage, outcome="failover")
+                logger.warning(f"{first} failed on {self.stage} ({e}), trying {second}")
+                message, winner, route = call(second), second, "failover"
+            self.settled(winner, first, route)
+            return ChatResult(generations=[ChatGeneration(message=message)])
+
+        def start(name):
+            # Copied context, so the call keeps its trace parent and scheduler lane on a pool thread
+            return _hedge_pool.submit(contextvars.copy_context().run, call, name)
+
+        futures = {start(first): first}
+        route, error = None, None
+        while futures:
+            done, _ = wait(futures, timeout=None if route else delay, return_when=FIRST_COMPLETED)
+            if not done:
+                route = "hedge"
+                metrics.increment("llm_hedges_total", stage=self.stage, outcome="fired")
+                futures[start(second)] = second
+                continue
+            for future in done:
+                name = futures.pop(future)
+                if future.exception() is None:
+                    # Threads cannot be interrupted; a running loser finishes and its answer is dropped
+                    for loser in futures:
+                        loser.cancel()
+                    self.settled(name, first, route)
+                    return ChatResult(generations=[ChatGeneration(message=future.result())])
+                error = future.exception()
+                if not route:
+                    route = "failover"
+                    metrics.increment("llm_hedges_total", stage=self.stage, outcome="failover")
+                    logger.warning(f"{name} failed on {self.stage} ({error}), trying {second}")
+                    futures[start(second)] = second
+        raise error
+
+    async def arace(self, first: str, second: str, stage: str, start, discard=None):
+        """Run start(name) for the first model, hedged with the second; return (winner, result)"""
+        delay = self.hedge_delay(first, stage)
+        tasks = {asyncio.ensure_future(self.atimed(first, stage, lambda: start(first))): first}
+        route, error = None, None
+        try:
+            while tasks:
+                done, _ = await asyncio.wait(tasks, timeout=None if route else delay,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    route = "hedge"
+                    metrics.increment("llm_hedges_total", stage=self.stage, outcome="fired")
+                    tasks[asyncio.ensure_future(self.atimed(second, stage, lambda: start(second)))] = second
+                    continue
+                winner = None
+                for task in done:
+                    name = tasks.pop(task)
+                    if task.exception() is not None:
+                        error = error or task.exception()
+                    elif winner is None:
+                        winner = (name, task.result())
+                    elif discard is not None:
+                        await discard(task.result())  # Both finished in the same instant
+                if winner is not None:
+                    self.settled(winner[0], first, route)
+                    return winner
+                if not route:
+                    route = "failover"
+                    metrics.increment("llm_hedges_total", stage=self.stage, outcome="failover")
+                    logger.warning(f"{first} failed on {self.stage} ({error}), trying {second}")
+                    tasks[asyncio.ensure_future(self.atimed(second, stage, lambda: start(second)))] = second
+            raise error
+        finally:
+            # Cancel the loser, or close it if it already got as far as a result
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled() and task.exception() is None and discard is not None:
+                    await discard(task.result())
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        first, second = self.order()
+        _, message = await self.arace(first, second, self.stage, lambda name: self.models[name].ainvoke(
+            messages, CLIENT_CONFIG, stop=stop, **kwargs))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        # Synchronous streams are not hedged: a stream cannot move threads once it has started
+        first, _ = self.order()
+        started = time.perf_counter()
+        stage = f"{self.stage}.first_token"
+        for i, chunk in enumerate(self.models[first].stream(messages, CLIENT_CONFIG, stop=stop, **kwargs)):
+            if i == 0:
+                self.latency.record(first, stage, time.perf_counter() - started, ok=True)
+            yield ChatGenerationChunk(message=chunk)
+        annotate(model=first, route="primary")
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        # Streams are hedged on the time to their first chunk, then the winner streams the rest
+        first, second = self.order()
+
+        async def open_stream(name):
+            iterator = self.models[name].astream(messages, CLIENT_CONFIG, stop=stop, **kwargs).__aiter__()
+            try:
+                return iterator, await iterator.__anext__()
+            except StopAsyncIteration:
+                return iterator, None
+
+        async def close_stream(opened):
+            await opened[0].aclose()
+
+        _, (iterator, chunk) = await self.arace(first, second, f"{self.stage}.first_token", open_stream,
+                                                discard=close_stream)
+        try:
+            if chunk is not None:
+                yield ChatGenerationChunk(message=chunk)
+            async for chunk in iterator:
+                yield ChatGenerationChunk(message=chunk)
+        finally:
+            await iterator.aclose()
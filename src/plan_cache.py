@@ -0,0 +1,227 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from schema_cache import database_fingerprint
+from tracing import metrics, annotate
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "plans")
+LITERAL = re.compile(
+    r"[\"']([^\"']+)[\"']"  # Quoted strings
+    r"|(\d+(?:\.\d+)?)"  # Numbers
+    r"|((?:[A-Z][\w/&'-]*)(?:\s+(?:of\s+|the\s+)?[A-Z][\w/&'-]*)*)"  # Capitalized phrases
+)
+SLOT = re.compile(r"\{(\d+)\}")
+STEP_REFERENCE = re.compile(r"\(after steps? [\d, and]+\)", re.IGNORECASE)
+FILLER = {
+    "a", "an", "the", "me", "please", "can", "could", "would", "you", "tell", "show", "list", "give", "get",
+    "find", "what", "which", "are", "is", "was", "were", "do", "does", "i", "we", "our", "all", "of",
+}
+# Words that change what a plan computes; similar templates must agree on every one of them
+OPERATORS = {
+    "min", "max", "minimum", "maximum", "lowest", "highest", "smallest", "largest", "least", "most", "fewest",
+    "top", "bottom", "first", "last", "earliest", "latest", "oldest", "newest", "best", "worst",
+    "asc", "ascending", "desc", "descending", "increasing", "decreasing",
+    "not", "no", "without", "except", "excluding", "never", "none", "only",
+    "count", "sum", "total", "average", "avg", "mean", "median", "number", "many", "much",
+    "more", "less", "fewer", "greater", "over", "under", "above", "below", "before", "after", "between",
+    "distinct", "unique", "each", "per", "every", "all", "any", "and", "or",
+}
+
+
+def question_template(question: str) -> tuple:
+    """Abstract literals out of a question: ("top {0} artists by {1}", ["5", "Rock"], ("num", "text"))"""
+    literals, kinds, parts, position = [], [], [], 0
+    for match in LITERAL.finditer(question):
+        quoted, number, phrase = match.groups()
+        value, start = quoted or number or phrase, match.start()
+        if phrase and not question[:start].strip():
+            # A capitalized first word is sentence case; a proper noun may still follow it
+            first, _, value = phrase.partition(" ")
+            start += len(first) + 1
+        if phrase and value in ("", "I"):
+            continue
+        parts.append(question[position:start])
+        parts.append("{%d}" % len(literals))
+        literals.append(value)
+        kinds.append("num" if number else "text")
+        position = match.end()
+    parts.append(question[position:])
+    template = re.sub(r"\s+", " ", "".join(parts).lower()).strip().rstrip("?!. ")
+    return template, literals, tuple(kinds)
+
+
+def template_tokens(template: str) -> frozenset:
+    """Content words of a template; slots count as words so "top {0}" differs from "top" """
+    words = re.findall(r"\{\d+\}|[a-z0-9_]+", template)
+    return frozenset(word.rstrip("s") if len(word) > 3 else word for word in words if word not in FILLER)
+
+
+def content_words(tokens: frozenset) -> frozenset:
+    """Template tokens without their slots"""
+    return frozenset(token for token in tokens if not SLOT.fullmatch(token))
+
+
+def operator_words(template: str) -> frozenset:
+    """Ordering, comparison, negation and aggregate words of a template"""
+    return frozenset(word for word in re.findall(r"[a-z]+", template) if word in OPERATORS)
+
+
+def similarity(a: frozenset, b: frozenset) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+class PlanCache:
+    """Persistent LRU of plans keyed by question template, re-instantiated with each question's literals.
+
+    A literal is only abstracted into a slot when the plan repeats it verbatim; otherwise it stays part of
+    the entry, so "Show Albums by AC/DC" can only be reused for questions that also ask about albums.
+    A similar template may differ only in filler words and slots, so "genre name" never serves
+    "customer name" however long the rest of the question is, and entries are only served for the schema fingerprint they were planned against.
+    """
+
+    def __init__(self, db_path: str, cache_dir: str = None, max_entries: int = None):
+        self.db_path = db_path
+        cache_dir = cache_dir or os.getenv("PLAN_CACHE_DIR", DEFAULT_CACHE_DIR)
+        self.path = os.path.join(cache_dir, hashlib.sha256(os.path.abspath(db_path).encode()).hexdigest()[:16]
+                                 + ".json")
+        self.max_entries = max_entries or int(os.getenv("PLAN_CACHE_MAX_ENTRIES", "512"))
+        self.entries = OrderedDict()  # template -> {"schema", "kinds", "fixed", "steps"}
+        self.tokens = {}  # template -> template_tokens(template)
+        self.lock = threading.Lock()
+        self.metrics = {"hits": 0, "similar_hits": 0, "misses": 0, "evictions": 0}
+        self.load()
+
+    def schema(self):
+        """Fingerprint of the database schema right now, or None when it cannot be read"""
+        try:
+            return database_fingerprint(self.db_path)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Could not fingerprint {self.db_path} for the plan cache: {e}")
+            return None
+
+    def get(self, question: str):
+        """Return the cached plan instantiated for this question, or None"""
+        template, literals, kinds = question_template(question)
+        schema = self.schema()
+        with self.lock:
+            match, score = self.lookup(template, literals, kinds, schema) if schema else (None, 0.0)
+            if match is None:
+                self.metrics["misses"] += 1
+                metrics.increment("cache_events_total", cache="plan", result="miss")
+                return None
+            self.entries.move_to_end(match)
+            entry = self.entries[match]
+            result = "hit" if match == template else "similar"
+            self.metrics["hits" if result == "hit" else "similar_hits"] += 1
+
+        metrics.increment("cache_events_total", cache="plan", result=result)
+        annotate(plan_cache_hit=True, plan_cache_similarity=round(score, 3))
+        return [SLOT.sub(lambda m: literals[int(m.group(1))], step) for step in entry["steps"]]
+
+    def lookup(self, template: str, literals: list, kinds: tuple, schema: str) -> tuple:
+        # Caller holds the lock; the exact template first, then ones with the same content and operator words
+        tokens, operators = template_tokens(template), operator_words(template)
+        words = content_words(tokens)
+        similar = [key for key in self.entries if key != template and content_words(self.tokens[key]) == words
+                   and operator_words(key) == operators]
+        candidates = [template] if template in self.entries else []
+        candidates += sorted(similar, key=lambda key: similarity(tokens, self.tokens[key]), reverse=True)
+
+        for key in candidates:
+            entry = self.entries[key]
+            if entry.get("schema") != schema or tuple(entry["kinds"]) != kinds:
+                continue
+            # Literals the plan depends on without naming them must be the same ones
+            if all(literals[int(slot)].lower() == value for slot, value in entry["fixed"].items()):
+                return key, similarity(tokens, self.tokens[key])
+        return None, 0.0
+
+    def put(self, question: str, steps: list):
+        """Store a plan from the LLM, with every literal it repeats replaced by its slot"""
+        template, literals, kinds = question_template(question)
+        if any(SLOT.search(step) for step in steps):
+            return  # Braces in the plan itself would be mistaken for slots
+        schema = self.schema()
+        if schema is None:
+            return
+
+        slotted, fixed = list(steps), {}
+        for slot, literal in enumerate(literals):
+            pattern = re.compile(r"(?<![\w/{{]){}(?![\w/}}])".format(re.escape(literal)))
+            found = False
+            for i, step in enumerate(slotted):
+                # "(after step 2)" is plan structure, never a literal from the question
+                references = STEP_REFERENCE.findall(step)
+                body = STEP_REFERENCE.sub("\0", step)
+                if pattern.search(body):
+                    found = True
+                    body = pattern.sub("{%d}" % slot, body)
+                    for reference in references:
+                        body = body.replace("\0", reference, 1)
+                    slotted[i] = body
+            if not found:
+                fixed[str(slot)] = literal.lower()
+
+        entry = {"schema": schema, "kinds": list(kinds), "fixed": fixed, "steps": slotted}
+        with self.lock:
+            if self.entries.get(template) == entry:
+                self.entries.move_to_end(template)
+                return  # Already stored, e.g. a cached plan remembered again
+            self.entries.pop(template, None)
+            self.entries[template] = entry
+            self.tokens[template] = template_tokens(template)
+            while len(self.entries) > self.max_entries:
+                oldest, _ = self.entries.popitem(last=False)
+                self.tokens.pop(oldest, None)
+                self.metrics["evictions"] += 1
+            self.save()
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                items = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable plan cache {self.path}: {e}")
+            return
+        # Saved oldest first, so the most recently used plans survive a smaller limit
+        for template, entry in items[-self.max_entries:]:
+            self.entries[template] = entry
+            self.tokens[template] = template_tokens(template)
+        logger.info(f"Loaded {len(self.entries)} cached plans from {self.path}")
+
+    def save(self):
+        # Caller holds the lock, so concurrent misses never write an older snapshot last
+        snapshot = json.dumps(list(self.entries.items()))
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(snapshot)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not persist plan cache: {e}")
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tokens.clear()
+            self.save()
+
+    def stats(self) -> dict:
+        lookups = self.metrics["hits"] + self.metrics["similar_hits"] + self.metrics["misses"]
+        hits = self.metrics["hits"] + self.metrics["similar_hits"]
+        return {**self.metrics, "entries": len(self.entries), "hit_rate": hits / lookups if lookups else 0.0}
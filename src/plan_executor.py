@@ -0,0 +1,155 @@
+import logging
+import os
+import re
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+# "(after step 2)", "(depends on steps 1 and 3)" - written by the planner when a step needs earlier results
+EXPLICIT_DEPENDENCY = re.compile(r"\s*\((?:after|depends on)\s+steps?\s+([\d,\s]+(?:and\s+\d+)?)\)", re.IGNORECASE)
+
+# Phrases that only make sense after an earlier query has produced something
+IMPLICIT_DEPENDENCY = re.compile(
+    r"\b(these|those|them|their|such|each of (them|these|those)|the (results?|above|previous|same)|"
+    r"previous(ly)?|earlier|from step \d+|in step \d+|found|identified|retrieved)\b",
+    re.IGNORECASE,
+)
+
+
+def parse_step(step: str):
+    """Split a plan line into (step_type, content, explicit 1-based dependencies)"""
+    step_type, content = step.split(':', 1)
+    dependencies = set()
+    match = EXPLICIT_DEPENDENCY.search(content)
+    if match:
+        dependencies = {int(n) for n in re.findall(r"\d+", match.group(1))}
+        content = EXPLICIT_DEPENDENCY.sub("", content)
+    return step_type.lower().strip(), content.strip(), dependencies
+
+
+def build_step_dag(steps: list) -> dict:
+    """Map each inference step index to the indices of the steps it depends on"""
+    dag = {}
+    for index, step in enumerate(steps):
+        if ':' not in step:
+            continue
+
+        step_type, content, explicit = parse_step(step)
+        if step_type != 'inference':
+            continue
+
+        if explicit:
+            # Explicit markers use the plan's own 1-based numbering and may only point backwards
+            dag[index] = {n - 1 for n in explicit if 0 < n <= index and (n - 1) in dag}
+        elif IMPLICIT_DEPENDENCY.search(content):
+            # Without markers we cannot tell which earlier query is meant, so wait for all of them
+            dag[index] = set(dag)
+        else:
+            dag[index] = set()
+    return dag
+
+
+class StepFailed(RuntimeError):
+    """A step returned instead of raising, but with an error rather than an answer."""
+
+
+class PlanExecutor:
+    """Run independent inference steps concurrently while keeping results in plan order."""
+
+    def __init__(self, max_workers: int = None, step_timeout: float = None):
+        self.max_workers = max_workers or int(os.getenv("PLAN_MAX_WORKERS", "4"))
+        self.step_timeout = step_timeout or float(os.getenv("PLAN_STEP_TIMEOUT", "120"))
+
+    def run(self, steps: list, run_inference, on_step_done=None) -> list:
+        """Execute the plan, calling run_inference(content) for each inference step
+
+        on_step_done(index, step, ok) is called from the calling thread as each inference step settles.
+        """
+        notify = on_step_done or (lambda index, step, ok: None)
+        results = [None] * len(steps)
+        dag = build_step_dag(steps)
+
+        # Non-inference steps need no work and are filled in immediately
+        for index, step in enumerate(steps):
+            if ':' not in step:
+                continue
+            if index not in dag:
+                results[index] = f"Step: {step}\nResult: {parse_step(step)[1]}"
+
+        pending = dict(dag)
+        failed = set()
+        running = {}  # future -> index
+        started = {}  # index -> time the step began on a worker, not when it was queued
+        # One thread per step, so an abandoned step never holds up the rest; max_workers bounds live steps
+        executor = ThreadPoolExecutor(max_workers=max(len(dag), 1), thread_name_prefix="plan-step")
+
+        def stamped(index, content):
+            started[index] = time.monotonic()
+            return run_inference(content)
+
+        try:
+            while pending or running:
+                # Skip steps whose dependencies failed, timed out or were cancelled
+                for index in [i for i, deps in pending.items() if deps & failed]:
+                    del pending[index]
+                    failed.add(index)
+                    results[index] = f"Step: {steps[index]}\nError: Cancelled because a step it depends on did not complete"
+                    notify(index, steps[index], False)
+
+                # Launch steps whose dependencies have all finished, up to max_workers at a time
+                ready = [i for i, deps in pending.items() if all(results[d] is not None for d in deps)]
+                for index in ready[:max(self.max_workers - len(running), 0)]:
+                    del pending[index]
+                    content = parse_step(steps[index])[1]
+                    # Copy the context so the step's spans and progress events attach to this run
+                    context = contextvars.copy_context()
+                    running[executor.submit(context.run, stamped, index, content)] = index
+
+                if not running:
+                    continue
+
+                # Wake up on the first completion or the earliest deadline of a step that has begun
+                now = time.monotonic()
+                deadlines = [started[index] + self.step_timeout for index in running.values() if index in started]
+                timeout = max(0.0, min(deadlines) - now) if deadlines else 0.05
+                done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    index = running.pop(future)
+                    try:
+                        results[index] = f"Step: {steps[index]}\nResult: {future.result()}"
+                        logger.info(f"Step {index + 1} finished in {time.monotonic() - started[index]:.2f}s")
+                        notify(index, steps[index], True)
+                    except StepFailed as e:
+                        logger.warning(f"Inference step {index + 1} failed: {e}")
+                        results[index] = f"Step: {steps[index]}\nError: Query failed - {str(e)}"
+                        failed.add(index)
+                        notify(index, steps[index], False)
+                    except Exception as e:
+                        logger.error(f"Error in inference step: {str(e)}", exc_info=True)
+                        results[index] = f"Step: {steps[index]}\nError: Query failed - {str(e)}"
+                        failed.add(index)
+                        notify(index, steps[index], False)
+
+                # Abandon steps that ran past their timeout; their dependents are cancelled above
+                # A running thread cannot be interrupted: it finishes in the background and its answer is dropped
+                now = time.monotonic()
+                for future, index in list(running.items()):
+                    if index in started and now - started[index] >= self.step_timeout:
+                        del running[future]
+                        failed.add(index)
+                        logger.warning(f"Step {index + 1} timed out after {self.step_timeout:.0f}s")
+                        results[index] = f"Step: {steps[index]}\nError: Query timed out after {self.step_timeout:.0f}s"
+                        notify(index, steps[index], False)
+        finally:
+            # Do not block the response on abandoned threads
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        return [result for result in results if result is not None]
@@ -1,5 +1,7 @@
 import logging
-from config import Config
+from config import Config, get_config
+from plan_cache import PlanCache
+from registry import registry
 from langchain_core.prompts import SystemMessagePromptTemplate, HumanMessagePromptTemplate, ChatPromptTemplate
 
 logging.basicConfig(
@@ -9,11 +11,16 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+FALLBACK_STEP = "General: I'd love to help you explore the database! What would you like to know?"
+ERROR_STEP = "General: Error occurred while creating plan"
+
 class PlannerAgent:
-    def __init__(self):
+    def __init__(self, config: Config = None):
          # Initialize configuration and planner prompt
-        self.config = Config()
+        self.config = config or get_config()
         self.planner_prompt = self.create_planner_prompt()
+        # Recurring question shapes reuse an earlier plan instead of another LLM round-trip
+        self.plan_cache = registry.get("plan_cache", lambda: PlanCache(self.config.db))
 
     def create_planner_prompt(self):
         """Define the system template for planning instructions"""
@@ -29,10 +36,13 @@ class PlannerAgent:
         - Steps must be in logical order
         - DO NOT repeat steps
         - Keep the plan minimal and focused
+        - If a step needs the results of an earlier step, end it with (after step N)
+        - Steps without (after step N) must be answerable on their own, they may run in parallel
 
         Example format:
         Inference: Get all artists from the database
         Inference: Count tracks per artist
+        Inference: Get the albums of the artist with the most tracks (after step 2)
         General: Provide the results in a friendly way
         """
 
@@ -45,25 +55,61 @@ class PlannerAgent:
             HumanMessagePromptTemplate.from_template(human_template)
         ])
 
-    def create_plan(self, question: str) -> list:
-        """ Generate a step-by-step plan to answer the given question"""
+    def create_plan(self, question: str, remember: bool = True) -> list:
+        """ Generate a step-by-step plan to answer the given question
+
+        With remember=False a new plan is not cached; speculative callers remember it once it is used.
+        """
+        plan = self.plan_cache.get(question)
+        if plan is not None:
+            logger.info(f"Reusing cached plan for question: {question}")
+            return plan
+
         try:
             logger.info(f"Creating plan for question: {question}")
-            response = self.config.llm.invoke(self.planner_prompt.format(
+            response = self.config.llm_for("plan").invoke(self.planner_prompt.format(
                 question=question
             ))
+            plan = self.parse_plan(response.content)
+            return self.remember_plan(question, plan) if remember else plan
 
-            # Extract and clean valid steps from the response
-            steps = [step.strip() for step in response.content.split('\n')
-                     if step.strip() and not step.lower() == 'plan:']
+        except Exception as e:
+            # Log and handle errors during plan creation
+            logger.error(f"Error creating plan: {str(e)}", exc_info=True)
+            return [ERROR_STEP]
 
-            # Provide a fallback message if no steps are returned
-            if not steps:
-                return ["General: I'd love to help you explore the database! What would you like to know?"]
+    async def acreate_plan(self, question: str, remember: bool = True) -> list:
+        """Async variant of create_plan"""
+        plan = self.plan_cache.get(question)
+        if plan is not None:
+            logger.info(f"Reusing cached plan for question: {question}")
+            return plan
 
-            return steps
+        try:
+            logger.info(f"Creating plan for question: {question}")
+            response = await self.config.llm_for("plan").ainvoke(self.planner_prompt.format(
+                question=question
+            ))
+            plan = self.parse_plan(response.content)
+            return self.remember_plan(question, plan) if remember else plan
 
         except Exception as e:
-            # Log and handle errors during plan creation
             logger.error(f"Error creating plan: {str(e)}", exc_info=True)
-            return ["General: Error occurred while creating plan"]
\ No newline at end of file
+            return [ERROR_STEP]
+
+    def remember_plan(self, question: str, plan: list) -> list:
+        """Cache a parsed plan, unless it is the fallback reply or the error reply"""
+        if plan not in ([FALLBACK_STEP], [ERROR_STEP]):
+            self.plan_cache.put(question, plan)
+        return plan
+
+    def parse_plan(self, content: str) -> list:
+        """Extract and clean valid steps from the planner response"""
+        steps = [step.strip() for step in content.split('\n')
+                 if step.strip() and not step.lower() == 'plan:']
+
+        # Provide a fallback message if no steps are returned
+        if not steps:
+            return [FALLBACK_STEP]
+
+        return steps
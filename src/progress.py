@@ -0,0 +1,14 @@
+import logging
+from langgraph.config import get_stream_writer
+
+logger = logging.getLogger(__name__)
+
+
+def emit_progress(event: str, **data):
+    """Send a progress event to stream_mode="custom" consumers; a no-op outside a streaming run"""
+    try:
+        writer = get_stream_writer()
+    except RuntimeError:
+        # Called outside of a LangGraph run (scripts, benchmarks)
+        return
+    writer({"event": event, **data})
@@ -0,0 +1,147 @@
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from tracing import metrics, annotate
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(text: str) -> str:
+    """Lower-case, collapse whitespace and drop trailing punctuation"""
+    return re.sub(r"\s+", " ", text.lower()).strip().rstrip("?!. ")
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapse whitespace and a trailing semicolon so equivalent SQL text shares an entry"""
+    return re.sub(r"\s+", " ", sql).strip().rstrip(";").strip()
+
+
+def entry_size(value) -> int:
+    """Approximate the memory held by a cached value in bytes"""
+    if isinstance(value, str):
+        return len(value.encode("utf-8", "ignore")) + 49
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """Thread-safe LRU cache with a TTL, an entry limit and a byte budget."""
+
+    def __init__(self, name: str, max_entries: int, max_bytes: int, ttl: float):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (value, size, stored_at)
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.metrics = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.metrics["misses"] += 1
+                metrics.increment("cache_events_total", cache=self.name, result="miss")
+                return None
+
+            value, size, stored_at = entry
+            if time.monotonic() - stored_at > self.ttl:
+                self.remove(key)
+                self.metrics["expired"] += 1
+                self.metrics["misses"] += 1
+                metrics.increment("cache_events_total", cache=self.name, result="expired")
+                return None
+
+            self.entries.move_to_end(key)
+            self.metrics["hits"] += 1
+            metrics.increment("cache_events_total", cache=self.name, result="hit")
+            annotate(**{f"{self.name}_hit": True})
+            return value
+
+    def put(self, key, value):
+        size = entry_size(value)
+        if size > self.max_bytes:
+            # Never let one huge result flush the whole cache
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (value, size, time.monotonic())
+            self.bytes += size
+
+            # Evict least recently used entries until both limits hold
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self.remove(oldest)
+                self.metrics["evictions"] += 1
+
+    def remove(self, key):
+        # Caller holds the lock
+        _, size, _ = self.entries.pop(key)
+        self.bytes -= size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.metrics["hits"] + self.metrics["misses"]
+        return {
+            **self.metrics,
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "hit_rate": self.metrics["hits"] / lookups if lookups else 0.0,
+        }
+
+
+class QueryCache:
+    """Question -> SQL (per schema version) and SQL -> result (per data version) caches."""
+
+    def __init__(self, db_path: str):
+        self.db_path = os.path.abspath(db_path)
+        ttl = float(os.getenv("QUERY_CACHE_TTL", "3600"))
+        max_entries = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "1024"))
+        max_bytes = int(os.getenv("QUERY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+        self.sql_cache = LRUCache("sql", max_entries, max_bytes // 8, ttl)
+        self.result_cache = LRUCache("result", max_entries, max_bytes, ttl)
+
+        # data_version only moves for commits made by *other* connections, so this one stays open
+        self.conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+        self.conn_lock = threading.Lock()
+
+    def versions(self) -> tuple:
+        """Return (schema version key, data version key) for the database right now"""
+        stat = os.stat(self.db_path)
+        with self.conn_lock:
+            schema_version = self.conn.execute("PRAGMA schema_version").fetchone()[0]
+            data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        return schema_version, (data_version, stat.st_mtime_ns, stat.st_size)
+
+    def get_sql(self, question: str, schema_version):
+        return self.sql_cache.get((normalize_question(question), schema_version))
+
+    def put_sql(self, question: str, schema_version, sql: str):
+        self.sql_cache.put((normalize_question(question), schema_version), normalize_sql(sql))
+
+    def get_result(self, sql: str, data_version):
+        return self.result_cache.get((normalize_sql(sql), data_version))
+
+    def put_result(self, sql: str, data_version, result):
+        self.result_cache.put((normalize_sql(sql), data_version), result)
+
+    def stats(self) -> dict:
+        return {"sql": self.sql_cache.stats(), "result": self.result_cache.stats()}
@@ -0,0 +1,254 @@
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+from schema_introspector import SchemaIntrospector
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+# Authorizer actions a read-only query needs; anything else (writes, PRAGMA, ATTACH, ...) is denied
+ALLOWED_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE}
+
+# SQLite's own planner assumes about 10 rows per equality lookup on a non-unique index when there is no ANALYZE data
+EQUALITY_FANOUT = 10
+RANGE_SELECTIVITY = 0.25
+
+AGGREGATE = re.compile(r"\b(count|sum|avg|min|max|total|group_concat)\s*\(|\b(group\s+by|distinct|order\s+by)\b",
+                       re.IGNORECASE)
+HAS_LIMIT = re.compile(r"\blimit\s+\d+", re.IGNORECASE)
+TABLE_ALIAS = re.compile(r'\b(?:from|join)\s+("[^"]+"|\w+)(?:\s+(?:as\s+)?(?!on\b|using\b|where\b|join\b|left\b|inner\b'
+                         r'|cross\b|natural\b|group\b|order\b|limit\b)(\w+))?', re.IGNORECASE)
+
+
+class GuardVerdict:
+    """What to do with a query: run it as is, run a rewritten version, or send it back."""
+
+    def __init__(self, action: str, sql: str, reason: str = None, cost: float = 0.0, findings: list = None,
+                 plan: list = None):
+        self.action = action  # "run", "rewrite" or "reject"
+        self.sql = sql  # The SQL to execute when not rejected
+        self.reason = reason
+        self.cost = cost  # Estimated row visits
+        self.findings = findings or []
+        self.plan = plan or []  # EXPLAIN QUERY PLAN lines, indented by depth
+
+    @property
+    def rejected(self) -> bool:
+        return self.action == "reject"
+
+    def feedback(self) -> str:
+        """Error text for the agent, with the plan so it can write a cheaper query"""
+        lines = [f"Error: query rejected by the guardrail: {self.reason}"]
+        if self.findings:
+            lines.append("Findings:")
+            lines.extend(f"- {finding}" for finding in self.findings)
+        if self.plan:
+            lines.append("Query plan:")
+            lines.extend(self.plan)
+            lines.append("Rewrite the query with indexed join conditions, tighter filters or aggregation in SQL.")
+        return "\n".join(lines)
+
+
+class QueryGuard:
+    """Checks generated SQL before it runs: read-only, and cheap enough according to EXPLAIN QUERY PLAN."""
+
+    def __init__(self, pool, max_cost: float = None, scan_rows: int = None, row_limit: int = None,
+                 timeout: float = None):
+        self.pool = pool
+        self.max_cost = max_cost or float(os.getenv("GUARD_MAX_COST", "5000000"))  # Estimated row visits
+        self.scan_rows = scan_rows or int(os.getenv("GUARD_SCAN_ROWS", "100000"))  # "Large table" threshold
+        self.row_limit = row_limit or int(os.getenv("GUARD_ROW_LIMIT", "1000"))  # LIMIT added by rewrites
+        self.timeout = timeout or float(os.getenv("QUERY_TIMEOUT_SECONDS", "15"))  # Hard statement timeout
+        self.introspector = SchemaIntrospector(pool.db_path)
+        self.row_counts = {}  # table name (lower case) -> estimated rows
+        self.data_version = None  # Data version the row estimates were taken at
+        self.lock = threading.Lock()
+
+    def check(self, sql: str) -> GuardVerdict:
+        """Decide whether a statement may run, and in which form"""
+        sql = (sql or "").strip().rstrip(";").strip()
+        if not sql:
+            return GuardVerdict("reject", sql, "empty query")
+        # The newline ends a trailing "--" comment; a second statement fails the single prepare in explain
+        if not sqlite3.complete_statement(sql + "\n;"):
+            return GuardVerdict("reject", sql, "incomplete statement")
+        if not re.match(r"^\s*(select|with)\b", sql, re.IGNORECASE):
+            return GuardVerdict("reject", sql, "only SELECT queries are allowed")
+
+        try:
+            plan_rows, tables = self.explain(sql)
+        except sqlite3.ProgrammingError as e:
+            # Raised for "You can only execute one statement at a time."
+            return GuardVerdict("reject", sql, f"only a single statement is allowed ({e})")
+        except sqlite3.Error as e:
+            return GuardVerdict("reject", sql, str(e))
+
+        aliases = self.aliases(sql)
+        cost, findings, sorts = self.estimate(plan_rows, aliases)
+        plan = self.format_plan(plan_rows)
+        if cost <= self.max_cost:
+            return GuardVerdict("run", sql, cost=cost, findings=findings, plan=plan)
+
+        # A LIMIT only bounds the work when rows stream straight out; sorts and aggregates read everything first
+        streaming = not sorts and not AGGREGATE.search(sql)
+        if streaming and HAS_LIMIT.search(sql):
+            return GuardVerdict("run", sql, cost=cost, findings=findings, plan=plan)
+        if streaming:
+            logger.info(f"Guardrail added LIMIT {self.row_limit} to a query estimated at {cost:,.0f} row visits")
+            return GuardVerdict(
+                "rewrite", f"SELECT * FROM ({sql}\n) LIMIT {self.row_limit}",
+                reason=f"only the first {self.row_limit} rows were read; the full query was estimated at "
+                       f"{cost:,.0f} row visits",
+                cost=cost, findings=findings, plan=plan
+            )
+
+        logger.info(f"Guardrail rejected a query estimated at {cost:,.0f} row visits over {sorted(tables)}")
+        return GuardVerdict(
+            "reject", sql,
+            reason=f"estimated cost of {cost:,.0f} row visits exceeds the limit of {self.max_cost:,.0f}",
+            cost=cost, findings=findings, plan=plan
+        )
+
+    def explain(self, sql: str):
+        """Compile the query under a read-only authorizer; return its plan rows and the tables it reads"""
+        tables = set()
+
+        def authorizer(action, arg1, arg2, database, trigger):
+            if action not in ALLOWED_ACTIONS:
+                return sqlite3.SQLITE_DENY
+            if action == sqlite3.SQLITE_READ and arg1:
+                tables.add(arg1)
+            return sqlite3.SQLITE_OK
+
+        with self.pool.connection() as conn:
+            conn.set_authorizer(authorizer)
+            try:
+                # (id, parent, notused, detail)
+                plan_rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+            finally:
+                conn.set_authorizer(None)
+        return plan_rows, tables
+
+    @staticmethod
+    def aliases(sql: str) -> dict:
+        """Map every name that can appear in the plan (table or alias) to its table"""
+        mapping = {}
+        for table, alias in TABLE_ALIAS.findall(sql):
+            table = table.strip('"')
+            mapping[table.lower()] = table
+            if alias:
+                mapping[alias.lower()] = table
+        return mapping
+
+    def rows(self, table: str) -> int:
+        """Estimated rows in a table, looked up once per table"""
+        key = table.lower()
+        count = self.row_counts.get(key)
+        if count is None:
+            with self.lock, self.pool.connection() as conn:
+                try:
+                    count = self.introspector.estimate_rows(conn, table)
+                except sqlite3.Error:
+                    count = 0
+                self.row_counts[key] = count
+        return count
+
+    def refresh(self):
+        """Forget row estimates, e.g. after the data has grown"""
+        with self.lock:
+            self.row_counts.clear()
+
+    def observe(self, data_version):
+        """Refresh row estimates when the data version (see QueryCache.versions) has moved"""
+        with self.lock:
+            if data_version == self.data_version:
+                return
+            stale, self.data_version = self.data_version is not None, data_version
+        if stale:
+            self.refresh()
+
+    def estimate(self, plan_rows: list, aliases: dict):
+        """Walk the plan tree: (estimated row visits, findings, whether a temp b-tree sort is used)"""
+        children = {}
+        for node_id, parent, _unused, detail in plan_rows:
+            children.setdefault(parent, []).append((node_id, detail))
+
+        findings = []
+        derived = {}  # CTE / subquery name -> estimated rows it produces
+        state = {"sorts": False}
+
+        def size(name: str) -> int:
+            if name.lower() in derived:
+                return derived[name.lower()]
+            return self.rows(aliases.get(name.lower(), name))
+
+        def walk(parent: int):
+            """(cost, rows flowing out) of the sibling loops under one plan node"""
+            cost, loop_rows = 0.0, 1.0
+            for node_id, detail in children.get(parent, []):
+                words = detail.split()
+                if words[0] == "SCAN" and len(words) > 1:
+                    name = words[1]
+                    rows = max(size(name), 1)
+                    table = aliases.get(name.lower(), name)
+                    if loop_rows > 1 and name.lower() not in derived:
+                        findings.append(f"{table} is scanned in full for every row of the outer loop "
+                                        f"(a cartesian product or a join without a usable condition)")
+                    elif rows >= self.scan_rows:
+                        findings.append(f"full scan of {table} (~{rows:,} rows)")
+                    loop_rows *= rows
+                    cost += loop_rows
+                elif words[0] == "SEARCH" and len(words) > 1:
+                    name = words[1]
+                    rows = max(size(name), 1)
+                    if "AUTOMATIC" in detail:
+                        findings.append(f"the join on {aliases.get(name.lower(), name)} has no index; "
+                                        f"SQLite builds a temporary one on every run")
+                        cost += rows * math.log2(rows + 1)
+                    if "PRIMARY KEY" in detail and "=" in detail:
+                        fanout = 1
+                    elif ">" in detail or "<" in detail:
+                        fanout = max(rows * RANGE_SELECTIVITY, 1)
+                    else:
+                        fanout = min(EQUALITY_FANOUT, rows)
+                    cost += loop_rows * math.log2(rows + 1)
+                    loop_rows *= fanout
+                    cost += loop_rows
+                elif words[0] in ("MATERIALIZE", "CO-ROUTINE"):
+                    sub_cost, sub_rows = walk(node_id)
+                    derived[words[-1].lower()] = max(int(sub_rows), 1)
+                    cost += sub_cost
+                elif "SUBQUERY" in detail:
+                    sub_cost, _ = walk(node_id)
+                    # A correlated subquery runs once per outer row
+                    cost += sub_cost * (loop_rows if words[0] == "CORRELATED" else 1)
+                elif detail.startswith("USE TEMP B-TREE"):
+                    state["sorts"] = True
+                    cost += loop_rows * math.log2(loop_rows + 1)
+                else:
+                    # COMPOUND QUERY, UNION ALL and other grouping nodes: their parts add up
+                    sub_cost, sub_rows = walk(node_id)
+                    cost += sub_cost
+                    if children.get(node_id):
+                        loop_rows = max(loop_rows, sub_rows)
+            return cost, loop_rows
+
+        cost, _ = walk(0)
+        return cost, findings, state["sorts"]
+
+    @staticmethod
+    def format_plan(plan_rows: list) -> list:
+        """Indent plan lines by depth, like the sqlite3 shell does"""
+        depth = {0: 0}
+        lines = []
+        for node_id, parent, _unused, detail in plan_rows:
+            depth[node_id] = depth.get(parent, 0) + 1
+            lines.append("  " * depth[node_id] + detail)
+        return lines
@@ -0,0 +1,342 @@
+import asyncio
+import csv
+import io
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter
+import numpy as np
+from connection_pool import StatementTimeout, statement_timeout
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+FETCH_BATCH = int(os.getenv("QUERY_FETCH_BATCH", "1000"))
+PROMPT_MAX_ROWS = int(os.getenv("PROMPT_MAX_ROWS", "200"))
+INLINE_ROWS = int(os.getenv("RESULT_INLINE_ROWS", "200"))  # Larger results are summarized
+SAMPLE_ROWS = int(os.getenv("RESULT_SAMPLE_ROWS", "20"))  # Rows kept alongside a summary
+SCAN_CAP = int(os.getenv("RESULT_SCAN_CAP", "1000000"))  # Rows read at most when summarizing
+PAGE_SIZE = int(os.getenv("RESULT_PAGE_SIZE", "50"))
+
+
+def to_array(values: list) -> np.ndarray:
+    """Pick the tightest NumPy dtype that holds a column: int64, float64 (NULL as NaN) or object"""
+    present = [value for value in values if value is not None]
+    if present and len(present) == len(values) and all(type(value) is int for value in present):
+        try:
+            return np.array(values, dtype=np.int64)
+        except OverflowError:
+            pass
+    if present and all(type(value) in (int, float) for value in present):
+        return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+class QueryResult:
+    """Column names plus one NumPy array per column; rendered to text only at the edge."""
+
+    def __init__(self, columns: list, arrays: list, error: str = None, summary: "ResultSummary" = None,
+                 notice: str = None):
+        self.columns = columns
+        self.arrays = arrays
+        self.error = error
+        self.summary = summary  # Set when the rows are only a sample of a larger result
+        self.notice = notice  # Set when the query was changed before running, e.g. a LIMIT was added
+        self.sql = None  # The checked SQL that produced the rows, for paging through the rest
+
+    @property
+    def truncated(self) -> bool:
+        """Whether prompts only see part of the rows, so the full result is worth paging"""
+        return self.summary is not None or len(self) > PROMPT_MAX_ROWS
+
+    @classmethod
+    def failed(cls, message: str) -> "QueryResult":
+        return cls([], [], error=message)
+
+    def __len__(self) -> int:
+        return len(self.arrays[0]) if self.arrays else 0
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the result, used for cache budgets"""
+        total = 0
+        for array in self.arrays:
+            total += array.nbytes
+            if array.dtype == object:
+                total += sum(len(value) if isinstance(value, (str, bytes)) else 8 for value in array)
+        return total
+
+    def rows(self, limit: int = None):
+        """Iterate rows as tuples, converting NumPy scalars back to Python values"""
+        count = len(self) if limit is None else min(limit, len(self))
+        for i in range(count):
+            yield tuple(self.value(array[i]) for array in self.arrays)
+
+    @staticmethod
+    def value(item):
+        if isinstance(item, np.generic):
+            item = item.item()
+        if isinstance(item, float) and np.isnan(item):
+            return None
+        return item
+
+    def to_csv(self, max_rows: int = None) -> str:
+        """Render as CSV with a header row"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow(self.columns)
+        writer.writerows(self.rows(max_rows))
+        return buffer.getvalue()
+
+    def to_markdown(self, max_rows: int = 50) -> str:
+        """Render as a Markdown table for the UI"""
+        if self.error:
+            return self.error
+        lines = ["| " + " | ".join(self.columns) + " |", "|" + "---|" * len(self.columns)]
+        for row in self.rows(max_rows):
+            lines.append("| " + " | ".join("" if value is None else str(value) for value in row) + " |")
+        if len(self) > max_rows:
+            lines.append(f"\n_{len(self) - max_rows} more rows not shown_")
+        return "\n".join(lines)
+
+    def to_prompt(self, max_rows: int = None) -> str:
+        """Compact CSV for LLM prompts, with an explicit note when rows are cut"""
+        if self.error:
+            return self.error
+        if self.summary is not None:
+            text = f"{self.summary.to_prompt()}\nFirst {len(self)} rows:\n{self.to_csv().rstrip()}"
+        else:
+            max_rows = PROMPT_MAX_ROWS if max_rows is None else max_rows
+            text = self.to_csv(max_rows).rstrip("\n")
+            if len(self) > max_rows:
+                text += f"\n... {len(self) - max_rows} more rows ({len(self)} total)"
+        return f"Note: {self.notice}\n{text}" if self.notice else text
+
+    def __str__(self) -> str:
+        return self.to_prompt()
+
+
+class ResultSummary:
+    """Single-pass aggregates over a row stream: counts, NULLs, min/max, top values and histograms."""
+
+    def __init__(self, columns: list, top_k: int = 5, reservoir_size: int = 2000, counter_capacity: int = 5000):
+        self.columns = columns
+        self.top_k = top_k
+        self.reservoir_size = reservoir_size
+        self.counter_capacity = counter_capacity
+        self.row_count = 0
+        self.capped = False  # True when the scan stopped at the row cap
+        self.nulls = [0] * len(columns)
+        self.minimum = [None] * len(columns)
+        self.maximum = [None] * len(columns)
+        self.counters = [Counter() for _ in columns]
+        self.reservoirs = [[] for _ in columns]  # Numeric sample for histograms
+        self.numeric_seen = [0] * len(columns)
+        self.random = random.Random(0)
+
+    def add(self, row: tuple):
+        self.row_count += 1
+        for i, value in enumerate(row):
+            if value is None:
+                self.nulls[i] += 1
+                continue
+
+            try:
+                if self.minimum[i] is None or value < self.minimum[i]:
+                    self.minimum[i] = value
+                if self.maximum[i] is None or value > self.maximum[i]:
+                    self.maximum[i] = value
+            except TypeError:
+                pass  # Mixed types in one SQLite column are not comparable
+
+            # Bounded frequency counts: when full, drop the rarest half (approximate heavy hitters)
+            counter = self.counters[i]
+            counter[value] += 1
+            if len(counter) > self.counter_capacity:
+                for key, _ in counter.most_common()[self.counter_capacity // 2:]:
+                    del counter[key]
+
+            if type(value) in (int, float):
+                self.numeric_seen[i] += 1
+                reservoir = self.reservoirs[i]
+                if len(reservoir) < self.reservoir_size:
+                    reservoir.append(value)
+                else:
+                    slot = self.random.randrange(self.numeric_seen[i])
+                    if slot < self.reservoir_size:
+                        reservoir[slot] = value
+
+    def histogram(self, i: int, bins: int = 8):
+        """Histogram of a numeric column, estimated from its reservoir sample"""
+        if len(self.reservoirs[i]) < 2:
+            return None
+        counts, edges = np.histogram(np.array(self.reservoirs[i], dtype=np.float64), bins=bins)
+        return [(round(float(edges[j]), 4), round(float(edges[j + 1]), 4), int(counts[j])) for j in range(len(counts))]
+
+    def to_prompt(self) -> str:
+        scanned = f"{self.row_count}+ rows (scan capped)" if self.capped else f"{self.row_count} rows"
+        lines = [f"Result too large to include in full: {scanned}, {len(self.columns)} columns. Column summary:"]
+        for i, name in enumerate(self.columns):
+            parts = [f"nulls={self.nulls[i]}", f"min={self.minimum[i]}", f"max={self.maximum[i]}"]
+            top = self.counters[i].most_common(self.top_k)
+            if top and top[0][1] > 1:
+                # Skipped for key-like columns where every value is unique
+                parts.append("top=[" + ", ".join(f"{value}({count})" for value, count in top) + "]")
+            histogram = self.histogram(i) if len(self.counters[i]) > self.top_k else None
+            if histogram:
+                parts.append("histogram=" + " ".join(f"[{low}..{high}):{count}" for low, high, count in histogram))
+            lines.append(f"- {name}: " + "; ".join(parts))
+        return "\n".join(lines)
+
+
+def iter_rows(pool, sql: str, batch_size: int = None, timeout: float = None):
+    """Yield the column names first, then rows fetched in batches; the connection stays checked out while iterating"""
+    batch_size = batch_size or FETCH_BATCH
+    with pool.connection(timeout) as conn:
+        cursor = conn.execute(sql)
+        if cursor.description is None:
+            yield []
+            return
+        yield [description[0] for description in cursor.description]
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            for row in batch:
+                yield tuple(row)
+
+
+def execute(pool, sql: str, batch_size: int = None, inline_rows: int = None, sample_rows: int = None,
+            scan_cap: int = None, timeout: float = None) -> QueryResult:
+    """Run SQL on a read-only pool connection; raises on database errors
+
+    Results up to inline_rows come back whole. Larger ones keep only the first sample_rows rows
+    plus a ResultSummary computed in one pass over at most scan_cap rows, so memory stays bounded.
+    A timeout in seconds bounds the whole run, fetching included.
+    """
+    inline_rows = INLINE_ROWS if inline_rows is None else inline_rows
+    sample_rows = SAMPLE_ROWS if sample_rows is None else sample_rows
+    scan_cap = SCAN_CAP if scan_cap is None else scan_cap
+
+    rows = iter_rows(pool, sql, batch_size, timeout)
+    columns = next(rows)
+    head, summary = [], None
+    for row in rows:
+        if summary is None:
+            if len(head) < inline_rows:
+                head.append(row)
+                continue
+            # The result outgrew the inline limit: summarize everything seen so far and keep streaming
+            summary = ResultSummary(columns)
+            for seen in head:
+                summary.add(seen)
+            head = head[:sample_rows]
+
+        if summary.row_count >= scan_cap:
+            summary.capped = True
+            rows.close()  # Releases the connection without reading the remaining rows
+            break
+        summary.add(row)
+
+    arrays = [to_array(list(values)) for values in zip(*head)] if head else [to_array([]) for _ in columns]
+    return QueryResult(columns, arrays, summary=summary)
+
+
+async def aexecute(pool, sql: str, **options) -> QueryResult:
+    """Run execute in a worker thread so the event loop is never blocked on SQLite"""
+    return await asyncio.to_thread(execute, pool, sql, **options)
+
+
+class ResultPager:
+    """Server-side cursor over a query's full result, read one page at a time for the UI."""
+
+    def __init__(self, pool, sql: str, page_size: int = None, timeout: float = None):
+        self.sql = sql
+        self.page_size = page_size or PAGE_SIZE
+        self.timeout = timeout  # Per page, so one slow page cannot pin a core
+        self.page = 0
+        self.last = None  # Last non-empty page, shown again when the UI switches back to this pager
+        self.touched = time.monotonic()
+        # A dedicated connection, so an idle pager never holds one of the pool's slots
+        self.conn = pool.new_connection()
+        with statement_timeout(self.conn, timeout):
+            self.cursor = self.conn.execute(sql)
+        self.columns = [description[0] for description in self.cursor.description or []]
+        self.exhausted = False
+
+    def next_page(self) -> QueryResult:
+        """Return the next page; an empty result once the cursor is exhausted"""
+        self.touched = time.monotonic()
+        rows = []
+        if not self.exhausted:
+            try:
+                with statement_timeout(self.conn, self.timeout):
+                    rows = self.cursor.fetchmany(self.page_size)
+            except StatementTimeout as e:
+                logger.warning(f"Pager stopped: {e}")
+                self.exhausted = True
+                self.close()
+                return QueryResult.failed(str(e))
+        if len(rows) < self.page_size:
+            self.exhausted = True
+            self.close()
+        self.page += 1
+        arrays = [to_array(list(values)) for values in zip(*rows)] if rows else [to_array([]) for _ in self.columns]
+        result = QueryResult(self.columns, arrays)
+        if rows:
+            self.last = result
+        return result
+
+    def close(self):
+        try:
+            self.conn.close()
+        except sqlite3.Error:
+            pass
+
+
+class PagerRegistry:
+    """Open pagers by handle, closing ones left idle longer than the TTL."""
+
+    def __init__(self, ttl: float = 900, max_open: int = 64):
+        self.ttl = ttl
+        self.max_open = max_open
+        self.pagers = {}
+        self.lock = threading.Lock()
+
+    def open(self, pool, sql: str, timeout: float = None) -> str:
+        pager = ResultPager(pool, sql, timeout=timeout)
+        handle = uuid.uuid4().hex
+        with self.lock:
+            self.expire()
+            if len(self.pagers) >= self.max_open:
+                oldest = min(self.pagers, key=lambda key: self.pagers[key].touched)
+                self.pagers.pop(oldest).close()
+            self.pagers[handle] = pager
+        return handle
+
+    def get(self, handle: str):
+        if handle is None:
+            return None
+        with self.lock:
+            self.expire()
+            return self.pagers.get(handle)
+
+    def expire(self):
+        # Caller holds the lock
+        now = time.monotonic()
+        for handle in [h for h, pager in self.pagers.items() if now - pager.touched > self.ttl]:
+            self.pagers.pop(handle).close()
+
+
+# Shared by every UI session in this process
+pagers = PagerRegistry()
@@ -0,0 +1,63 @@
+import logging
+import threading
+import time
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+
+class ResourceRegistry:
+    """Process-wide registry that lazily builds each shared resource exactly once."""
+
+    def __init__(self):
+        self.resources = {}  # Resource name -> built object
+        self.timings = {}  # Resource name -> build time in seconds
+        self.lock = threading.RLock()  # Re-entrant, factories may depend on other resources
+
+    def get(self, name: str, factory):
+        """Return the named resource, building it with factory on first use"""
+        if name in self.resources:
+            return self.resources[name]
+
+        with self.lock:
+            # Another thread may have built it while we waited for the lock
+            if name in self.resources:
+                return self.resources[name]
+
+            started = time.perf_counter()
+            value = factory()
+            elapsed = time.perf_counter() - started
+
+            self.resources[name] = value
+            self.timings[name] = elapsed
+            logger.info(f"Built shared resource '{name}' in {elapsed * 1000:.1f} ms")
+            return value
+
+    def peek(self, name: str):
+        """Return the named resource if it has been built, without building it"""
+        return self.resources.get(name)
+
+    def override(self, name: str, value):
+        """Install a ready-made resource, e.g. a stand-in LLM for offline runs"""
+        with self.lock:
+            self.resources[name] = value
+            self.timings[name] = 0.0
+
+    def reset(self):
+        """Forget every resource so the next access rebuilds it"""
+        with self.lock:
+            self.resources.clear()
+            self.timings.clear()
+
+    def startup_report(self) -> dict:
+        """Return build times in milliseconds, slowest first"""
+        ordered = sorted(self.timings.items(), key=lambda item: item[1], reverse=True)
+        return {name: round(seconds * 1000, 1) for name, seconds in ordered}
+
+
+# Shared by every agent in this process
+registry = ResourceRegistry()
@@ -0,0 +1,208 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import networkx as nx
+from tracing import metrics
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "schema")
+
+
+def database_fingerprint(db_path: str) -> str:
+    """Fingerprint a SQLite file's schema by path, PRAGMA schema_version and a hash of its DDL
+
+    Data-only writes leave the fingerprint alone, so they never produce a new cache entry.
+    """
+    path = os.path.abspath(db_path)
+
+    # schema_version is bumped by SQLite on every DDL change; the DDL hash also tells apart a replaced file
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        schema_version = conn.execute("PRAGMA schema_version").fetchone()[0]
+        ddl = conn.execute("SELECT type, name, tbl_name, sql FROM sqlite_master ORDER BY type, name").fetchall()
+    finally:
+        conn.close()
+
+    ddl_hash = hashlib.sha256(json.dumps(ddl).encode()).hexdigest()
+    key = f"{path}|{schema_version}|{ddl_hash}"
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+class SchemaCache:
+    """Two-tier (in-process and on-disk) cache of schema graphs keyed by database fingerprint."""
+
+    def __init__(self, cache_dir: str = None):
+        self.cache_dir = cache_dir or os.getenv("SCHEMA_CACHE_DIR", DEFAULT_CACHE_DIR)
+        self.memory = {}  # db path -> (fingerprint, graph)
+        self.lock = threading.Lock()
+        self.hits = {"memory": 0, "disk": 0, "update": 0, "miss": 0}
+        self.listeners = []  # Called with (previous graph, new graph, changes) after an incremental update
+
+    def subscribe(self, listener):
+        """Register a derived cache to be told which tables changed when a graph is patched"""
+        self.listeners.append(listener)
+
+    def get_or_build(self, db_path: str, builder, updater=None) -> nx.Graph:
+        """Return the cached graph for the current database state or build and store a new one
+
+        With an updater, the last graph seen for this database is copied and patched by updater(graph), which
+        returns the changed tables, or None when only a full rebuild will do.
+        """
+        path = os.path.abspath(db_path)
+        fingerprint = database_fingerprint(path)
+
+        # Tier 1: graph already held by this process
+        cached = self.memory.get(path)
+        if cached is not None and cached[0] == fingerprint:
+            self.hits["memory"] += 1
+            metrics.increment("cache_events_total", cache="schema", result="memory")
+            return cached[1]
+
+        with self.lock:
+            # Another thread may have filled the entry while we waited
+            cached = self.memory.get(path)
+            if cached is not None and cached[0] == fingerprint:
+                self.hits["memory"] += 1
+                metrics.increment("cache_events_total", cache="schema", result="memory")
+                return cached[1]
+
+            # Tier 2: graph serialized by an earlier process or another worker
+            graph = self.load(fingerprint)
+            previous, changes = None, None
+            if graph is not None:
+                self.hits["disk"] += 1
+                metrics.increment("cache_events_total", cache="schema", result="disk")
+                logger.info(f"Loaded schema graph from disk cache ({fingerprint})")
+            else:
+                # Tier 3: patch the previous graph for this database, so only changed tables are re-read
+                previous = cached[1] if cached is not None else self.load_latest(path)
+                if previous is not None and updater is not None:
+                    graph = previous.copy()  # Readers of the previous graph keep a consistent view
+                    changes = updater(graph)
+                if changes is not None:
+                    self.hits["update"] += 1
+                    metrics.increment("cache_events_total", cache="schema", result="update")
+                    logger.info(f"Updated schema graph in place: {changes}")
+                else:
+                    self.hits["miss"] += 1
+                    metrics.increment("cache_events_total", cache="schema", result="miss")
+                    logger.info(f"Schema cache miss for {path}, running discovery")
+                    graph = builder()
+                graph.graph["fingerprint"] = fingerprint
+                self.store(fingerprint, graph)
+                self.store_latest(path, fingerprint)
+
+            self.memory[path] = (fingerprint, graph)
+            if changes is not None:
+                self.notify(previous, graph, changes)
+            return graph
+
+    def notify(self, previous: nx.Graph, graph: nx.Graph, changes: dict):
+        for listener in self.listeners:
+            try:
+                listener(previous, graph, changes)
+            except Exception as e:
+                # A derived cache that cannot update is rebuilt on its next use instead
+                name = getattr(listener, "__name__", repr(listener))  # partials and callable objects have none
+                logger.warning(f"Schema change listener {name} failed: {e}")
+
+    def publish(self, db_path: str, graph: nx.Graph) -> bool:
+        """Swap an enriched copy of the current graph in, e.g. once profiled; False when it was superseded"""
+        path = os.path.abspath(db_path)
+        fingerprint = graph.graph.get("fingerprint")
+        with self.lock:
+            cached = self.memory.get(path)
+            if cached is None or cached[0] != fingerprint:
+                return False
+            self.memory[path] = (fingerprint, graph)
+            self.store(fingerprint, graph)
+        return True
+
+    def peek(self, db_path: str):
+        """Return the in-process graph for a database without validating or building it"""
+        cached = self.memory.get(os.path.abspath(db_path))
+        return cached[1] if cached is not None else None
+
+    def invalidate(self, db_path: str = None):
+        """Drop in-process entries; a disk entry is deleted once a newer graph replaces it"""
+        with self.lock:
+            if db_path is None:
+                self.memory.clear()
+            else:
+                self.memory.pop(os.path.abspath(db_path), None)
+
+    def path_for(self, fingerprint: str) -> str:
+        return os.path.join(self.cache_dir, f"{fingerprint}.json")
+
+    def latest_path(self, db_path: str) -> str:
+        digest = hashlib.sha256(os.path.abspath(db_path).encode()).hexdigest()[:32]
+        return os.path.join(self.cache_dir, f"{digest}.latest")
+
+    def load_latest(self, db_path: str):
+        """The graph most recently stored for this database, whatever its fingerprint"""
+        try:
+            with open(self.latest_path(db_path), encoding="utf-8") as f:
+                fingerprint = f.read().strip()
+        except OSError:
+            return None
+        return self.load(fingerprint) if fingerprint else None
+
+    def store_latest(self, db_path: str, fingerprint: str):
+        """Point the database at its newest graph and delete the graph it supersedes"""
+        try:
+            target = self.latest_path(db_path)
+            try:
+                with open(target, encoding="utf-8") as f:
+                    superseded = f.read().strip()
+            except FileNotFoundError:
+                superseded = None
+            temp = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp, "w", encoding="utf-8") as f:
+                f.write(fingerprint)
+            os.replace(temp, target)
+            if superseded and superseded != fingerprint:
+                os.remove(self.path_for(superseded))
+        except FileNotFoundError:
+            pass  # Already pruned by another worker
+        except OSError as e:
+            logger.warning(f"Could not record the latest schema graph for {db_path}: {e}")
+
+    def load(self, fingerprint: str):
+        """Read a node-link JSON graph from the disk tier"""
+        try:
+            with open(self.path_for(fingerprint), encoding="utf-8") as f:
+                graph = nx.node_link_graph(json.load(f), edges="links")
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable schema cache entry {fingerprint}: {e}")
+            return None
+
+        graph.graph["fingerprint"] = fingerprint
+        return graph
+
+    def store(self, fingerprint: str, graph: nx.Graph):
+        """Write the graph as node-link JSON, atomically so concurrent workers never read a partial file"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            target = self.path_for(fingerprint)
+            temp = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp, "w", encoding="utf-8") as f:
+                # dumps (unlike dump) runs the C encoder: several times faster on large schemas
+                f.write(json.dumps(nx.node_link_data(graph, edges="links")))
+            os.replace(temp, target)
+        except OSError as e:
+            logger.warning(f"Could not write schema cache entry {fingerprint}: {e}")
+
+
+# Shared by every request handled in this process
+schema_cache = SchemaCache()
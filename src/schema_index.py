@@ -0,0 +1,286 @@
+import json
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter
+import numpy as np
+from schema_cache import schema_cache
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+# Everyday words for schema nouns common to most databases; a JSON file named by SCHEMA_SYNONYMS
+# adds the ones specific to a database, e.g. data/chinook_synonyms.json for the sample music store
+SYNONYMS = {
+    "customer": ["client", "buyer", "shopper"],
+    "employee": ["staff", "worker"],
+    "price": ["cost", "amount"],
+    "total": ["sum", "amount"],
+    "country": ["nation"],
+}
+
+
+def stem(word: str) -> str:
+    """Very light plural stripping so "songs" and "song" share a token"""
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def split_words(text: str) -> list:
+    """Split CamelCase, snake_case and prose into lower-case stemmed words"""
+    text = re.sub(r"(?<=[a-z0-9])(?=[A-Z])", " ", text)
+    return [stem(word) for word in re.findall(r"[a-z0-9]+", text.lower())]
+
+
+def load_synonyms() -> dict:
+    synonyms = {key: list(values) for key, values in SYNONYMS.items()}
+    path = os.getenv("SCHEMA_SYNONYMS")
+    if path:
+        try:
+            with open(path, encoding="utf-8") as f:
+                for key, values in json.load(f).items():
+                    synonyms.setdefault(stem(key.lower()), []).extend(values)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring synonym file {path}: {e}")
+    return {stem(key): [stem(v) for v in values] for key, values in synonyms.items()}
+
+
+class SchemaIndex:
+    """TF-IDF vectors for every table and column, searched with one matrix product."""
+
+    def __init__(self, vocabulary: dict, table_tf: np.ndarray, column_tf: np.ndarray, tables: list, columns: list):
+        self.vocabulary = vocabulary  # token -> column in the matrices
+        self.table_tf = table_tf  # (tables, vocabulary) log term frequencies, kept for incremental updates
+        self.column_tf = column_tf  # (columns, vocabulary)
+        self.tables = tables  # [table name]
+        self.columns = columns  # [{"name", "type", "table"}]
+
+        # Document frequencies come straight from the term-frequency rows, so removed tables drop out of them
+        documents = len(tables) + len(columns)
+        document_frequency = (table_tf > 0).sum(axis=0) + (column_tf > 0).sum(axis=0)
+        self.idf = (np.log((1 + documents) / (1 + document_frequency)) + 1.0).astype(np.float32)
+        self.idf[document_frequency == 0] = 0.0  # Tokens of removed tables weigh nothing, as if unknown
+        self.table_matrix = self.weigh(table_tf)  # Rows L2-normalised
+        self.column_matrix = self.weigh(column_tf)
+
+    @staticmethod
+    def documents(db_graph, tables: set = None):
+        """Token lists for every table (or only the given ones) and their columns"""
+        synonyms = load_synonyms()
+
+        def expand(words):
+            return words + [alias for word in words for alias in synonyms.get(word, [])]
+
+        names, columns, table_docs, column_docs = [], [], [], []
+        for node in db_graph.nodes():
+            data = db_graph.nodes[node]
+            if "tableName" not in data or (tables is not None and data["tableName"] not in tables):
+                continue
+
+            table_words = expand(split_words(data["tableName"]))
+            neighbour_words = []
+            for neighbor in db_graph.neighbors(node):
+                col_data = db_graph.nodes[neighbor]
+                if "columnName" not in col_data:
+                    continue
+                column_words = expand(split_words(col_data["columnName"]))
+                neighbour_words.extend(column_words)
+                columns.append({"name": col_data["columnName"], "type": col_data.get("columnType"),
+                                "table": data["tableName"]})
+                column_docs.append(column_words)
+
+            # The table's own name counts more than the names of its columns
+            names.append(data["tableName"])
+            table_docs.append(table_words * 3 + neighbour_words)
+        return names, columns, table_docs, column_docs
+
+    @classmethod
+    def build(cls, db_graph) -> "SchemaIndex":
+        """Build the index from the schema graph"""
+        tables, columns, table_docs, column_docs = cls.documents(db_graph)
+        vocabulary = {token: i for i, token in enumerate(sorted({t for doc in table_docs + column_docs for t in doc}))}
+        return cls(vocabulary, cls.term_frequencies(table_docs, vocabulary),
+                   cls.term_frequencies(column_docs, vocabulary), tables, columns)
+
+    def update(self, db_graph, changes: dict) -> "SchemaIndex":
+        """A new index with the changed tables' rows replaced; the other rows are reused as they are"""
+        stale = set(changes["removed"]) | set(changes["changed"])
+        rebuilt = set(changes["added"]) | set(changes["changed"])
+        keep_tables = [i for i, name in enumerate(self.tables) if name not in stale]
+        keep_columns = [i for i, column in enumerate(self.columns) if column["table"] not in stale]
+        tables, columns, table_docs, column_docs = self.documents(db_graph, rebuilt) if rebuilt else ([], [], [], [])
+
+        # New tokens get new matrix columns at the end; existing positions never move
+        vocabulary = dict(self.vocabulary)
+        for token in sorted({t for doc in table_docs + column_docs for t in doc} - vocabulary.keys()):
+            vocabulary[token] = len(vocabulary)
+        grow = ((0, 0), (0, len(vocabulary) - len(self.vocabulary)))
+
+        table_tf = np.vstack([np.pad(self.table_tf[keep_tables], grow), self.term_frequencies(table_docs, vocabulary)])
+        column_tf = np.vstack([np.pad(self.column_tf[keep_columns], grow),
+                               self.term_frequencies(column_docs, vocabulary)])
+        return SchemaIndex(vocabulary, table_tf, column_tf, [self.tables[i] for i in keep_tables] + tables,
+                           [self.columns[i] for i in keep_columns] + columns)
+
+    @staticmethod
+    def term_frequencies(documents: list, vocabulary: dict) -> np.ndarray:
+        """Log term frequencies of token lists, one row per document"""
+        matrix = np.zeros((len(documents), len(vocabulary)), dtype=np.float32)
+        for row, tokens in enumerate(documents):
+            for token, count in Counter(tokens).items():
+                column = vocabulary.get(token)
+                if column is not None:
+                    matrix[row, column] = 1.0 + math.log(count)
+        return matrix
+
+    def weigh(self, term_frequencies: np.ndarray) -> np.ndarray:
+        """Apply IDF weights and L2-normalise the rows"""
+        matrix = term_frequencies * self.idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1.0, norms)
+
+    def vectorize(self, documents: list) -> np.ndarray:
+        """Turn token lists into L2-normalised TF-IDF rows"""
+        return self.weigh(self.term_frequencies(documents, self.vocabulary))
+
+    def search(self, question: str, top_k: int = 5, min_score: float = 0.1) -> list:
+        """Return up to top_k relevant tables, each with the question's matching columns"""
+        query = self.vectorize([split_words(question)])[0]
+        if not query.any() or not self.tables:
+            return []
+
+        table_scores = self.table_matrix @ query
+        column_scores = self.column_matrix @ query if self.columns else np.zeros(0)
+
+        # A strongly matching column also makes its table relevant
+        boosted = table_scores.copy()
+        table_position = {name: i for i, name in enumerate(self.tables)}
+        for i in np.flatnonzero(column_scores >= min_score * 2):
+            position = table_position[self.columns[i]["table"]]
+            boosted[position] = max(boosted[position], 0.5 * column_scores[i])
+
+        k = min(top_k, len(self.tables))
+        candidates = np.argpartition(-boosted, k - 1)[:k]
+        ranked = [i for i in candidates[np.argsort(-boosted[candidates])] if boosted[i] >= min_score]
+
+        results = []
+        for i in ranked:
+            name = self.tables[i]
+            matches = [dict(self.columns[j], score=round(float(column_scores[j]), 3))
+                       for j in np.flatnonzero(column_scores >= min_score)
+                       if self.columns[j]["table"] == name]
+            matches.sort(key=lambda column: column["score"], reverse=True)
+            results.append({"name": name, "score": round(float(boosted[i]), 3), "columns": matches})
+        return results
+
+    def save(self, path: str):
+        """Persist the index as a compressed .npz file"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        tokens = sorted(self.vocabulary, key=self.vocabulary.get)
+        np.savez_compressed(
+            temp, table_tf=self.table_tf, column_tf=self.column_tf,
+            meta=np.array(json.dumps({"tokens": tokens, "tables": self.tables, "columns": self.columns})),
+        )
+        os.replace(temp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "SchemaIndex":
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            vocabulary = {token: i for i, token in enumerate(meta["tokens"])}
+            return cls(vocabulary, data["table_tf"], data["column_tf"], meta["tables"], meta["columns"])
+
+
+# One index per schema fingerprint, shared by every inference step in the process
+_indexes = {}
+_lock = threading.Lock()
+
+
+def index_path(fingerprint: str) -> str:
+    # Persisted next to the cached schema graph so other workers and restarts reuse it
+    return os.path.join(schema_cache.cache_dir, f"{fingerprint}.index.npz")
+
+
+def cached_index(fingerprint: str):
+    """The index for a fingerprint from memory or disk, without building one"""
+    index = _indexes.get(fingerprint)
+    path = index_path(fingerprint)
+    if index is None and os.path.exists(path):
+        try:
+            index = SchemaIndex.load(path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Rebuilding unreadable schema index {path}: {e}")
+    return index
+
+
+def keep_index(key, index: SchemaIndex, persist: bool):
+    _indexes[key] = index
+    if persist:
+        try:
+            index.save(index_path(key))
+        except OSError as e:
+            logger.warning(f"Could not persist schema index: {e}")
+
+
+def get_schema_index(db_graph) -> SchemaIndex:
+    """Return the index for this graph, loading it from disk or building it once per fingerprint"""
+    fingerprint = db_graph.graph.get("fingerprint")
+    key = fingerprint or id(db_graph)
+    index = _indexes.get(key)
+    if index is not None:
+        return index
+
+    with _lock:
+        index = _indexes.get(key)
+        if index is not None:
+            return index
+
+        index = cached_index(fingerprint) if fingerprint else None
+        if index is not None:
+            _indexes[key] = index
+            return index
+
+        index = SchemaIndex.build(db_graph)
+        logger.info(f"Built schema index over {len(index.tables)} tables and {len(index.columns)} columns")
+        keep_index(key, index, persist=bool(fingerprint))
+        return index
+
+
+def update_index(previous, graph, changes: dict):
+    """Schema change listener: derive the new graph's index from the previous one instead of rebuilding
+
+    The previous fingerprint's index is evicted and its file deleted, since that schema is gone.
+    """
+    fingerprint = previous.graph.get("fingerprint")
+    with _lock:
+        old = cached_index(fingerprint) if fingerprint else None
+        _indexes.pop(fingerprint or id(previous), None)
+        if old is None:
+            return  # Never built for the previous graph; built lazily for the new one
+        old_path, new_path = index_path(fingerprint), index_path(graph.graph["fingerprint"])
+        try:
+            if any(changes.values()):
+                keep_index(graph.graph["fingerprint"], old.update(graph, changes), persist=True)
+                os.remove(old_path)
+            else:
+                # No table changed: the same index serves the new fingerprint and its file moves along
+                _indexes[graph.graph["fingerprint"]] = old
+                os.replace(old_path, new_path)
+        except FileNotFoundError:
+            pass  # Never persisted, or already moved by another worker
+        except OSError as e:
+            logger.warning(f"Could not remove superseded schema index {old_path}: {e}")
+    logger.info(f"Updated schema index for {changes}")
+
+
+schema_cache.subscribe(update_index)
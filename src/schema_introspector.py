@@ -0,0 +1,142 @@
+import hashlib
+import logging
+import sqlite3
+import time
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+
+class SchemaIntrospector:
+    """Read the schema of a SQLite database straight from its catalog."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+
+    def connect(self) -> sqlite3.Connection:
+        """Open a read-only connection to the database file"""
+        return sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+
+    def introspect(self, tables: list = None) -> list:
+        """Return every user table (or only the named ones) in the same shape the discovery prompt asks the LLM for"""
+        started = time.perf_counter()
+        conn = self.connect()
+        try:
+            hashes = self.table_hashes(conn)
+            names = self.list_tables(conn) if tables is None else [name for name in tables if name in hashes]
+            tables = [dict(self.describe_table(conn, name), ddlHash=hashes[name]) for name in names]
+        finally:
+            conn.close()
+
+        logger.info(f"Introspected {len(tables)} tables in {(time.perf_counter() - started) * 1000:.1f} ms")
+        return tables
+
+    def list_tables(self, conn: sqlite3.Connection) -> list:
+        """List user tables, skipping SQLite's internal bookkeeping tables"""
+        rows = conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite\\_%' ESCAPE '\\' ORDER BY name"
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def table_hashes(self, conn: sqlite3.Connection = None) -> dict:
+        """Hash each user table's CREATE statement together with those of its indexes"""
+        own = conn is None
+        conn = conn or self.connect()
+        try:
+            rows = conn.execute(
+                "SELECT tbl_name, type, name, sql FROM sqlite_master WHERE type IN ('table', 'index') "
+                "AND tbl_name NOT LIKE 'sqlite\\_%' ESCAPE '\\' ORDER BY tbl_name, type DESC, name"
+            ).fetchall()
+        finally:
+            if own:
+                conn.close()
+
+        definitions = {}
+        for table, kind, name, sql in rows:
+            # Automatic indexes have no SQL; their names still change with the constraints behind them
+            definitions.setdefault(table, []).append(f"{kind} {name} {sql or ''}")
+        return {table: hashlib.sha256("\n".join(lines).encode()).hexdigest()[:16]
+                for table, lines in definitions.items() if lines[0].startswith("table ")}
+
+    def describe_table(self, conn: sqlite3.Connection, table: str) -> dict:
+        """Collect columns, primary key, foreign keys, indexes and a row estimate for one table"""
+        quoted = self.quote(table)
+
+        # PRAGMA foreign_key_list: (id, seq, table, from, to, on_update, on_delete, match)
+        foreign_keys = {}
+        parent_keys = {}  # Parent table -> its primary key columns, for bare REFERENCES clauses
+        for row in conn.execute(f"PRAGMA foreign_key_list({quoted})").fetchall():
+            target = row[4]
+            if target is None:
+                # A bare REFERENCES clause points at the parent's primary key, column seq of a composite one
+                if row[2] not in parent_keys:
+                    parent_keys[row[2]] = self.primary_key_columns(conn, row[2])
+                key = parent_keys[row[2]]
+                target = key[row[1]] if row[1] < len(key) else None
+            foreign_keys[row[3]] = {"table": row[2], "column": target}
+
+        # PRAGMA table_info: (cid, name, type, notnull, dflt_value, pk)
+        columns = []
+        primary_key = []
+        for cid, name, column_type, notnull, _default, pk in conn.execute(f"PRAGMA table_info({quoted})"):
+            if pk:
+                primary_key.append((pk, name))
+            columns.append({
+                "columnName": name,
+                "columnType": column_type,
+                "isOptional": not notnull and not pk,
+                "isPrimaryKey": bool(pk),
+                "foreignKeyReference": foreign_keys.get(name),
+            })
+
+        return {
+            "tableName": table,
+            "columns": columns,
+            "primaryKey": [name for _, name in sorted(primary_key)],
+            "indexes": self.list_indexes(conn, table),
+            "rowCount": self.estimate_rows(conn, table),
+        }
+
+    def primary_key_columns(self, conn: sqlite3.Connection, table: str) -> tuple:
+        """Return a table's primary key columns in key order; empty when it has none"""
+        columns = [(row[5], row[1]) for row in conn.execute(f"PRAGMA table_info({self.quote(table)})") if row[5]]
+        return tuple(name for _, name in sorted(columns))
+
+    def list_indexes(self, conn: sqlite3.Connection, table: str) -> list:
+        """List the indexes on a table with the columns they cover"""
+        indexes = []
+        # PRAGMA index_list: (seq, name, unique, origin, partial)
+        for row in conn.execute(f"PRAGMA index_list({self.quote(table)})"):
+            name, unique, origin = row[1], row[2], row[3]
+            columns = [info[2] for info in conn.execute(f"PRAGMA index_info({self.quote(name)})")]
+            indexes.append({"name": name, "columns": columns, "unique": bool(unique), "origin": origin})
+        return indexes
+
+    def estimate_rows(self, conn: sqlite3.Connection, table: str) -> int:
+        """Estimate the row count without a full table scan"""
+        # sqlite_stat1 is only present once ANALYZE has been run
+        try:
+            row = conn.execute(
+                "SELECT stat FROM sqlite_stat1 WHERE tbl = ? ORDER BY idx IS NOT NULL LIMIT 1", (table,)
+            ).fetchone()
+            if row and row[0]:
+                return int(row[0].split()[0])
+        except sqlite3.OperationalError:
+            pass
+
+        # MAX(rowid) is a single b-tree seek and a good upper bound for rowid tables
+        try:
+            row = conn.execute(f"SELECT MAX(rowid) FROM {self.quote(table)}").fetchone()
+            return int(row[0] or 0)
+        except sqlite3.OperationalError:
+            # WITHOUT ROWID tables have no rowid to seek on
+            return conn.execute(f"SELECT COUNT(*) FROM {self.quote(table)}").fetchone()[0]
+
+    @staticmethod
+    def quote(identifier: str) -> str:
+        """Quote an identifier for use inside a PRAGMA or query"""
+        return '"' + identifier.replace('"', '""') + '"'
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import os
+import threading
+from tracing import metrics, annotate
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+metrics.define("coalesced_total", "counter", "Requests that attached to an identical in-flight one, by level")
+
+
+class SingleFlightTimeout(TimeoutError):
+    """A waiter gave up on an in-flight computation it had attached to."""
+
+
+class Call:
+    """One in-flight synchronous computation and everything its waiters need."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Broadcast:
+    """One in-flight async stream, replayed to late subscribers and followed live."""
+
+    def __init__(self):
+        self.events = []
+        self.finished = False
+        self.error = None
+        self.changed = asyncio.Event()
+        self.subscribers = 0
+        self.task = None
+
+    def publish(self):
+        # Wake every subscriber, then arm a fresh event for the next change
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+class SingleFlight:
+    """Coalesces identical concurrent work: the first caller runs it, the rest share its outcome.
+
+    Keys only live while the work is in flight, so nothing is cached; the outcome, result or
+    exception, is handed to every caller that attached before it finished.
+    """
+
+    def __init__(self, name: str, timeout: float = None):
+        self.name = name
+        self.timeout = timeout or float(os.getenv("SINGLE_FLIGHT_TIMEOUT", "180"))  # Per waiter
+        self.calls = {}  # key -> Call
+        self.streams = {}  # key -> Broadcast
+        self.lock = threading.Lock()
+
+    def do(self, key, func):
+        """Run func() once for all concurrent callers with this key and return its result to each"""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+
+        if not leader:
+            self.attached()
+            if not call.done.wait(self.timeout):
+                raise SingleFlightTimeout(f"Gave up after {self.timeout:g}s waiting for an identical {self.name}")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            # Unregister before waking waiters, so later arrivals start a fresh computation
+            with self.lock:
+                self.calls.pop(key, None)
+            call.done.set()
+
+    async def astream(self, key, factory):
+        """Iterate the async iterator factory() once for all concurrent subscribers with this key"""
+        with self.lock:
+            broadcast = self.streams.get(key)
+            leader = broadcast is None
+            if leader:
+                broadcast = self.streams[key] = Broadcast()
+                # A task of its own, so one subscriber leaving does not stop the stream for the rest
+                broadcast.task = asyncio.ensure_future(self.pump(key, broadcast, factory))
+            broadcast.subscribers += 1
+        if not leader:
+            self.attached()
+
+        index = 0
+        try:
+            while True:
+                while index < len(broadcast.events):
+                    yield broadcast.events[index]
+                    index += 1
+                if broadcast.finished:
+                    if broadcast.error is not None:
+                        raise broadcast.error
+                    return
+                try:
+                    await asyncio.wait_for(broadcast.changed.wait(), self.timeout)
+                except asyncio.TimeoutError:
+                    raise SingleFlightTimeout(f"No progress for {self.timeout:g}s from the shared {self.name}")
+        finally:
+            with self.lock:
+                broadcast.subscribers -= 1
+                abandoned = broadcast.subscribers == 0 and not broadcast.finished
+                if abandoned and self.streams.get(key) is broadcast:
+                    self.streams.pop(key)
+            if abandoned:
+                broadcast.task.cancel()
+
+    async def pump(self, key, broadcast: Broadcast, factory):
+        try:
+            async for event in factory():
+                broadcast.events.append(event)
+                broadcast.publish()
+        except asyncio.CancelledError:
+            broadcast.error = SingleFlightTimeout(f"The shared {self.name} was cancelled")
+            raise
+        except Exception as e:
+            broadcast.error = e
+        finally:
+            with self.lock:
+                if self.streams.get(key) is broadcast:
+                    self.streams.pop(key)
+            broadcast.finished = True
+            broadcast.publish()
+
+    def attached(self):
+        metrics.increment("coalesced_total", level=self.name)
+        annotate(coalesced=True)
+        logger.info(f"Attached to an identical in-flight {self.name}")
@@ -0,0 +1,184 @@
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tracing import metrics, annotate
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+metrics.define("speculation_total", "counter", "Requests whose speculative planning and discovery was committed or discarded")
+metrics.define("speculative_seconds_total", "counter", "Time spent on speculative work by kind and outcome")
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def speculative_pool() -> ThreadPoolExecutor:
+    """The worker pool for sync speculation, created on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=int(os.getenv("SPECULATIVE_WORKERS", "8")),
+                                       thread_name_prefix="speculative")
+        return _pool
+
+
+class Work:
+    """Timing of one piece of speculative work, which may still be running when it is settled."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = None
+        self.ended = None
+
+    def seconds(self) -> float:
+        if self.started is None:
+            return 0.0  # Cancelled before it ran
+        return (self.ended or time.perf_counter()) - self.started
+
+    def run(self, func, *args):
+        self.started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.ended = time.perf_counter()
+
+    async def arun(self, func, *args):
+        self.started = time.perf_counter()
+        try:
+            return await func(*args)
+        finally:
+            self.ended = time.perf_counter()
+
+
+class SpeculationStats:
+    """Committed and wasted speculative seconds, for tuning whether speculation pays off."""
+
+    def __init__(self):
+        self.seconds = {"committed": 0.0, "wasted": 0.0}
+        self.requests = {"committed": 0, "discarded": 0, "skipped": 0}
+        self.lock = threading.Lock()
+
+    def record(self, outcome: str, work: Work):
+        seconds = work.seconds()
+        with self.lock:
+            self.seconds[outcome] += seconds
+        metrics.increment("speculative_seconds_total", seconds, work=work.name, outcome=outcome)
+
+    def count(self, outcome: str):
+        with self.lock:
+            self.requests[outcome] += 1
+        metrics.increment("speculation_total", outcome=outcome)
+
+    def wasted_ratio(self) -> float:
+        with self.lock:
+            total = self.seconds["committed"] + self.seconds["wasted"]
+            return self.seconds["wasted"] / total if total else 0.0
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            seconds = {outcome: round(value, 3) for outcome, value in self.seconds.items()}
+            requests = dict(self.requests)
+        return {"requests": requests, "seconds": seconds, "wasted_ratio": round(self.wasted_ratio(), 4)}
+
+
+# Shared by every graph built in this process
+speculation_stats = SpeculationStats()
+
+
+class Speculator:
+    """Runs classification, schema discovery and planning at the same time.
+
+    Planning only needs the question and discovery only the database, so neither waits for the
+    classifier. Once it lands, a database question commits both results; anything else discards them,
+    cancelling the planner's LLM call where it is still running (async) or dropping its answer (sync).
+    Inputs the rule tier already knows are not database questions are classified without speculating,
+    and a plan only reaches the plan cache once it is committed.
+    """
+
+    def __init__(self, classify, aclassify, discover, planner, log_plan, prejudge=None, stats: SpeculationStats = None):
+        self.classify = classify  # state -> state with input_type
+        self.aclassify = aclassify
+        self.discover = discover  # state -> state with db_graph
+        self.planner = planner
+        self.log_plan = log_plan  # Reports a committed plan, as the create_plan node would
+        self.prejudge = prejudge  # state -> label from a cheap tier, or None when it cannot tell
+        self.stats = stats or speculation_stats
+
+    def worthwhile(self, state: dict) -> bool:
+        """False when a cheap tier already rules out a database question"""
+        label = self.prejudge(state) if self.prejudge is not None else None
+        if label is None or label == "DATABASE_QUERY":
+            return True
+        self.stats.count("skipped")
+        annotate(speculation="skipped")
+        return False
+
+    def settle(self, committed: bool, pending: list):
+        """Account for each (work, future) once it finishes, and report the outcome"""
+        outcome = "committed" if committed else "wasted"
+        for work, future in pending:
+            future.add_done_callback(lambda _, work=work: self.stats.record(outcome, work))
+        key = "committed" if committed else "discarded"
+        self.stats.count(key)
+        annotate(speculation=key)
+        logger.info(f"Speculative planning {key}; wasted-work ratio so far {self.stats.wasted_ratio():.2f}")
+
+    def commit(self, state: dict, classified: dict, db_graph, plan: list) -> dict:
+        self.planner.remember_plan(state["question"], plan)
+        self.log_plan(plan)
+        return {**classified, "db_graph": db_graph, "plan": plan}
+
+    def run(self, state: dict) -> dict:
+        if not self.worthwhile(state):
+            return self.classify(state)
+
+        discovery, planning = Work("discover"), Work("plan")
+        pool = speculative_pool()
+        # Copied contexts keep the trace parent and the stream writer on the pool threads
+        discovered = pool.submit(contextvars.copy_context().run, discovery.run, self.discover, state)
+        planned = pool.submit(contextvars.copy_context().run, planning.run, self.planner.create_plan,
+                              state["question"], False)
+        classified = self.classify(state)
+
+        if classified.get("input_type") != "DATABASE_QUERY":
+            planned.cancel()
+            self.settle(False, [(discovery, discovered), (planning, planned)])
+            return classified
+
+        db_graph = discovered.result()["db_graph"]
+        plan = planned.result()
+        self.settle(True, [(discovery, discovered), (planning, planned)])
+        return self.commit(state, classified, db_graph, plan)
+
+    async def arun(self, state: dict) -> dict:
+        if not self.worthwhile(state):
+            return await self.aclassify(state)
+
+        discovery, planning = Work("discover"), Work("plan")
+        discovered = asyncio.ensure_future(asyncio.to_thread(discovery.run, self.discover, state))
+        planned = asyncio.ensure_future(planning.arun(self.planner.acreate_plan, state["question"], False))
+        try:
+            classified = await self.aclassify(state)
+        except BaseException:
+            planned.cancel()
+            raise
+
+        if classified.get("input_type") != "DATABASE_QUERY":
+            # Discovery runs on a thread and only warms the schema cache; it is left to finish
+            planned.cancel()
+            self.settle(False, [(discovery, discovered), (planning, planned)])
+            return classified
+
+        db_graph = (await discovered)["db_graph"]
+        plan = await planned
+        self.settle(True, [(discovery, discovered), (planning, planned)])
+        return self.commit(state, classified, db_graph, plan)
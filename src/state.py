@@ -1,9 +1,9 @@
 import networkx as nx
 from typing_extensions import NotRequired
-from typing import Annotated, TypedDict, List, Optional
+from typing import Annotated, TypedDict, Dict, List, Optional
 
 def db_graph_reducer():
-    # Reducer function for handling database graph updates
+    # Reducer function for handling database graph updates within one run; across runs the graph comes from schema_cache
     def _reducer(previous_value: Optional[nx.Graph], new_value: nx.Graph) -> nx.Graph:
         if previous_value is None:  # If no previous graph exists, use the new graph
             return new_value
@@ -29,5 +29,7 @@ class ConversationState(TypedDict):
     input_type: Annotated[str, classify_input_reducer()]  # Classification of the input type
     plan: Annotated[List[str], plan_reducer()]  # Step-by-step plan to respond to the question
     db_results: NotRequired[str]  # Optional field for database query results
+    step_paths: NotRequired[Dict[str, str]]  # Which path (cache, fast, agent, error) served each inference step
+    step_queries: NotRequired[Dict[str, str]]  # Checked SQL behind each truncated step result
     response: NotRequired[str]  # Optional field for generated response
     db_graph: Annotated[Optional[nx.Graph], db_graph_reducer()] = None  # Optional field for database graph
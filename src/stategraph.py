@@ -1,9 +1,20 @@
+import os
+import time
 import logging
-from langchain_google_genai import ChatGoogleGenerativeAI
 from supervisor_agent import SupervisorAgent
 from state import ConversationState
 from langgraph.graph import StateGraph, START, END
+from langchain_core.runnables import RunnableLambda
 from discovery_agent import DiscoveryAgent
+from schema_introspector import SchemaIntrospector
+from schema_cache import schema_cache
+from column_profiler import profile_in_background
+from tracing import traced_node, start_metrics_server
+from config import get_config
+from llm_scheduler import llm_lane
+from registry import registry
+from input_classifier import InputClassifier
+from speculation import Speculator
 
 logging.basicConfig(
     level=logging.INFO,
@@ -13,11 +24,7 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def classify_user_input(state: ConversationState):
-    """Classifies user input to determine if it requires database access."""
-
-    # Define a system prompt for classifying input into predefined categories
-    system_prompt = """You are an input classifier. Classify the user's input into one of these categories:
+CLASSIFIER_PROMPT = """You are an input classifier. Classify the user's input into one of these categories:
     - DATABASE_QUERY: Questions about data, requiring database access
     - GREETING: General greetings, how are you, etc.
     - CHITCHAT: General conversation not requiring database
@@ -25,22 +32,44 @@ def classify_user_input(state: ConversationState):
 
     Respond with ONLY the category name."""
 
+# Shared across messages so the local model keeps learning from logged LLM decisions
+input_classifier = InputClassifier()
+
+
+def classifier_messages(text: str) -> list:
     # Prepare messages for the LLM, including the system prompt and user's input
-    messages = [
-        ("system", system_prompt),  # Instructions for the LLM
-        ("user", state['question'])  # User's question for classification
+    return [
+        ("system", CLASSIFIER_PROMPT),  # Instructions for the LLM
+        ("user", text)  # User's question for classification
     ]
 
-    # Invoke the LLM with a zero-temperature setting for deterministic output
-    llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash",
-    temperature=0, max_tokens=None, timeout=None,
-    max_retries=2,
+
+def llm_classify(text: str) -> str:
+    """Classify input with the shared LLM client, the last tier of the classifier"""
+    # Invoke the LLM with a zero-temperature setting for deterministic output; the user is waiting on it
+    with llm_lane("interactive"):
+        response = get_config().llm_for("classify").invoke(classifier_messages(text))
+    return response.content.strip()  # Extract the category from the response
+
+
+async def allm_classify(text: str) -> str:
+    """Async variant of llm_classify"""
+    with llm_lane("interactive"):
+        response = await get_config().llm_for("classify").ainvoke(classifier_messages(text))
+    return response.content.strip()
+
+
+def classify_user_input(state: ConversationState):
+    """Classifies user input to determine if it requires database access."""
+
+    # Rules and the local model answer most messages; the LLM is only asked when they are unsure
+    config = get_config()
+    classification = input_classifier.classify(
+        state['question'], llm_classify, db_graph=schema_cache.peek(config.db)
     )
-    response = llm.invoke(messages)
-    classification = response.content.strip()  # Extract the category from the response
 
     # Log the classification result
-    logger.info(f"Input classified as: {classification}")
+    logger.info(f"Input classified as: {classification} (tier hit rates: {input_classifier.hit_rates()})")
 
     # Update the conversation state with the input classification
     return {
@@ -48,16 +77,34 @@ def classify_user_input(state: ConversationState):
         "input_type": classification
     }
 
+
+async def aclassify_user_input(state: ConversationState):
+    """Async variant of classify_user_input used by graph.ainvoke / astream."""
+    config = get_config()
+    classification = await input_classifier.aclassify(
+        state['question'], allm_classify, db_graph=schema_cache.peek(config.db)
+    )
+    logger.info(f"Input classified as: {classification} (tier hit rates: {input_classifier.hit_rates()})")
+    return {
+        **state,
+        "input_type": classification
+    }
+
 def discover_database(state: ConversationState) -> ConversationState:
     # Check if the database graph is already present in the state
     if state.get('db_graph') is None:
-        logger.info("Performing one-time database schema discovery...")
-
-        # Use the DiscoveryAgent to generate the database graph
-        discovery_agent = DiscoveryAgent()
-        graph = discovery_agent.discover()
-
-        logger.info("Database schema discovery complete - this will be reused for future queries")
+        # Each question starts with a fresh state, so reuse the graph cached for this database
+        # The DiscoveryAgent is only built when neither cache tier has a graph for the current schema
+        # After a schema change the previous graph is patched, re-reading only the tables whose DDL changed
+        config = get_config()
+        graph = schema_cache.get_or_build(
+            config.db,
+            lambda: registry.get("discovery_agent", lambda: DiscoveryAgent(config)).discover(),
+            updater=lambda graph: DiscoveryAgent.updateGraph(graph, SchemaIntrospector(config.db))
+        )
+
+        # Column statistics and value dictionaries are filled in without delaying this question
+        profile_in_background(graph, config.read_pool)
 
         # Update the state with the discovered database graph
         return {**state, "db_graph": graph}
@@ -67,33 +114,56 @@ def discover_database(state: ConversationState) -> ConversationState:
 
 def create_graph():
     """Initialize the supervisor agent and state graph builder"""
+    started = time.perf_counter()
     supervisor = SupervisorAgent()
     builder = StateGraph(ConversationState)
 
-    # Add nodes representing processing steps in the flow
-    builder.add_node("classify_input", classify_user_input)  # Classify the user input
-    builder.add_node("discover_database", discover_database)  # Perform database discovery
-    builder.add_node("create_plan", supervisor.create_plan)  # Create a plan based on input
-    builder.add_node("execute_plan", supervisor.execute_plan)  # Execute the generated plan
-    builder.add_node("generate_response", supervisor.generate_response)  # Generate the final response
-
-    # Define the flow of states
-    builder.add_edge(START, "classify_input")  # Start with input classification
-
-    # Conditionally proceed to database discovery or directly to response generation
-    builder.add_conditional_edges(
-        "classify_input",
-        lambda state: "discover_database" if state.get("input_type") == "DATABASE_QUERY" else "generate_response"
-    )
-
-    # Connect discovery to plan creation
-    builder.add_edge("discover_database", "create_plan")
-
-    # Conditionally execute the plan or generate a response if no plan exists
-    builder.add_conditional_edges(
-        "create_plan",
-        lambda x: "execute_plan" if x.get("plan") is not None else "generate_response"
-    )
+    # Add nodes representing processing steps in the flow; nodes with an async variant use it under ainvoke/astream
+    # Every node runs inside a "stage" span named after it
+    def node(name, func, afunc=None):
+        if afunc is None:
+            return traced_node(name, func)
+        return RunnableLambda(traced_node(name, func), afunc=traced_node(name, afunc), name=name)
+
+    builder.add_node("execute_plan", node("execute_plan", supervisor.execute_plan))  # Execute the generated plan
+    builder.add_node("generate_response", node("generate_response", supervisor.generate_response, supervisor.agenerate_response))  # Generate the final response
+
+    if os.getenv("SPECULATIVE_MODE", "0") == "1":
+        # Classify, discover and plan at once; the plan is kept only if the input is a database question
+        # Inputs the rules already recognise as greetings or farewells never start the planner
+        speculator = Speculator(classify_user_input, aclassify_user_input, discover_database,
+                                supervisor.planner_agent, supervisor.log_plan,
+                                prejudge=lambda state: input_classifier.rule_label(
+                                    state['question'], db_graph=schema_cache.peek(get_config().db)))
+        builder.add_node("speculate", node("speculate", speculator.run, speculator.arun))
+        builder.add_edge(START, "speculate")
+        builder.add_conditional_edges(
+            "speculate",
+            lambda state: "execute_plan" if state.get("input_type") == "DATABASE_QUERY" and state.get("plan") is not None
+            else "generate_response"
+        )
+    else:
+        builder.add_node("classify_input", node("classify_input", classify_user_input, aclassify_user_input))  # Classify the user input
+        builder.add_node("discover_database", node("discover_database", discover_database))  # Perform database discovery
+        builder.add_node("create_plan", node("create_plan", supervisor.create_plan, supervisor.acreate_plan))  # Create a plan based on input
+
+        # Define the flow of states
+        builder.add_edge(START, "classify_input")  # Start with input classification
+
+        # Conditionally proceed to database discovery or directly to response generation
+        builder.add_conditional_edges(
+            "classify_input",
+            lambda state: "discover_database" if state.get("input_type") == "DATABASE_QUERY" else "generate_response"
+        )
+
+        # Connect discovery to plan creation
+        builder.add_edge("discover_database", "create_plan")
+
+        # Conditionally execute the plan or generate a response if no plan exists
+        builder.add_conditional_edges(
+            "create_plan",
+            lambda x: "execute_plan" if x.get("plan") is not None else "generate_response"
+        )
 
     # Connect execution to response generation
     builder.add_edge("execute_plan", "generate_response")
@@ -101,5 +171,13 @@ def create_graph():
     # End the process after generating the response
     builder.add_edge("generate_response", END)
 
-    # Compile and return the state graph
-    return builder.compile()
\ No newline at end of file
+    # Compile the state graph
+    compiled = builder.compile()
+
+    # Histograms of every span are scraped from a local Prometheus endpoint, once per process
+    registry.get("metrics_server", start_metrics_server)
+
+    # Report how long startup took and which shared resources dominated it
+    logger.info(f"Graph ready in {(time.perf_counter() - started) * 1000:.1f} ms; "
+                f"shared resource build times (ms): {registry.startup_report()}")
+    return compiled
\ No newline at end of file
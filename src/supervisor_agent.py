@@ -1,8 +1,13 @@
 import logging
-from config import Config
+from config import Config, get_config
+from registry import registry
 from inference_agent import InferenceAgent
 from planning_agent import PlannerAgent
 from discovery_agent import DiscoveryAgent
+from plan_executor import PlanExecutor, StepFailed
+from progress import emit_progress
+from llm_scheduler import llm_lane
+from tracing import span
 from langchain_core.prompts import ChatPromptTemplate
 from state import ConversationState
 
@@ -14,12 +19,13 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 class SupervisorAgent:
-    def __init__(self):
-        # Initialize configuration and agents
-        self.config = Config()
-        self.inference_agent = InferenceAgent()
-        self.planner_agent = PlannerAgent()
-        self.discovery_agent = DiscoveryAgent()
+    def __init__(self, config: Config = None):
+        # Initialize configuration and agents, all sharing one set of clients and one engine
+        self.config = config or get_config()
+        self.inference_agent = InferenceAgent(self.config)
+        self.planner_agent = PlannerAgent(self.config)
+        self.discovery_agent = registry.get("discovery_agent", lambda: DiscoveryAgent(self.config))
+        self.plan_executor = PlanExecutor()
 
         #Prompts for different types of responses
         self.db_response_prompt = ChatPromptTemplate.from_messages([
@@ -28,7 +34,8 @@ class SupervisorAgent:
             Database Results: {db_results}
 
             Rules:
-            1. ALWAYS include ALL results from database queries in your response
+            1. Include all rows shown in the database results; when a result was summarized, report its
+               summary and sample rows and say the full result is available in the table below the answer
             2. Format the response clearly with each piece of information on its own line
             3. Use bullet points or numbers for multiple pieces of information
             4. Only provide the final results summary.
@@ -48,7 +55,24 @@ class SupervisorAgent:
         plan = self.planner_agent.create_plan(
             question = state["question"]
         )
+        self.log_plan(plan)
 
+        return {
+            **state, "plan": plan
+        }
+
+    async def acreate_plan(self, state: ConversationState) -> ConversationState:
+        """Async variant of create_plan"""
+        plan = await self.planner_agent.acreate_plan(
+            question = state["question"]
+        )
+        self.log_plan(plan)
+
+        return {
+            **state, "plan": plan
+        }
+
+    def log_plan(self, plan: list):
         #log the plan, seperating inference and general steps
         logger.info("Generated plan:")
         inference_steps = [step for step in plan if step.startswith('Inference:')]
@@ -61,41 +85,40 @@ class SupervisorAgent:
 
         if general_steps:
             logger.info("General Steps:")
-            for i,step in enumerate(inference_steps, 1):
+            for i,step in enumerate(general_steps, 1):
                 logger.info(f"  {i}. {step}")
 
-        return {
-            **state, "plan": plan
-        }
+        emit_progress("plan", steps=plan)
 
     def execute_plan(self, state: ConversationState) -> ConversationState:
-        # Execute the generated plan step by step
-        results = []
+        # Execute the generated plan, running independent inference steps in parallel
+        step_paths = {}  # Step text -> cache, fast, agent or error
+        step_queries = {}  # Step text -> checked SQL of a truncated result, for paging in the UI
+
+        def run_step(content):
+            with span("execute_plan.step", kind="step", step=content) as step_span:
+                answer, path, sql = self.inference_agent.query_with_path(content, state.get('db_graph'))
+                step_span.set(path=path)
+            step_paths[content] = path
+            if path == "error":
+                raise StepFailed(answer)  # Dependent steps must not run on an error message
+            if sql:
+                step_queries[content] = sql
+            return answer
 
         try:
-            for step in state['plan']:
-                if ':' not in step:
-                    continue
-
-                step_type, content = step.split(':', 1)
-                content = content.strip()
-
-                if step_type.lower().strip() == 'inference':
-                    # Handle inference steps using the InferenceAgent
-                    try:
-                        result = self.inference_agent.query(content, state.get('db_graph'))
-                        results.append(f"Step: {step}\nResult: {result}")
-                    except Exception as e:
-                        logger.error(f"Error in inference step: {str(e)}", exc_info=True)
-                        results.append(f"Step: {step}\nError: Query failed - {str(e)}")
-                else:
-                    # Handle general steps
-                    results.append(f"Step: {step}\nResult: {content}")
+            results = self.plan_executor.run(
+                state['plan'],
+                run_step,
+                on_step_done=lambda index, step, ok: emit_progress("step", index=index, step=step, ok=ok)
+            )
 
             # Return state with results
             return {
                 **state,
-                "db_results": "\n\n".join(results) if results else "No results were generated."
+                "db_results": "\n\n".join(results) if results else "No results were generated.",
+                "step_paths": step_paths,
+                "step_queries": step_queries
             }
 
         except Exception as e:
@@ -105,14 +128,26 @@ class SupervisorAgent:
     def generate_response(self, state:ConversationState) -> ConversationState:
          # Generate the final response based on the input type
         logger.info("Generating final response")
-        is_chat = state.get("input_type") in ["GREETING", "CHITCHAT", "FAREWELL"]
-        prompt = self.chat_response_prompt if is_chat else self.db_response_prompt
 
-        # Invoke the LLM to generate the response
-        response = self.config.llm.invoke(prompt.format(
-            question=state['question'],
-            db_results=state.get('db_results', '')
-        ))
+        # Invoke the LLM to generate the response, ahead of planning and SQL work queued for other users
+        with llm_lane("interactive"):
+            response = self.config.llm_for("response").invoke(self.response_prompt(state))
 
         # Update state with the response and clear the plan
         return {**state, "response": response.content, "plan": []}
+
+    async def agenerate_response(self, state: ConversationState) -> ConversationState:
+        """Async variant of generate_response; tokens reach stream_mode="messages" consumers as they arrive"""
+        logger.info("Generating final response")
+        with llm_lane("interactive"):
+            response = await self.config.llm_for("response").ainvoke(self.response_prompt(state))
+        return {**state, "response": response.content, "plan": []}
+
+    def response_prompt(self, state: ConversationState):
+        """Pick and fill the response prompt for the input type"""
+        is_chat = state.get("input_type") in ["GREETING", "CHITCHAT", "FAREWELL"]
+        prompt = self.chat_response_prompt if is_chat else self.db_response_prompt
+        return prompt.format(
+            question=state['question'],
+            db_results=state.get('db_results', '')
+        )
@@ -0,0 +1,287 @@
+import argparse
+import json
+import logging
+import os
+import resource
+import sqlite3
+import sys
+import time
+import numpy as np
+from schema_introspector import SchemaIntrospector
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+TOPOLOGIES = ("star", "snowflake", "chain")
+
+SUBJECTS = [
+    "customer", "product", "store", "region", "supplier", "employee", "campaign", "channel", "currency", "calendar",
+    "warehouse", "carrier", "account", "contract", "device", "invoice", "order", "payment", "shipment", "ticket",
+    "vendor", "branch", "category", "brand", "promotion", "territory", "department", "project", "asset", "policy",
+    "claim", "partner", "service", "subscription", "session", "event", "lead", "opportunity", "refund", "review",
+]
+
+# (column name, SQL type, value kind); tables take the first N and number the rest
+ATTRIBUTES = [
+    ("name", "TEXT", "label"), ("status", "TEXT", "category"), ("amount", "REAL", "decimal"),
+    ("quantity", "INTEGER", "count"), ("created_at", "TEXT", "date"), ("description", "TEXT", "label"),
+    ("region", "TEXT", "category"), ("price", "REAL", "decimal"), ("score", "INTEGER", "count"),
+    ("code", "TEXT", "category"), ("updated_at", "TEXT", "date"), ("notes", "TEXT", "label"),
+]
+
+CATEGORY_WORDS = [
+    "Active", "Pending", "Closed", "Cancelled", "North", "South", "East", "West", "Gold", "Silver", "Bronze",
+    "Retail", "Online", "Wholesale", "Premium", "Basic", "Standard", "Express", "Domestic", "International",
+    "New", "Returning", "Trial", "Enterprise", "Small", "Medium", "Large", "Urgent", "Normal", "Low",
+]
+
+SYLLABLES = ["ka", "lo", "mi", "ra", "tu", "ven", "sol", "dar", "ni", "po", "qui", "ber", "lan", "zo", "fel", "mar"]
+
+
+class SyntheticDatabaseGenerator:
+    """Builds SQLite databases of a chosen size and foreign-key topology for profiling at scale.
+
+    Rows are generated a batch at a time with numpy and written with executemany inside one transaction,
+    with the journal and fsyncs turned off; indexes are created after the data is loaded.
+    """
+
+    def __init__(self, tables: int = 100, topology: str = "star", columns: int = 8, rows: int = 10000,
+                 dimension_rows: int = None, fanout: int = 8, text_width: int = 24, fk_indexes: bool = True,
+                 batch_size: int = 50000, seed: int = 0):
+        if topology not in TOPOLOGIES:
+            raise ValueError(f"Unknown topology {topology!r}, expected one of {TOPOLOGIES}")
+        self.tables = max(tables, 2)
+        self.topology = topology
+        self.columns = columns  # Attribute columns per table, besides the keys
+        self.rows = rows  # Rows in fact tables (star, snowflake) or in every table (chain)
+        self.dimension_rows = dimension_rows or max(rows // 100, 10)
+        self.fanout = max(fanout, 1)  # Dimensions per fact table, children per snowflake dimension
+        self.text_width = text_width  # Approximate characters in free-text values
+        self.fk_indexes = fk_indexes
+        self.batch_size = batch_size
+        self.seed = seed
+
+    def plan(self) -> list:
+        """Table specs in creation order (parents first): name, rows, parents and attribute columns"""
+        counts = {}  # (prefix, subject) -> tables named after it so far
+
+        def name(prefix, i):
+            subject = SUBJECTS[i % len(SUBJECTS)]
+            counts[(prefix, subject)] = counts.get((prefix, subject), 0) + 1
+            suffix = counts[(prefix, subject)]
+            return f"{prefix}{subject}" + (f"_{suffix}" if suffix > 1 else "")
+
+        if self.topology == "chain":
+            # Each table references the one before it: the longest possible join paths
+            specs = []
+            for i in range(self.tables):
+                specs.append({"tableName": name("", i), "rows": self.rows,
+                              "parents": [specs[-1]["tableName"]] if specs else []})
+        else:
+            facts = max(1, self.tables // (self.fanout + 1))
+            dimensions = [{"tableName": name("dim_", i), "rows": self.dimension_rows, "parents": []}
+                          for i in range(self.tables - facts)]
+            if self.topology == "snowflake":
+                # Dimensions are normalised into a tree: each one references its parent dimension
+                for i, dimension in enumerate(dimensions[1:], start=1):
+                    dimension["parents"] = [dimensions[(i - 1) // self.fanout]["tableName"]]
+
+            # Every fact also references the first dimension, so the schema stays one connected graph
+            specs = list(dimensions)
+            for i in range(facts):
+                own = [dimensions[(i * self.fanout + j) % len(dimensions)]["tableName"]
+                       for j in range(self.fanout)] if dimensions else []
+                parents = list(dict.fromkeys(([dimensions[0]["tableName"]] if dimensions else []) + own))
+                specs.append({"tableName": name("fact_", i), "rows": self.rows, "parents": parents})
+
+        for spec in specs:
+            spec["columns"] = []
+            for i in range(self.columns):
+                column, column_type, kind = ATTRIBUTES[i % len(ATTRIBUTES)]
+                if i >= len(ATTRIBUTES):
+                    column = f"{column}_{i // len(ATTRIBUTES) + 1}"
+                spec["columns"].append((column, column_type, kind))
+        return specs
+
+    @staticmethod
+    def table_ddl(spec: dict) -> str:
+        quote = SchemaIntrospector.quote
+        lines = ['"id" INTEGER PRIMARY KEY']
+        lines += [f'{quote(parent + "_id")} INTEGER NOT NULL REFERENCES {quote(parent)} ("id")'
+                  for parent in spec["parents"]]
+        lines += [f"{quote(column)} {column_type}" for column, column_type, _kind in spec["columns"]]
+        return f"CREATE TABLE {quote(spec['tableName'])} (\n    " + ",\n    ".join(lines) + "\n)"
+
+    def label_pool(self, rng: np.random.Generator, size: int) -> np.ndarray:
+        """Pronounceable proper-noun-like strings about text_width characters long"""
+        # Words of two or three syllables (about 5 characters each), drawn for the whole pool at once
+        words = max(1, round(self.text_width / 6))
+        syllables = rng.integers(0, len(SYLLABLES), (size, words, 3))
+        lengths = rng.integers(2, 4, (size, words))
+        labels = [" ".join("".join(SYLLABLES[s] for s in syllables[i, w, :lengths[i, w]]).capitalize()
+                           for w in range(words))
+                  for i in range(size)]
+        return np.array(labels, dtype=object)
+
+    def column_values(self, rng: np.random.Generator, kind: str, count: int, pools: dict, column: str) -> list:
+        """One batch of values for an attribute column"""
+        if kind in ("label", "category"):
+            values = pools[column][rng.integers(0, len(pools[column]), count)]
+        elif kind == "decimal":
+            values = np.round(rng.gamma(2.0, 50.0, count), 2)
+        elif kind == "count":
+            values = rng.integers(0, 1000, count)
+        else:
+            values = (np.datetime64("2015-01-01") + rng.integers(0, 3650, count)).astype(str)
+        values = values.tolist()
+
+        # A few missing values in optional numeric columns, as real data has
+        if kind in ("decimal", "count"):
+            for i in np.flatnonzero(rng.random(count) < 0.02):
+                values[i] = None
+        return values
+
+    def populate(self, conn: sqlite3.Connection, spec: dict, sizes: dict, rng: np.random.Generator) -> int:
+        """Insert a table's rows in batches; returns the number of rows written"""
+        pools = {}
+        for column, _type, kind in spec["columns"]:
+            if kind == "label":
+                pools[column] = self.label_pool(rng, min(2000, max(spec["rows"] // 2, 1)))
+            elif kind == "category":
+                pools[column] = np.array(list(rng.choice(CATEGORY_WORDS, 8, replace=False)), dtype=object)
+
+        columns = ["id"] + [f"{parent}_id" for parent in spec["parents"]] + [c[0] for c in spec["columns"]]
+        insert = (f"INSERT INTO {SchemaIntrospector.quote(spec['tableName'])} "
+                  f"({', '.join(SchemaIntrospector.quote(c) for c in columns)}) VALUES ({', '.join('?' * len(columns))})")
+        for start in range(0, spec["rows"], self.batch_size):
+            count = min(self.batch_size, spec["rows"] - start)
+            batch = [list(range(start + 1, start + count + 1))]
+            batch += [rng.integers(1, sizes[parent] + 1, count).tolist() for parent in spec["parents"]]
+            batch += [self.column_values(rng, kind, count, pools, column) for column, _type, kind in spec["columns"]]
+            conn.executemany(insert, zip(*batch))
+        return spec["rows"]
+
+    def generate(self, path: str) -> dict:
+        """Write a new database to path and return a summary of what was generated"""
+        started = time.perf_counter()
+        if os.path.exists(path):
+            os.remove(path)
+        specs = self.plan()
+        rng = np.random.default_rng(self.seed)
+        quote = SchemaIntrospector.quote
+
+        conn = sqlite3.connect(path, isolation_level=None)
+        try:
+            # Bulk-load settings: nothing to roll back or recover if the run dies, the file is simply rebuilt
+            conn.execute("PRAGMA journal_mode = OFF")
+            conn.execute("PRAGMA synchronous = OFF")
+            conn.execute("PRAGMA locking_mode = EXCLUSIVE")
+            conn.execute("PRAGMA temp_store = MEMORY")
+            conn.execute(f"PRAGMA cache_size = -{256 * 1024}")
+
+            conn.execute("BEGIN")
+            for spec in specs:
+                conn.execute(self.table_ddl(spec))
+            sizes, total = {}, 0
+            for spec in specs:
+                total += self.populate(conn, spec, sizes, rng)
+                sizes[spec["tableName"]] = spec["rows"]
+            conn.execute("COMMIT")
+
+            # Indexes are cheaper to build once over sorted keys than to maintain during the load
+            if self.fk_indexes:
+                conn.execute("BEGIN")
+                for spec in specs:
+                    for parent in spec["parents"]:
+                        index = f"idx_{spec['tableName']}_{parent}_id"
+                        conn.execute(f"CREATE INDEX {quote(index)} ON {quote(spec['tableName'])} "
+                                     f"({quote(parent + '_id')})")
+                conn.execute("COMMIT")
+            conn.execute("ANALYZE")
+        finally:
+            conn.close()
+
+        elapsed = time.perf_counter() - started
+        summary = {
+            "path": path, "topology": self.topology, "tables": len(specs), "rows": total,
+            "foreignKeys": sum(len(spec["parents"]) for spec in specs),
+            "columns": sum(len(spec["columns"]) + len(spec["parents"]) + 1 for spec in specs),
+            "sizeMb": round(os.path.getsize(path) / (1024 * 1024), 1), "seconds": round(elapsed, 2),
+        }
+        logger.info(f"Generated {summary['tables']} tables with {total:,} rows in {elapsed:.1f} s "
+                    f"({total / elapsed:,.0f} rows/s)")
+        return summary
+
+
+def profile_schema(path: str, questions: int = 50, seed: int = 0) -> dict:
+    """Time schema-graph construction and retrieval over a database, in milliseconds"""
+    from discovery_agent import DiscoveryAgent
+    from schema_index import SchemaIndex
+    from join_paths import JoinPlanner
+
+    timings = {}
+
+    def timed(name, func):
+        started = time.perf_counter()
+        value = func()
+        timings[name] = round((time.perf_counter() - started) * 1000, 3)
+        return value
+
+    data = timed("introspect_ms", SchemaIntrospector(path).introspect)
+    graph = timed("build_graph_ms", lambda: DiscoveryAgent.buildGraph(data))
+    index = timed("schema_index_ms", lambda: SchemaIndex.build(graph))
+    planner = timed("join_planner_ms", lambda: JoinPlanner(graph))
+
+    # Questions naming a random table subject and attribute, like the ones users ask
+    rng = np.random.default_rng(seed)
+    tables = [table["tableName"] for table in data]
+    texts = [f"total {ATTRIBUTES[rng.integers(len(ATTRIBUTES))][0]} per {tables[rng.integers(len(tables))]}"
+             .replace("_", " ") for _ in range(questions)]
+    matches = timed("index_search_total_ms", lambda: [index.search(text) for text in texts])
+    timings["index_search_ms"] = round(timings.pop("index_search_total_ms") / max(questions, 1), 3)
+
+    groups = [[match["name"] for match in found] for found in matches if len(found) > 1]
+    timed("join_tree_total_ms", lambda: [planner.join_tree(group) for group in groups])
+    timings["join_tree_ms"] = round(timings.pop("join_tree_total_ms") / max(len(groups), 1), 3)
+
+    timings.update({
+        "tables": len(tables), "graph_nodes": graph.number_of_nodes(), "graph_edges": graph.number_of_edges(),
+        "index_mb": round((index.table_matrix.nbytes + index.column_matrix.nbytes) / (1024 * 1024), 1),
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                             / (1024 * 1024 if sys.platform == "darwin" else 1024), 1),
+    })
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic SQLite database for profiling at scale")
+    parser.add_argument("path", help="Database file to create (overwritten)")
+    parser.add_argument("--tables", type=int, default=100, help="Number of tables")
+    parser.add_argument("--topology", choices=TOPOLOGIES, default="star", help="Foreign-key layout")
+    parser.add_argument("--columns", type=int, default=8, help="Attribute columns per table")
+    parser.add_argument("--rows", type=int, default=10000, help="Rows per fact table (every table for chain)")
+    parser.add_argument("--dimension-rows", type=int, help="Rows per dimension table (default rows / 100)")
+    parser.add_argument("--fanout", type=int, default=8, help="Dimensions per fact, children per snowflake level")
+    parser.add_argument("--text-width", type=int, default=24, help="Characters per free-text value")
+    parser.add_argument("--fk-indexes", action=argparse.BooleanOptionalAction, default=True,
+                        help="Index every foreign-key column")
+    parser.add_argument("--batch-size", type=int, default=50000, help="Rows per executemany call")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for reproducible data")
+    parser.add_argument("--profile", action="store_true",
+                        help="Also time schema-graph construction and retrieval on the result")
+    args = parser.parse_args()
+
+    generator = SyntheticDatabaseGenerator(
+        tables=args.tables, topology=args.topology, columns=args.columns, rows=args.rows,
+        dimension_rows=args.dimension_rows, fanout=args.fanout, text_width=args.text_width,
+        fk_indexes=args.fk_indexes, batch_size=args.batch_size, seed=args.seed
+    )
+    report = generator.generate(args.path)
+    if args.profile:
+        report["profile"] = profile_schema(args.path, seed=args.seed)
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,308 @@
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from langchain_core.callbacks import BaseCallbackHandler
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+DEFAULT_TRACE_LOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "traces", "spans.jsonl")
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+PREFIX = "ai_db"
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense."""
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class Metrics:
+    """Process-wide histograms and counters, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.definitions = {}  # name -> (type, help, buckets)
+        self.series = {}  # (name, sorted labels) -> Histogram or float
+        self.lock = threading.Lock()
+
+    def define(self, metric: str, kind: str, help_text: str, buckets: tuple = None):
+        self.definitions[f"{PREFIX}_{metric}"] = (kind, help_text, buckets)
+
+    def observe(self, metric: str, value: float, **labels):
+        key = (f"{PREFIX}_{metric}", tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.series.get(key)
+            if histogram is None:
+                histogram = self.series[key] = Histogram(self.definitions[key[0]][2] or DURATION_BUCKETS)
+            histogram.observe(value)
+
+    def increment(self, metric: str, amount: float = 1, **labels):
+        key = (f"{PREFIX}_{metric}", tuple(sorted(labels.items())))
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    @staticmethod
+    def label_text(labels: tuple, extra: str = None) -> str:
+        def escape(value):
+            return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+        parts = [f'{key}="{escape(value)}"' for key, value in labels]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            for name, (kind, help_text, _buckets) in sorted(self.definitions.items()):
+                series = [(labels, value) for (series_name, labels), value in sorted(self.series.items(),
+                          key=lambda item: str(item[0])) if series_name == name]
+                if not series:
+                    continue
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in series:
+                    if kind == "counter":
+                        lines.append(f"{name}{self.label_text(labels)} {value:g}")
+                        continue
+                    for bound, count in zip(value.buckets, value.counts):
+                        bucket_labels = self.label_text(labels, 'le="%g"' % bound)
+                        lines.append(f"{name}_bucket{bucket_labels} {count}")
+                    infinity_labels = self.label_text(labels, 'le="+Inf"')
+                    lines.append(f"{name}_bucket{infinity_labels} {value.count}")
+                    lines.append(f"{name}_sum{self.label_text(labels)} {value.sum:g}")
+                    lines.append(f"{name}_count{self.label_text(labels)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+metrics.define("span_duration_seconds", "histogram", "Wall time of traced spans by kind and name")
+metrics.define("llm_tokens_total", "counter", "LLM tokens by model and direction (input or output)")
+metrics.define("llm_first_token_seconds", "histogram", "Time to the first streamed token by model")
+metrics.define("db_rows", "histogram", "Rows produced by database queries", ROW_BUCKETS)
+metrics.define("cache_events_total", "counter", "Cache lookups by cache and result")
+metrics.define("inference_steps_total", "counter", "Plan steps by the path that answered them")
+
+
+class Span:
+    """One timed operation with attributes, linked to its parent within a trace."""
+
+    def __init__(self, name: str, kind: str, parent: "Span" = None, attributes: dict = None):
+        self.name = name
+        self.kind = kind
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self, error: BaseException = None):
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self.started
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        metrics.observe("span_duration_seconds", self.duration, kind=self.kind, name=self.name)
+        exporter.export(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+            "name": self.name, "kind": self.kind, "start": round(self.started_at, 6),
+            "duration_ms": round(self.duration * 1000, 3), "attributes": self.attributes, "error": self.error,
+        }
+
+
+class TraceExporter:
+    """Appends finished spans to a JSONL file, rotating it when it grows too large."""
+
+    def __init__(self, path: str = None, max_bytes: int = None):
+        self.path = os.getenv("TRACE_LOG", DEFAULT_TRACE_LOG) if path is None else path  # Empty disables
+        self.max_bytes = max_bytes or int(os.getenv("TRACE_LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+        self.lock = threading.Lock()
+
+    def export(self, span: Span):
+        if not self.path:
+            return
+        line = json.dumps(span.to_dict(), default=str) + "\n"
+        with self.lock:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                    os.replace(self.path, self.path + ".1")
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+            except OSError as e:
+                logger.warning(f"Could not write trace span: {e}")
+
+
+exporter = TraceExporter()
+_current = ContextVar("current_span", default=None)
+
+
+def current_span():
+    return _current.get()
+
+
+@contextmanager
+def span(name: str, kind: str = "internal", **attributes):
+    """Time a block as a child of the current span"""
+    parent = _current.get()
+    active = Span(name, kind, parent, attributes)
+    _current.set(active)
+    try:
+        yield active
+    except BaseException as e:
+        active.finish(e)
+        raise
+    finally:
+        # Restored by value rather than token: async generators may resume in another context
+        _current.set(parent)
+        active.finish()
+
+
+def annotate(**attributes):
+    """Add attributes to the current span, if there is one"""
+    active = _current.get()
+    if active is not None:
+        active.set(**attributes)
+
+
+def traced_node(name: str, func):
+    """Wrap a LangGraph node (sync or async) in a "stage" span"""
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_node(state, *args, **kwargs):
+            with span(name, kind="stage"):
+                return await func(state, *args, **kwargs)
+        return async_node
+
+    @functools.wraps(func)
+    def node(state, *args, **kwargs):
+        with span(name, kind="stage"):
+            return func(state, *args, **kwargs)
+    return node
+
+
+class LLMTracer(BaseCallbackHandler):
+    """LangChain callback recording a span, token counts and time to first token for every LLM call."""
+
+    run_inline = True  # Called in the caller's context, so spans attach to the active parent
+
+    def __init__(self):
+        self.spans = {}  # run id -> Span
+
+    def start(self, serialized, run_id, kwargs):
+        params = kwargs.get("invocation_params") or {}
+        model = (kwargs.get("metadata") or {}).get("ls_model_name") or params.get("model") or params.get("model_name") \
+            or (serialized or {}).get("name", "unknown")
+        self.spans[run_id] = Span("llm", "llm", _current.get(), {"model": str(model).replace("models/", "")})
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self.start(serialized, run_id, kwargs)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self.start(serialized, run_id, kwargs)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        active = self.spans.get(run_id)
+        if active is not None and "first_token_ms" not in active.attributes:
+            elapsed = time.perf_counter() - active.started
+            active.set(first_token_ms=round(elapsed * 1000, 3))
+            metrics.observe("llm_first_token_seconds", elapsed, model=active.attributes["model"])
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        active = self.spans.pop(run_id, None)
+        if active is None:
+            return
+        tokens_in, tokens_out = self.token_usage(response)
+        active.set(tokens_in=tokens_in, tokens_out=tokens_out)
+        model = active.attributes["model"]
+        metrics.increment("llm_tokens_total", tokens_in, model=model, direction="input")
+        metrics.increment("llm_tokens_total", tokens_out, model=model, direction="output")
+        active.finish()
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        active = self.spans.pop(run_id, None)
+        if active is not None:
+            active.finish(error)
+
+    @staticmethod
+    def token_usage(response) -> tuple:
+        """(input, output) tokens from message usage metadata or the provider's llm_output"""
+        tokens_in = tokens_out = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                tokens_in += usage.get("input_tokens", 0)
+                tokens_out += usage.get("output_tokens", 0)
+        if not tokens_in and not tokens_out:
+            usage = (response.llm_output or {}).get("token_usage") or {}
+            tokens_in, tokens_out = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+        return tokens_in, tokens_out
+
+
+llm_tracer = LLMTracer()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes every few seconds would flood the log
+
+
+def start_metrics_server(port: int = None, host: str = None):
+    """Serve /metrics on a daemon thread; METRICS_PORT=0 disables it"""
+    port = int(os.getenv("METRICS_PORT", "9464")) if port is None else port
+    if not port:
+        return None
+    host = host or os.getenv("METRICS_HOST", "127.0.0.1")
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        # Usually another worker on this machine already serves the port
+        logger.warning(f"Metrics endpoint not started on {host}:{port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"Serving Prometheus metrics on http://{host}:{port}/metrics")
+    return server
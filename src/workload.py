@@ -0,0 +1,121 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from query_cache import normalize_sql
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "workload", "log.jsonl")
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+# Catalog lookups made by the app itself, e.g. listing tables; they say nothing about which indexes would help
+CATALOG_QUERY = re.compile(r"\b(sqlite_(?:master|schema|temp_master|temp_schema|stat\d)|pragma_\w+)\b", re.IGNORECASE)
+
+
+def query_shape(sql: str) -> str:
+    """Normalized SQL with literals replaced by ?, so queries differing only in values group together"""
+    shape = STRING_LITERAL.sub("?", normalize_sql(sql))
+    return NUMBER_LITERAL.sub("?", shape)
+
+
+class WorkloadRecorder:
+    """Log of executed queries (SQL, latency, rows, plan), aggregated per query shape.
+
+    The log is compacted into one line per shape every compact_every executions, so it stays bounded
+    by the number of shapes (at most max_shapes, the most expensive ones) rather than growing forever.
+    """
+
+    def __init__(self, log_path: str = None, compact_every: int = None, max_shapes: int = None):
+        self.log_path = log_path or os.getenv("WORKLOAD_LOG", DEFAULT_LOG_PATH)
+        self.compact_every = compact_every or int(os.getenv("WORKLOAD_COMPACT_EVERY", "1000"))
+        self.max_shapes = max_shapes or int(os.getenv("WORKLOAD_MAX_SHAPES", "5000"))
+        self.shapes = {}  # query shape -> {"sql", "count", "total_ms", "max_ms", "rows", "plan"}
+        self.appended = 0  # Lines written since the log was last compacted
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """Aggregate previously logged executions and per-shape totals"""
+        try:
+            with open(self.log_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        if "count" in record:
+                            self.merge(record)
+                        else:
+                            self.add(record["sql"], record["ms"], record.get("rows", 0), record.get("plan", []))
+                            self.appended += 1
+                    except (ValueError, KeyError):
+                        continue
+        except FileNotFoundError:
+            return
+        if self.appended >= self.compact_every or len(self.shapes) > self.max_shapes:
+            with self.lock:
+                self.compact()
+
+    def add(self, sql: str, latency_ms: float, rows: int, plan: list):
+        self.merge({"sql": sql, "count": 1, "total_ms": latency_ms, "max_ms": latency_ms, "rows": rows, "plan": plan})
+
+    def merge(self, record: dict):
+        shape = query_shape(record["sql"])
+        entry = self.shapes.get(shape)
+        if entry is None:
+            entry = self.shapes[shape] = {"shape": shape, "sql": record["sql"], "count": 0, "total_ms": 0.0,
+                                          "max_ms": 0.0, "rows": 0, "plan": record.get("plan", [])}
+        entry["count"] += record["count"]
+        entry["total_ms"] += record["total_ms"]
+        entry["max_ms"] = max(entry["max_ms"], record["max_ms"])
+        entry["rows"] = record.get("rows", 0)
+        # Latest concrete instance, used to explain and time the shape
+        entry["sql"], entry["plan"] = record["sql"], record.get("plan", [])
+
+    def record(self, sql: str, latency_ms: float, rows: int, plan: list = None):
+        """Log one execution and fold it into its shape's totals"""
+        sql = normalize_sql(sql)
+        if CATALOG_QUERY.search(sql):
+            return
+        with self.lock:
+            self.add(sql, latency_ms, rows, plan or [])
+            try:
+                os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"sql": sql, "ms": round(latency_ms, 3), "rows": rows, "plan": plan or [],
+                                        "at": round(time.time(), 3)}) + "\n")
+                self.appended += 1
+            except OSError as e:
+                logger.warning(f"Could not log query execution: {e}")
+            if self.appended >= self.compact_every:
+                self.compact()
+
+    def compact(self):
+        """Rewrite the log as one totals line per shape, keeping the max_shapes most expensive ones"""
+        # Caller holds the lock
+        if len(self.shapes) > self.max_shapes:
+            kept = sorted(self.shapes.values(), key=lambda e: e["total_ms"], reverse=True)[:self.max_shapes]
+            self.shapes = {entry["shape"]: entry for entry in kept}
+        temp = f"{self.log_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+            with open(temp, "w", encoding="utf-8") as f:
+                for entry in self.shapes.values():
+                    f.write(json.dumps({key: value for key, value in entry.items() if key != "shape"}) + "\n")
+            os.replace(temp, self.log_path)
+            self.appended = 0
+            logger.info(f"Compacted the workload log to {len(self.shapes)} query shapes")
+        except OSError as e:
+            logger.warning(f"Could not compact the workload log: {e}")
+
+    def queries(self) -> list:
+        """Recorded query shapes, most total time first"""
+        with self.lock:
+            return sorted((dict(entry) for entry in self.shapes.values()), key=lambda e: e["total_ms"], reverse=True)
@@ -0,0 +1,29 @@
+import os
+import sqlite3
+import pytest
+
+# Keep tests from writing trace logs or binding the metrics port; set before any src module is imported
+os.environ.setdefault("TRACE_LOG", "")
+os.environ.setdefault("METRICS_PORT", "0")
+
+
+@pytest.fixture
+def sample_db(tmp_path):
+    """A small music database: artists, albums and tracks with foreign keys and one secondary index"""
+    path = str(tmp_path / "music.db")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE artists (ArtistId INTEGER PRIMARY KEY, Name TEXT);
+        CREATE TABLE albums (AlbumId INTEGER PRIMARY KEY, Title TEXT,
+                             ArtistId INTEGER REFERENCES artists(ArtistId));
+        CREATE TABLE tracks (TrackId INTEGER PRIMARY KEY, Name TEXT, Milliseconds INTEGER,
+                             AlbumId INTEGER REFERENCES albums(AlbumId));
+        CREATE INDEX idx_albums_artist ON albums (ArtistId);
+    """)
+    conn.executemany("INSERT INTO artists VALUES (?, ?)", [(i, f"Artist {i}") for i in range(1, 51)])
+    conn.executemany("INSERT INTO albums VALUES (?, ?, ?)", [(i, f"Album {i}", i % 50 + 1) for i in range(1, 201)])
+    conn.executemany("INSERT INTO tracks VALUES (?, ?, ?, ?)",
+                     [(i, f"Track {i}", 1000 * i, i % 200 + 1) for i in range(1, 2001)])
+    conn.commit()
+    conn.close()
+    return path
@@ -0,0 +1,56 @@
+import threading
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+from connection_pool import PoolClosed, PoolTimeout, ReadOnlyPool
+
+
+def test_a_thread_gets_back_its_last_connection(sample_db):
+    pool = ReadOnlyPool(sample_db, size=2)
+    first = pool.acquire()
+    other = []
+    thread = threading.Thread(target=lambda: other.append(pool.acquire()))
+    thread.start()
+    thread.join(5)
+    pool.release(first)
+    pool.release(other[0])  # Most recently idle, so a thread without affinity would get it
+    assert pool.acquire() is first
+
+
+def test_checkout_times_out_when_every_connection_is_in_use(sample_db):
+    pool = ReadOnlyPool(sample_db, size=1, checkout_timeout=0.1)
+    pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+
+
+def test_sqlalchemy_connections_come_from_the_pool(sample_db):
+    pool = ReadOnlyPool(sample_db, size=2)
+    engine = create_engine("sqlite://", creator=pool.checkout, poolclass=NullPool)
+    counts = []
+
+    def query():
+        with engine.connect() as conn:
+            counts.append(conn.execute(text("SELECT count(*) FROM tracks")).scalar())
+
+    threads = [threading.Thread(target=query) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert counts == [2000] * 8
+    stats = pool.stats()
+    assert stats["open"] <= 2 and stats["idle"] == stats["open"]
+
+
+def test_closed_pool_refuses_checkouts_and_closes_released_connections(sample_db):
+    pool = ReadOnlyPool(sample_db, size=2)
+    held = pool.acquire()
+    pool.release(pool.acquire())
+    pool.close()
+    with pytest.raises(PoolClosed):
+        pool.acquire()
+    pool.release(held)
+    assert pool.stats()["open"] == 0 and pool.stats()["idle"] == 0
+    with pytest.raises(Exception, match="closed"):
+        held.execute("SELECT 1")
@@ -0,0 +1,42 @@
+import sqlite3
+import pytest
+from discovery_agent import DiscoveryAgent
+from join_paths import JoinPlanner, UnreachableTables
+from schema_introspector import SchemaIntrospector
+
+
+def planner_for(db_path):
+    return JoinPlanner(DiscoveryAgent.buildGraph(SchemaIntrospector(db_path).introspect()))
+
+
+def test_join_clauses_follow_foreign_keys(sample_db):
+    clauses = planner_for(sample_db).join_clauses(["tracks", "artists"])
+    assert [clause.split(" ON ")[0] for clause in clauses] == ['FROM "tracks"', 'JOIN "albums"', 'JOIN "artists"']
+    conn = sqlite3.connect(sample_db)
+    assert conn.execute(" ".join(["SELECT count(*)"] + clauses)).fetchone() == (2000,)
+    conn.close()
+
+
+def test_join_clauses_quote_awkward_identifiers(tmp_path):
+    path = str(tmp_path / "orders.db")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE "Order" ("Order ID" INTEGER PRIMARY KEY);
+        CREATE TABLE "Order Details" (Id INTEGER PRIMARY KEY,
+                                      "Order ID" INTEGER REFERENCES "Order"("Order ID"));
+    """)
+    conn.close()
+    clauses = planner_for(path).join_clauses(["Order Details", "Order"])
+    sql = " ".join(["SELECT count(*)"] + clauses)
+    conn = sqlite3.connect(path)
+    assert conn.execute(sql).fetchone() == (0,)
+    conn.close()
+
+
+def test_unconnected_tables_raise(sample_db):
+    conn = sqlite3.connect(sample_db)
+    conn.execute("CREATE TABLE genres (GenreId INTEGER PRIMARY KEY)")
+    conn.close()
+    with pytest.raises(UnreachableTables) as raised:
+        planner_for(sample_db).join_clauses(["tracks", "genres"])
+    assert raised.value.tables == ["genres"]
@@ -0,0 +1,189 @@
+import asyncio
+import threading
+import pytest
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+import llm_scheduler
+from llm_scheduler import LLMOverloaded, LLMScheduler, ScheduledChatModel
+
+
+class FakeTime:
+    """Stands in for the scheduler module's time: a clock that only moves when told to, or on sleep"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def perf_counter(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class StubChatModel(BaseChatModel):
+    """Raises or answers from a script of outcomes, one per call"""
+
+    outcomes: list
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def next_outcome(self):
+        outcome = self.outcomes[min(self.calls, len(self.outcomes) - 1)]
+        self.calls += 1
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.next_outcome()))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        return self._generate(messages, stop, run_manager, **kwargs)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        for piece in self.next_outcome().split():
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+        raise ConnectionError("connection reset mid-stream")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(llm_scheduler, "time", fake)
+    monkeypatch.setattr(llm_scheduler.random, "uniform", lambda low, high: high)  # No jitter
+    return fake
+
+
+def scheduler(**kwargs):
+    settings = {"requests_per_minute": 0, "tokens_per_minute": 0, "concurrency": 8}
+    built = LLMScheduler("test", **{**settings, **kwargs})
+    built.wake_in = lambda delay: None  # The tests redispatch when they move the clock
+    return built
+
+
+def test_request_bucket_holds_calls_until_it_refills(clock):
+    limited = scheduler(requests_per_minute=2)
+    tickets = [limited.enqueue("normal", 10) for _ in range(3)]
+    assert [ticket.state for ticket in tickets] == ["granted", "granted", "waiting"]
+
+    clock.now += 29
+    limited.redispatch()
+    assert tickets[2].state == "waiting"
+    clock.now += 1  # One request every 30 seconds
+    limited.redispatch()
+    assert tickets[2].state == "granted"
+
+
+def test_token_bucket_admits_by_estimated_and_settles_on_real_usage(clock):
+    limited = scheduler(tokens_per_minute=1200)
+    first = limited.enqueue("normal", 800)
+    second = limited.enqueue("normal", 800)
+    assert (first.state, second.state) == ("granted", "waiting")
+
+    # The first call only used 200 of its 800 tokens, which refunds the difference
+    limited.release(first, used_tokens=200)
+    assert second.state == "granted"
+
+
+def test_higher_priority_lanes_are_granted_first(clock):
+    single = scheduler(concurrency=1)
+    running = single.enqueue("normal", 1)
+    waiting = [single.enqueue(lane, 1) for lane in ("background", "normal", "interactive")]
+    assert all(ticket.state == "waiting" for ticket in waiting)
+
+    order = []
+    holder = running
+    for _ in waiting:
+        single.release(holder)
+        holder = next(ticket for ticket in waiting if ticket.state == "granted" and ticket not in order)
+        order.append(holder)
+    assert [ticket.lane for ticket in order] == ["interactive", "normal", "background"]
+
+
+def test_full_queue_sheds_the_least_urgent_waiter(clock):
+    single = scheduler(concurrency=1, max_queue=2)
+    single.enqueue("normal", 1)
+    older, newer = single.enqueue("background", 1), single.enqueue("background", 1)
+
+    urgent = single.enqueue("interactive", 1)
+    assert (older.state, newer.state, urgent.state) == ("waiting", "shed", "waiting")
+    with pytest.raises(LLMOverloaded):
+        single.admitted(newer)
+
+    # Nothing in the queue is less urgent than another background call, so the newcomer is refused
+    with pytest.raises(LLMOverloaded):
+        single.enqueue("background", 1)
+    assert single.stats()["by_lane"] == {"background": 1, "interactive": 1}
+
+
+def test_waiting_past_the_queue_timeout_gives_up_and_leaves_the_queue():
+    single = scheduler(concurrency=1, queue_timeout=0.05)
+    single.enqueue("normal", 1)
+    with pytest.raises(LLMOverloaded, match="Waited over"):
+        single.acquire("normal", 1)
+    assert single.stats()["waiting"] == 0
+
+
+def test_rate_limits_are_retried_with_backoff_and_pause_the_provider(clock):
+    limited = scheduler()
+    stub = StubChatModel(outcomes=[RuntimeError("429 rate limit"), RuntimeError("503 unavailable"), "done"])
+    model = ScheduledChatModel(client=stub, scheduler=limited)
+
+    assert model.invoke("hi").content == "done"
+    assert clock.sleeps == [limited.backoff_base, limited.backoff_base * 2]
+    assert limited.paused_until == 1000.0 + limited.backoff_base
+    assert limited.active == 0
+
+
+def test_other_errors_and_exhausted_retries_are_raised(clock):
+    limited = scheduler()
+    model = ScheduledChatModel(client=StubChatModel(outcomes=[ValueError("bad request")]), scheduler=limited)
+    with pytest.raises(ValueError):
+        model.invoke("hi")
+    assert clock.sleeps == []
+
+    model = ScheduledChatModel(client=StubChatModel(outcomes=[RuntimeError("503 unavailable")]), scheduler=limited)
+    with pytest.raises(RuntimeError):
+        model.invoke("hi")
+    assert len(clock.sleeps) == limited.max_retries
+    assert limited.active == 0
+
+
+def test_a_stream_is_not_retried_once_it_has_produced_tokens(clock):
+    limited = scheduler()
+    stub = StubChatModel(outcomes=["partial answer"])
+    model = ScheduledChatModel(client=stub, scheduler=limited)
+    pieces = []
+    with pytest.raises(ConnectionError):
+        for chunk in model.stream("hi"):
+            pieces.append(chunk.content)
+    assert pieces == ["partial", "answer"]
+    assert stub.calls == 1 and clock.sleeps == []
+    assert limited.active == 0
+
+
+def test_async_calls_queue_and_retry_like_sync_ones():
+    limited = scheduler(concurrency=1)
+    limited.backoff_base = 0.001
+    stub = StubChatModel(outcomes=[RuntimeError("429 rate limit"), "done"])
+    model = ScheduledChatModel(client=stub, scheduler=limited)
+
+    async def run():
+        held = limited.enqueue("normal", 1)
+        call = asyncio.ensure_future(model.ainvoke("hi"))
+        await asyncio.sleep(0.01)
+        assert limited.stats()["waiting"] == 1
+        threading.Thread(target=limited.release, args=(held,)).start()
+        return await asyncio.wait_for(call, 5)
+
+    assert asyncio.run(run()).content == "done"
+    assert stub.calls == 2 and limited.active == 0
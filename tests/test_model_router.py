@@ -0,0 +1,120 @@
+import asyncio
+import time
+import pytest
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from model_router import LatencyStats, RoutedChatModel
+
+MIN_SAMPLES = 20  # LLM_HEDGE_MIN_SAMPLES default
+
+
+class StubChatModel(BaseChatModel):
+    """Answers with its name after a delay, or fails; records calls and cancellations"""
+
+    name: str
+    delay: float = 0.0
+    error: str = ""
+    calls: list = []
+    cancelled: list = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def answer(self):
+        if self.error:
+            raise RuntimeError(self.error)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.name))])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls.append(time.perf_counter())
+        time.sleep(self.delay)
+        return self.answer()
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls.append(time.perf_counter())
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled.append(True)
+            raise
+        return self.answer()
+
+
+def route(primary: StubChatModel, alternate: StubChatModel, stats: LatencyStats) -> RoutedChatModel:
+    return RoutedChatModel(stage="sql", primary="primary", alternate="alternate", stats=stats,
+                           models={"primary": primary, "alternate": alternate})
+
+
+def seeded(seconds: float = 0.01, ok: bool = True) -> LatencyStats:
+    stats = LatencyStats(window=50)
+    for _ in range(MIN_SAMPLES):
+        stats.record("primary", "sql", seconds, ok=ok)
+    return stats
+
+
+def test_percentile_needs_enough_samples():
+    stats = LatencyStats(window=50)
+    for seconds in (0.1, 0.2, 0.3, 0.4):
+        stats.record("m", "s", seconds, ok=True)
+    stats.record("m", "s", 9.0, ok=False)
+    assert stats.percentile("m", "s", 50) == 0.2
+    assert stats.percentile("m", "s", 95) == 0.4  # Failures are not latency samples
+    assert stats.percentile("m", "s", 95, min_samples=5) is None
+    assert stats.error_rate("m", "s") == 0.2
+
+
+def test_no_hedging_before_the_minimum_samples():
+    stats = LatencyStats(window=50)
+    stats.record("primary", "sql", 0.01, ok=True)
+    primary, alternate = StubChatModel(name="primary", delay=0.2), StubChatModel(name="alternate")
+    assert route(primary, alternate, stats).invoke("q").content == "primary"
+    assert alternate.calls == []
+
+
+def test_slow_primary_is_hedged_after_its_p95():
+    primary, alternate = StubChatModel(name="primary", delay=1.0), StubChatModel(name="alternate")
+    started = time.perf_counter()
+    assert route(primary, alternate, seeded()).invoke("q").content == "alternate"
+    assert time.perf_counter() - started < 0.5
+    # The hedge went out once the primary had run past its p95 of 10ms
+    assert 0.005 < alternate.calls[0] - primary.calls[0] < 0.5
+
+
+def test_fast_primary_is_not_hedged():
+    primary, alternate = StubChatModel(name="primary"), StubChatModel(name="alternate")
+    assert route(primary, alternate, seeded(seconds=0.5)).invoke("q").content == "primary"
+    assert alternate.calls == []
+
+
+def test_failed_primary_fails_over():
+    primary, alternate = StubChatModel(name="primary", error="503 unavailable"), StubChatModel(name="alternate")
+    stats = LatencyStats(window=50)
+    assert route(primary, alternate, stats).invoke("q").content == "alternate"
+    assert stats.error_rate("primary", "sql") == 1.0
+
+
+def test_primary_that_keeps_failing_is_demoted():
+    primary, alternate = StubChatModel(name="primary"), StubChatModel(name="alternate")
+    routed = route(primary, alternate, seeded(ok=False))
+    assert routed.order() == ("alternate", "primary")
+    assert routed.invoke("q").content == "alternate"
+    assert primary.calls == []
+
+
+def test_async_hedge_cancels_the_slow_primary():
+    primary, alternate = StubChatModel(name="primary", delay=5.0), StubChatModel(name="alternate")
+    routed = route(primary, alternate, seeded())
+    answer = asyncio.run(asyncio.wait_for(routed.ainvoke("q"), 2))
+    assert answer.content == "alternate"
+    assert primary.cancelled == [True]
+
+
+def test_async_failover_and_demotion():
+    failing, alternate = StubChatModel(name="primary", error="overloaded"), StubChatModel(name="alternate")
+    assert asyncio.run(route(failing, alternate, LatencyStats(window=50)).ainvoke("q")).content == "alternate"
+
+    primary, alternate = StubChatModel(name="primary"), StubChatModel(name="alternate")
+    assert asyncio.run(route(primary, alternate, seeded(ok=False)).ainvoke("q")).content == "alternate"
+    assert primary.calls == []
@@ -0,0 +1,86 @@
+import os
+import sqlite3
+import pytest
+from plan_cache import PlanCache, question_template
+
+
+@pytest.fixture
+def cache(sample_db, tmp_path):
+    return PlanCache(sample_db, cache_dir=str(tmp_path / "plans"))
+
+
+def test_template_abstracts_numbers_quotes_and_proper_nouns():
+    template, literals, kinds = question_template("Show the top 5 albums by Iron Maiden released after '1990'?")
+    assert template == "show the top {0} albums by {1} released after {2}"
+    assert literals == ["5", "Iron Maiden", "1990"]
+    assert kinds == ("num", "text", "text")
+
+
+def test_exact_template_is_reused_with_new_literals(cache):
+    cache.put("Show the top 5 albums by Iron Maiden", ["Inference: top 5 albums of artist Iron Maiden by track count"])
+    assert cache.get("Show the top 3 albums by Led Zeppelin") == [
+        "Inference: top 3 albums of artist Led Zeppelin by track count"]
+    assert cache.stats()["hits"] == 1
+
+
+def test_similar_template_with_the_same_operators_is_reused(cache):
+    cache.put("Show the top 5 artists by total sales", ["Inference: top 5 artists by total sales"])
+    assert cache.get("Can you show me the top 10 artists by total sales please") == [
+        "Inference: top 10 artists by total sales"]
+    assert cache.stats()["similar_hits"] == 1
+
+
+@pytest.mark.parametrize("question", [
+    "Show the bottom 5 artists by total sales",
+    "Show the top 5 artists by average sales",
+    "Show the top 5 artists not by total sales",
+])
+def test_one_decisive_word_is_a_miss(cache, question):
+    cache.put("Show the top 5 artists by total sales", ["Inference: top 5 artists by total sales"])
+    assert cache.get(question) is None
+
+
+def test_literal_the_plan_does_not_repeat_must_match(cache):
+    # The plan bakes in what "Rock" means, so only questions about Rock may reuse it
+    cache.put("How many tracks are Rock", ["Inference: count tracks whose genre id is 1"])
+    assert cache.get("How many tracks are Rock") is not None
+    assert cache.get("How many tracks are Jazz") is None
+
+
+def test_literal_kinds_must_match(cache):
+    cache.put("Show albums by Queen", ["Inference: albums by Queen"])
+    assert cache.get("Show albums by 1990") is None
+
+
+def test_schema_change_invalidates_entries(cache, sample_db):
+    cache.put("Show the top 5 artists by total sales", ["Inference: top 5 artists by total sales"])
+    conn = sqlite3.connect(sample_db)
+    conn.execute("CREATE TABLE genres (GenreId INTEGER PRIMARY KEY)")
+    conn.commit()
+    conn.close()
+    assert cache.get("Show the top 5 artists by total sales") is None
+
+
+def test_entries_persist_across_instances(cache, sample_db):
+    cache.put("Show the top 5 artists by total sales", ["Inference: top 5 artists by total sales"])
+    reopened = PlanCache(sample_db, cache_dir=os.path.dirname(cache.path))
+    assert reopened.get("Show the top 7 artists by total sales") == ["Inference: top 7 artists by total sales"]
+
+
+def test_least_recently_used_entries_are_evicted(sample_db, tmp_path):
+    cache = PlanCache(sample_db, cache_dir=str(tmp_path / "plans"), max_entries=2)
+    cache.put("List albums", ["Inference: list albums"])
+    cache.put("List artists", ["Inference: list artists"])
+    cache.get("List albums")
+    cache.put("List tracks", ["Inference: list tracks"])
+    assert cache.get("List artists") is None
+    assert cache.get("List albums") == ["Inference: list albums"]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entity_swap_in_a_long_question_is_a_miss(cache):
+    question = ("list the track name, album title, artist name, genre name, media type name, composer, "
+                "milliseconds and unit price of every track in the playlist with the highest number of tracks")
+    cache.put(question, ["Inference: track, album, artist, genre and media type columns of the largest playlist"])
+    assert cache.get(question.replace("genre name", "customer name")) is None
+    assert cache.stats()["similar_hits"] == 0
@@ -0,0 +1,95 @@
+import threading
+import time
+from plan_executor import PlanExecutor, StepFailed, build_step_dag
+
+
+def test_dag_from_explicit_and_implicit_dependencies():
+    steps = [
+        "Inference: count tracks per album",
+        "Inference: list artists",
+        "Inference: names of those albums' artists (after step 1)",
+        "General: summarise",
+        "Inference: compare the previous results",
+    ]
+    assert build_step_dag(steps) == {0: set(), 1: set(), 2: {0}, 4: {0, 1, 2}}
+
+
+def test_independent_steps_run_concurrently_and_keep_plan_order():
+    executor = PlanExecutor(max_workers=3, step_timeout=5)
+
+    def run(content):
+        time.sleep(0.2)
+        return content.upper()
+
+    started = time.monotonic()
+    results = executor.run(["Inference: a", "General: hello", "Inference: b", "Inference: c"], run)
+    assert time.monotonic() - started < 0.5
+    assert results == ["Step: Inference: a\nResult: A", "Step: General: hello\nResult: hello",
+                       "Step: Inference: b\nResult: B", "Step: Inference: c\nResult: C"]
+
+
+def test_dependent_step_starts_after_its_dependency():
+    executor = PlanExecutor(max_workers=4, step_timeout=5)
+    finished = {}
+
+    def run(content):
+        if content == "first":
+            time.sleep(0.1)
+        finished[content] = time.monotonic()
+        return "first done" if content == "first" else f"saw {sorted(finished)}"
+
+    results = executor.run(["Inference: first", "Inference: second (after step 1)"], run)
+    assert results[1] == "Step: Inference: second (after step 1)\nResult: saw ['first', 'second']"
+    assert finished["first"] <= finished["second"]
+
+
+def test_failed_step_cancels_its_dependents():
+    executor = PlanExecutor(max_workers=2, step_timeout=5)
+    events = []
+
+    def run(content):
+        if content == "broken":
+            raise StepFailed("Error processing query: no such table")
+        return content
+
+    results = executor.run(
+        ["Inference: broken", "Inference: uses it (after step 1)", "Inference: unrelated"],
+        run,
+        on_step_done=lambda index, step, ok: events.append((index, ok)),
+    )
+    assert results[0] == "Step: Inference: broken\nError: Query failed - Error processing query: no such table"
+    assert "Cancelled because a step it depends on did not complete" in results[1]
+    assert results[2] == "Step: Inference: unrelated\nResult: unrelated"
+    assert sorted(events) == [(0, False), (1, False), (2, True)]
+
+
+def test_queued_steps_are_timed_from_when_they_start():
+    # With one worker the third step waits 0.4s in line, longer than its 0.3s timeout
+    executor = PlanExecutor(max_workers=1, step_timeout=0.3)
+
+    def run(content):
+        time.sleep(0.2)
+        return content
+
+    results = executor.run(["Inference: a", "Inference: b", "Inference: c"], run)
+    assert all("Result:" in result for result in results), results
+
+
+def test_timed_out_step_does_not_hold_up_the_rest():
+    executor = PlanExecutor(max_workers=1, step_timeout=0.2)
+    release = threading.Event()
+
+    def run(content):
+        if content == "stuck":
+            release.wait(5)
+        return content
+
+    started = time.monotonic()
+    try:
+        results = executor.run(["Inference: stuck", "Inference: quick", "Inference: after it (after step 1)"], run)
+    finally:
+        release.set()
+    assert time.monotonic() - started < 1.0
+    assert results[0].startswith("Step: Inference: stuck\nError: Query timed out")
+    assert results[1] == "Step: Inference: quick\nResult: quick"
+    assert "Cancelled because a step it depends on did not complete" in results[2]
@@ -0,0 +1,76 @@
+import sqlite3
+import pytest
+from connection_pool import ReadOnlyPool
+from query_guard import QueryGuard
+
+
+@pytest.fixture
+def guard(sample_db):
+    return QueryGuard(ReadOnlyPool(sample_db, size=2), max_cost=100_000, row_limit=10)
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT Name FROM artists WHERE ArtistId = 1",
+    "SELECT Name FROM artists WHERE Name = 'a;b'",
+    "SELECT * FROM artists;",
+    "SELECT Name FROM artists -- trailing comment",
+    "WITH a AS (SELECT * FROM artists) SELECT COUNT(*) FROM a",
+])
+def test_accepts_single_read_only_statements(guard, sql):
+    verdict = guard.check(sql)
+    assert verdict.action == "run", verdict.reason
+
+
+@pytest.mark.parametrize("sql, reason", [
+    ("", "empty query"),
+    ("SELECT 1; DROP TABLE artists", "single statement"),
+    ("SELECT 1; SELECT 2", "single statement"),
+    ("DELETE FROM artists", "only SELECT"),
+    ("PRAGMA table_info(artists)", "only SELECT"),
+    ("SELECT (1", "incomplete"),
+])
+def test_rejects_writes_and_multiple_statements(guard, sql, reason):
+    verdict = guard.check(sql)
+    assert verdict.rejected
+    assert reason in verdict.reason
+
+
+def test_rejects_writes_behind_a_with_clause(guard):
+    # The authorizer denies anything but reads, even when the text starts like a query
+    verdict = guard.check("WITH doomed AS (SELECT 1) DELETE FROM artists")
+    assert verdict.rejected
+
+
+def test_rewrites_expensive_streaming_query_with_limit(sample_db):
+    guard = QueryGuard(ReadOnlyPool(sample_db, size=2), max_cost=100, row_limit=10)
+    verdict = guard.check("SELECT * FROM tracks -- every row")
+    assert verdict.action == "rewrite"
+    assert verdict.sql.endswith("LIMIT 10")
+
+    # The rewritten statement still runs: the comment cannot swallow the closing parenthesis
+    conn = sqlite3.connect(sample_db)
+    assert len(conn.execute(verdict.sql).fetchall()) == 10
+    conn.close()
+
+
+def test_rejects_expensive_sorted_query_with_plan_feedback(sample_db):
+    guard = QueryGuard(ReadOnlyPool(sample_db, size=2), max_cost=100)
+    verdict = guard.check("SELECT * FROM tracks ORDER BY Name")
+    assert verdict.rejected
+    assert "exceeds the limit" in verdict.reason
+    feedback = verdict.feedback()
+    assert "Query plan:" in feedback and "SCAN tracks" in feedback
+
+
+def test_cheap_query_over_limit_with_explicit_limit_runs(sample_db):
+    guard = QueryGuard(ReadOnlyPool(sample_db, size=2), max_cost=100)
+    assert guard.check("SELECT * FROM tracks LIMIT 5").action == "run"
+
+
+def test_row_estimates_refresh_when_data_version_moves(guard):
+    guard.observe((1, 0, 0))
+    assert guard.rows("tracks") == 2000
+    guard.observe((1, 0, 0))
+    assert guard.row_counts == {"tracks": 2000}
+    guard.observe((2, 0, 0))
+    assert guard.row_counts == {}
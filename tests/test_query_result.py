@@ -0,0 +1,83 @@
+import pytest
+from connection_pool import ReadOnlyPool
+from query_result import PagerRegistry, ResultPager, ResultSummary, execute
+
+
+@pytest.fixture
+def pool(sample_db):
+    pool = ReadOnlyPool(sample_db, size=2)
+    yield pool
+    pool.close()
+
+
+def test_summary_tracks_counts_nulls_and_extremes():
+    summary = ResultSummary(["id", "name"])
+    for row in [(3, "c"), (1, None), (2, "a"), (None, "b")]:
+        summary.add(row)
+    assert summary.row_count == 4
+    assert summary.nulls == [1, 1]
+    assert (summary.minimum, summary.maximum) == ([1, "a"], [3, "c"])
+
+
+def test_summary_tolerates_mixed_types_in_one_column():
+    summary = ResultSummary(["value"])
+    for value in (1, "one", 2.5):
+        summary.add((value,))
+    assert summary.row_count == 3 and summary.counters[0]["one"] == 1
+
+
+def test_reservoir_is_bounded_and_samples_the_whole_stream():
+    summary = ResultSummary(["value"], reservoir_size=100)
+    for value in range(10000):
+        summary.add((value,))
+    reservoir = summary.reservoirs[0]
+    assert len(reservoir) == 100 and summary.numeric_seen[0] == 10000
+    assert max(reservoir) > 5000  # Later rows replaced early ones, not only the first 100 kept
+    assert sum(count for _, _, count in summary.histogram(0)) == 100
+
+
+def test_counters_stay_bounded_and_keep_heavy_hitters():
+    summary = ResultSummary(["value"], counter_capacity=50)
+    for value in range(1000):
+        summary.add((f"rare {value}",))
+        if value % 10 == 0:
+            summary.add(("common",))
+    counter = summary.counters[0]
+    assert len(counter) <= 50
+    assert counter.most_common(1)[0][0] == "common"
+
+
+def test_large_results_keep_a_sample_and_a_summary(pool):
+    result = execute(pool, "SELECT * FROM tracks", inline_rows=100, sample_rows=10)
+    assert len(result) == 10 and result.truncated
+    assert result.summary.row_count == 2000
+    assert "2000 rows" in result.to_prompt()
+
+    capped = execute(pool, "SELECT * FROM tracks", inline_rows=100, sample_rows=10, scan_cap=500)
+    assert capped.summary.capped and capped.summary.row_count == 500
+
+    small = execute(pool, "SELECT * FROM artists")
+    assert len(small) == 50 and not small.truncated and small.summary is None
+
+
+def test_pager_reads_pages_until_exhausted(pool):
+    pager = ResultPager(pool, "SELECT AlbumId FROM albums ORDER BY AlbumId", page_size=80)
+    pages = [pager.next_page() for _ in range(3)]
+    assert [len(page) for page in pages] == [80, 80, 40]
+    assert pages[1].arrays[0][0] == 81
+    assert pager.exhausted and pager.last is pages[2]
+    assert len(pager.next_page()) == 0
+    assert pool.stats()["open"] == 0  # Pagers use their own connection, not a pool slot
+
+
+def test_registry_expires_idle_pagers_and_caps_open_ones(pool):
+    registry = PagerRegistry(ttl=60, max_open=2)
+    first, second = registry.open(pool, "SELECT 1"), registry.open(pool, "SELECT 2")
+    registry.get(first).touched += 1  # Used more recently than the second
+    third = registry.open(pool, "SELECT 3")
+    assert registry.get(second) is None
+    assert registry.get(first) is not None and registry.get(third) is not None
+
+    registry.ttl = -1
+    assert registry.get(first) is None and registry.pagers == {}
+    assert registry.get(None) is None
@@ -0,0 +1,131 @@
+import functools
+import os
+import sqlite3
+import networkx as nx
+import pytest
+from discovery_agent import DiscoveryAgent
+from schema_cache import SchemaCache, database_fingerprint
+from schema_introspector import SchemaIntrospector
+
+
+def execute(db_path, sql):
+    conn = sqlite3.connect(db_path)
+    conn.executescript(sql)
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SchemaCache(str(tmp_path / "cache"))
+
+
+def discovery(db_path):
+    introspector = SchemaIntrospector(db_path)
+    builds = []
+
+    def builder():
+        builds.append(1)
+        return DiscoveryAgent.buildGraph(introspector.introspect())
+
+    return builder, (lambda graph: DiscoveryAgent.updateGraph(graph, introspector)), builds
+
+
+def graph_files(cache):
+    return sorted(name for name in os.listdir(cache.cache_dir) if name.endswith(".json"))
+
+
+def test_fingerprint_ignores_data_writes_but_follows_ddl(sample_db):
+    before = database_fingerprint(sample_db)
+    execute(sample_db, "INSERT INTO artists (Name) VALUES ('New Artist')")
+    assert database_fingerprint(sample_db) == before
+
+    execute(sample_db, "CREATE INDEX idx_tracks_name ON tracks (Name)")
+    assert database_fingerprint(sample_db) != before
+
+
+def test_fingerprint_differs_between_databases_with_the_same_schema(sample_db, tmp_path):
+    copy = str(tmp_path / "copy.db")
+    source, target = sqlite3.connect(sample_db), sqlite3.connect(copy)
+    source.backup(target)
+    source.close()
+    target.close()
+    assert database_fingerprint(copy) != database_fingerprint(sample_db)
+
+
+def test_graph_is_built_once_then_served_from_memory_and_disk(cache, sample_db):
+    builder, updater, builds = discovery(sample_db)
+    graph = cache.get_or_build(sample_db, builder, updater)
+    assert cache.get_or_build(sample_db, builder, updater) is graph
+    execute(sample_db, "INSERT INTO artists (Name) VALUES ('New Artist')")
+    assert cache.get_or_build(sample_db, builder, updater) is graph
+
+    # Another process with the same cache directory loads the stored graph instead of discovering
+    other = SchemaCache(cache.cache_dir)
+    loaded = other.get_or_build(sample_db, builder, updater)
+    assert len(builds) == 1
+    assert other.hits["disk"] == 1
+    assert nx.utils.graphs_equal(loaded, graph)
+
+
+def test_schema_change_patches_a_copy_and_notifies_listeners(cache, sample_db):
+    builder, updater, builds = discovery(sample_db)
+    notified = []
+    cache.subscribe(lambda previous, graph, changes: notified.append((previous, graph, changes)))
+    previous = cache.get_or_build(sample_db, builder, updater)
+
+    execute(sample_db, """
+        CREATE TABLE genres (GenreId INTEGER PRIMARY KEY, Name TEXT);
+        ALTER TABLE tracks ADD COLUMN GenreId INTEGER REFERENCES genres(GenreId);
+    """)
+    graph = cache.get_or_build(sample_db, builder, updater)
+
+    assert len(builds) == 1 and cache.hits["update"] == 1
+    assert notified == [(previous, graph, {"added": ["genres"], "removed": [], "changed": ["tracks"]})]
+    # Readers of the previous graph keep a consistent view
+    assert "genres" not in previous and "tracks.GenreId" not in previous
+    assert graph.has_edge("tracks.GenreId", "genres.GenreId")
+
+    # The patched graph matches a full rebuild
+    rebuilt = DiscoveryAgent.buildGraph(SchemaIntrospector(sample_db).introspect())
+    assert set(graph.nodes) == set(rebuilt.nodes)
+    assert {frozenset(edge) for edge in graph.edges} == {frozenset(edge) for edge in rebuilt.edges}
+
+
+def test_superseded_graph_files_are_pruned(cache, sample_db):
+    builder, updater, _ = discovery(sample_db)
+    first = cache.get_or_build(sample_db, builder, updater)
+    execute(sample_db, "CREATE TABLE notes (NoteId INTEGER PRIMARY KEY)")
+    second = cache.get_or_build(sample_db, builder, updater)
+
+    assert graph_files(cache) == [f"{second.graph['fingerprint']}.json"]
+    assert cache.load(first.graph["fingerprint"]) is None
+    assert cache.load_latest(sample_db).graph["fingerprint"] == second.graph["fingerprint"]
+
+
+def test_publish_only_replaces_the_current_graph(cache, sample_db):
+    builder, updater, _ = discovery(sample_db)
+    graph = cache.get_or_build(sample_db, builder, updater)
+
+    enriched = graph.copy()
+    enriched.graph["profiled"] = True
+    assert cache.publish(sample_db, enriched)
+    assert cache.peek(sample_db) is enriched
+    assert cache.load(graph.graph["fingerprint"]).graph["profiled"] is True
+
+    execute(sample_db, "CREATE TABLE notes (NoteId INTEGER PRIMARY KEY)")
+    cache.get_or_build(sample_db, builder, updater)
+    assert not cache.publish(sample_db, enriched)
+
+
+def test_failing_listener_without_a_name_is_logged_and_skipped(cache, caplog):
+    seen = []
+
+    def failing(tag, previous, graph, changes):
+        raise RuntimeError(f"{tag} broke")
+
+    cache.subscribe(functools.partial(failing, "partial"))
+    cache.subscribe(lambda previous, graph, changes: seen.append(changes))
+    cache.notify(nx.Graph(), nx.Graph(), {"added": ["t"]})
+    assert seen == [{"added": ["t"]}]
+    assert "partial broke" in caplog.text
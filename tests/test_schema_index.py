@@ -0,0 +1,36 @@
+import json
+import os
+from discovery_agent import DiscoveryAgent
+from schema_index import SchemaIndex, load_synonyms
+from schema_introspector import SchemaIntrospector
+
+CHINOOK_SYNONYMS = os.path.join(os.path.dirname(__file__), os.pardir, "src", "data", "chinook_synonyms.json")
+
+
+def index_for(db_path):
+    return SchemaIndex.build(DiscoveryAgent.buildGraph(SchemaIntrospector(db_path).introspect()))
+
+
+def test_only_generic_synonyms_are_built_in(monkeypatch):
+    monkeypatch.delenv("SCHEMA_SYNONYMS", raising=False)
+    synonyms = load_synonyms()
+    assert "client" in synonyms["customer"]
+    assert "track" not in synonyms and "artist" not in synonyms
+
+
+def test_synonym_file_extends_the_defaults(monkeypatch, tmp_path):
+    path = tmp_path / "synonyms.json"
+    path.write_text(json.dumps({"Artists": ["band"], "customer": ["patron"]}))
+    monkeypatch.setenv("SCHEMA_SYNONYMS", str(path))
+    synonyms = load_synonyms()
+    assert synonyms["artist"] == ["band"]
+    assert {"client", "patron"} <= set(synonyms["customer"])
+
+
+def test_database_specific_words_need_the_synonym_file(monkeypatch, sample_db):
+    monkeypatch.delenv("SCHEMA_SYNONYMS", raising=False)
+    assert index_for(sample_db).search("which band has the most songs") == []
+
+    monkeypatch.setenv("SCHEMA_SYNONYMS", CHINOOK_SYNONYMS)
+    names = [table["name"] for table in index_for(sample_db).search("which band has the most songs")]
+    assert {"artists", "tracks"} <= set(names)
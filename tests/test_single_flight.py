@@ -0,0 +1,136 @@
+import asyncio
+import threading
+import time
+import pytest
+from single_flight import SingleFlight, SingleFlightTimeout
+
+
+def run_threads(count, target):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+
+def test_concurrent_callers_share_one_computation():
+    flight = SingleFlight("test")
+    calls, results = [], []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return "answer"
+
+    run_threads(8, lambda: results.append(flight.do("key", compute)))
+    assert len(calls) == 1
+    assert results == ["answer"] * 8
+    assert flight.calls == {}
+
+
+def test_different_keys_do_not_coalesce():
+    flight = SingleFlight("test")
+    calls = []
+    run_threads(2, lambda: flight.do(threading.get_ident(), lambda: calls.append(1)))
+    assert len(calls) == 2
+
+
+def test_error_reaches_every_waiter():
+    flight = SingleFlight("test")
+    errors = []
+
+    def compute():
+        time.sleep(0.2)
+        raise ValueError("boom")
+
+    def call():
+        try:
+            flight.do("key", compute)
+        except ValueError as e:
+            errors.append(e)
+
+    run_threads(4, call)
+    assert len(errors) == 4 and len({id(e) for e in errors}) == 1
+
+
+def test_waiter_gives_up_after_its_timeout():
+    flight = SingleFlight("test", timeout=0.1)
+    release = threading.Event()
+    leader = threading.Thread(target=lambda: flight.do("key", lambda: release.wait(5)))
+    leader.start()
+    time.sleep(0.05)
+    try:
+        with pytest.raises(SingleFlightTimeout):
+            flight.do("key", lambda: "not run")
+    finally:
+        release.set()
+        leader.join(5)
+
+
+def test_later_calls_start_a_fresh_computation():
+    flight = SingleFlight("test")
+    assert flight.do("key", lambda: 1) == 1
+    assert flight.do("key", lambda: 2) == 2
+
+
+def test_stream_is_shared_and_replayed_to_late_subscribers():
+    flight = SingleFlight("test")
+    started = []
+
+    async def source():
+        started.append(1)
+        for i in range(3):
+            await asyncio.sleep(0.05)
+            yield i
+
+    async def collect(delay):
+        await asyncio.sleep(delay)
+        return [event async for event in flight.astream("key", source)]
+
+    async def main():
+        return await asyncio.gather(collect(0), collect(0.08))
+
+    assert asyncio.run(main()) == [[0, 1, 2], [0, 1, 2]]
+    assert len(started) == 1
+
+
+def test_stream_error_reaches_subscribers():
+    flight = SingleFlight("test")
+
+    async def source():
+        yield "first"
+        raise RuntimeError("stream failed")
+
+    async def main():
+        events = []
+        with pytest.raises(RuntimeError, match="stream failed"):
+            async for event in flight.astream("key", source):
+                events.append(event)
+        return events
+
+    assert asyncio.run(main()) == ["first"]
+
+
+def test_stream_is_cancelled_once_every_subscriber_leaves():
+    flight = SingleFlight("test")
+
+    async def main():
+        state = {"cancelled": False}
+
+        async def source():
+            try:
+                for i in range(100):
+                    await asyncio.sleep(0.01)
+                    yield i
+            except asyncio.CancelledError:
+                state["cancelled"] = True
+                raise
+
+        stream = flight.astream("key", source)
+        assert await stream.__anext__() == 0
+        await stream.aclose()
+        await asyncio.sleep(0.05)
+        return state["cancelled"]
+
+    assert asyncio.run(main())
+    assert flight.streams == {}